@@ -8,7 +8,9 @@ import logging
 from flask import Flask
 from flask_cors import CORS
 
-from .shared.database import db_init_paths, fechar_ligacoes, inicializar_catalogo
+from .shared.database import db_init_paths, fechar_ligacoes
+from .shared.instrumentation import init_instrumentacao
+from .shared.migrations import migrar_bases_partilhadas, migrar_todos_tenants
 from .shared.config import Config
 from .shared.modules import ModuleRegistry
 from .shared.plans import PlanService
@@ -25,6 +27,11 @@ def create_app(config_class=Config):
     app = Flask(__name__, static_folder=static_folder, static_url_path='')
     app.config.from_object(config_class)
 
+    # Signed tokens are verified by every worker: the random per-process
+    # fallback key would reject tokens issued by the other workers
+    if app.config.get('AUTH_TOKEN_MODE') == 'signed' and not os.environ.get('SECRET_KEY'):
+        raise RuntimeError("AUTH_TOKEN_MODE=signed requires SECRET_KEY to be set in the environment")
+
     # Configure logging
     logging.basicConfig(
         level=logging.INFO,
@@ -34,8 +41,14 @@ def create_app(config_class=Config):
     # Initialize paths
     db_init_paths(app.config['BASE_PATH'])
 
-    # Initialize catalog database (shared across all tenants)
-    inicializar_catalogo()
+    # Schema migrations of the shared databases (catalog and global
+    # directory). Tenant databases are migrated once per deploy by
+    # `scripts/maintenance.py migrate` before the workers start; only
+    # single-process setups turn on SCHEMA_AUTO_MIGRATE to do it here.
+    with app.app_context():
+        migrar_bases_partilhadas()
+        if app.config.get('SCHEMA_AUTO_MIGRATE', False):
+            migrar_todos_tenants(app)
 
     # Initialize plan service
     PlanService.init(app.config['BASE_PATH'])
@@ -53,6 +66,9 @@ def create_app(config_class=Config):
     # Register teardown
     app.teardown_appcontext(fechar_ligacoes)
 
+    # Per-request query metrics (Server-Timing header, slow/N+1 logging)
+    init_instrumentacao(app)
+
     # Register core blueprints (always active)
     from .core.auth.routes import auth_bp
     from .core.tenants.routes import tenants_bp
@@ -8,11 +8,17 @@ import string
 import logging
 from datetime import datetime, timedelta
 
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, current_app
 
 from ...shared.database import obter_bd, carregar_tenants, MASTER_TENANT_ID
 from ...shared.security import hash_password, verify_password, generate_token
-from ...shared.permissions import requer_autenticacao, identificar_tenant_por_email
+from ...shared.permissions import (
+    requer_autenticacao, identificar_tenant_por_email, emitir_token_assinado
+)
+from ...shared.directory import (
+    registar_sessao, invalidar_sessao, invalidar_sessoes_utilizador,
+    sincronizar_utilizadores_tenant, revogar_token
+)
 from ...shared.email_service import enviar_email_2fa, enviar_sms_2fa, enviar_email_reset_password
 from ...shared.config import Config
 from ...shared.error_codes import ErrorCode, error_response
@@ -22,6 +28,29 @@ logger = logging.getLogger(__name__)
 auth_bp = Blueprint('auth', __name__)
 
 
+def _criar_sessao(bd, tenant_id, user):
+    """Issue the access token of a successful login (not committed).
+
+    AUTH_TOKEN_MODE 'signed' issues a stateless signed token; otherwise an
+    opaque token backed by a sessions row.
+    """
+    if current_app.config.get('AUTH_TOKEN_MODE') == 'signed':
+        token, _ = emitir_token_assinado(tenant_id, user['id'], user['role'], user['email'],
+                                         Config.TOKEN_EXPIRATION_HOURS)
+        return token, None
+
+    token = generate_token()
+    expires = datetime.now() + timedelta(hours=Config.TOKEN_EXPIRATION_HOURS)
+    bd.execute('''
+        INSERT INTO sessions (user_id, token, expires_at, ip_address, user_agent)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (
+        user['id'], token, expires.isoformat(),
+        request.remote_addr, request.headers.get('User-Agent', '')[:255]
+    ))
+    return token, expires.isoformat()
+
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     """User login endpoint."""
@@ -112,21 +141,14 @@ def login():
         }), 200
 
     # Create session
-    token = generate_token()
-    expires = datetime.now() + timedelta(hours=Config.TOKEN_EXPIRATION_HOURS)
-
-    bd.execute('''
-        INSERT INTO sessions (user_id, token, expires_at, ip_address, user_agent)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        user['id'], token, expires.isoformat(),
-        request.remote_addr, request.headers.get('User-Agent', '')[:255]
-    ))
+    token, expires = _criar_sessao(bd, tenant_id, user)
 
     # Update last login
     bd.execute('UPDATE users SET last_login = ? WHERE id = ?',
                (datetime.now().isoformat(), user['id']))
     bd.commit()
+    if expires:
+        registar_sessao(token, tenant_id, user['id'], expires)
 
     return jsonify({
         'token': token,
@@ -193,20 +215,13 @@ def verify_2fa():
     ''', (user_id,)).fetchone()
 
     # Create session
-    token = generate_token()
-    expires = datetime.now() + timedelta(hours=Config.TOKEN_EXPIRATION_HOURS)
-
-    bd.execute('''
-        INSERT INTO sessions (user_id, token, expires_at, ip_address, user_agent)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        user_id, token, expires.isoformat(),
-        request.remote_addr, request.headers.get('User-Agent', '')[:255]
-    ))
+    token, expires = _criar_sessao(bd, tenant_id, user)
 
     bd.execute('UPDATE users SET last_login = ? WHERE id = ?',
                (datetime.now().isoformat(), user_id))
     bd.commit()
+    if expires:
+        registar_sessao(token, tenant_id, user['id'], expires)
 
     return jsonify({
         'token': token,
@@ -268,10 +283,15 @@ def resend_2fa():
 @requer_autenticacao
 def logout():
     """User logout - invalidate session."""
+    if g.get('token_assinado'):
+        revogar_token(g.token_assinado)
+        return jsonify({'message': 'logout_success'}), 200
+
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     bd = obter_bd()
     bd.execute('DELETE FROM sessions WHERE token = ?', (token,))
     bd.commit()
+    invalidar_sessao(token)
     return jsonify({'message': 'logout_success'}), 200
 
 
@@ -289,8 +309,17 @@ def me():
     tenant = obter_tenant(tenant_id)
     menu_items = get_tenant_menu_items(tenant_id, user.get('role', 'user'))
 
-    # Get user language preference (handle missing column gracefully)
+    # Profile fields come from users: signed tokens only carry id, email and
+    # role, and must_change_password/active change after the token is issued
     bd = obter_bd(tenant_id)
+    perfil = bd.execute('''
+        SELECT first_name, last_name, must_change_password, two_factor_enabled
+        FROM users WHERE id = ? AND active = 1
+    ''', (user['user_id'],)).fetchone()
+    if not perfil:
+        return jsonify({'error': 'Sessão inválida ou expirada'}), 401
+
+    # Get user language preference (handle missing column gracefully)
     user_language = 'pt'
     try:
         user_data = bd.execute(
@@ -306,12 +335,12 @@ def me():
         'id': user['user_id'],
         'email': user['email'],
         'role': user['role'],
-        'first_name': user.get('first_name'),
-        'last_name': user.get('last_name'),
+        'first_name': perfil['first_name'],
+        'last_name': perfil['last_name'],
         'tenant_id': tenant_id,
         'tenant_name': tenant.get('name', tenant_id) if tenant else tenant_id,
-        'must_change_password': bool(user.get('must_change_password')),
-        'two_factor_enabled': bool(user.get('two_factor_enabled')),
+        'must_change_password': bool(perfil['must_change_password']),
+        'two_factor_enabled': bool(perfil['two_factor_enabled']),
         'menu_items': menu_items,
         'language': user_language
     }), 200
@@ -475,6 +504,7 @@ def bootstrap():
             ''', (new_hash,))
 
         bd.commit()
+        sincronizar_utilizadores_tenant(MASTER_TENANT_ID)
 
         return jsonify({
             'message': 'Admin user ready',
@@ -518,7 +548,10 @@ def reset_password():
                     WHERE id = ?
                 ''', (new_hash, reset['user_id']))
                 bd.execute('UPDATE password_reset_tokens SET used = 1 WHERE token = ?', (token,))
+                # Existing sessions must not survive a password reset
+                bd.execute('DELETE FROM sessions WHERE user_id = ?', (reset['user_id'],))
                 bd.commit()
+                invalidar_sessoes_utilizador(tenant['id'], reset['user_id'])
                 return jsonify({'message': 'password_changed'}), 200
         except Exception:
             continue
@@ -12,7 +12,13 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, send_file
 
 from flask import g
-from ...shared.database import obter_bd, obter_bd_catalogo, extrair_valor, table_exists
+from ...shared.database import (
+    obter_bd, obter_bd_catalogo, extrair_valor, table_exists, consolidar_wal, libertar_bd_sqlite,
+    restaurar_bd_sqlite, insert_returning_id
+)
+from ...shared.pagination import paginar_por_cursor, consulta_por_cursor, codificar_cursor, dividir_pagina, obter_total
+from ...shared.migrations import migrar_tenant
+from ...shared.query_plans import registar_consulta_critica
 from ...shared.permissions import requer_admin, requer_superadmin, requer_autenticacao
 from ...shared.config import Config
 
@@ -20,6 +26,25 @@ logger = logging.getLogger(__name__)
 
 settings_bp = Blueprint('settings', __name__)
 
+# Audit log listing (get_audit_log)
+_SELECT_AUDITORIA = '''
+    SELECT
+        a.id,
+        a.user_id,
+        a.action,
+        a.table_name,
+        a.record_id,
+        a.old_values,
+        a.new_values,
+        a.created_at,
+        (u.first_name || ' ' || u.last_name) as user_name,
+        u.email as user_email
+    FROM audit_log a
+    LEFT JOIN users u ON a.user_id = u.id
+'''
+registar_consulta_critica('audit_log_after_cursor', lambda bd: consulta_por_cursor(
+    _SELECT_AUDITORIA, 'WHERE 1=1', [], codificar_cursor('2100-01-01', 1), 50, 'a.created_at', 'a.id'))
+
 
 @settings_bp.route('/prefixes', methods=['GET'])
 @requer_admin
@@ -172,7 +197,7 @@ def add_schema_field():
     if options and isinstance(options, list):
         options = json.dumps(options)
 
-    bd.execute('''
+    new_id = insert_returning_id(bd, '''
         INSERT INTO schema_fields (field_name, field_type, field_label, required, field_order, field_category, field_options)
         VALUES (?, ?, ?, ?, ?, ?, ?)
     ''', (
@@ -186,13 +211,6 @@ def add_schema_field():
     ))
     bd.commit()
 
-    # Get the newly inserted ID (PostgreSQL compatible)
-    new_field = bd.execute(
-        'SELECT id FROM schema_fields WHERE field_name = ?',
-        (dados['field_name'],)
-    ).fetchone()
-    new_id = new_field['id'] if new_field else None
-
     return jsonify({'message': 'Campo adicionado', 'id': new_id}), 201
 
 
@@ -204,7 +222,8 @@ def update_schema_field(field_id):
     bd = obter_bd()
 
     # Check if exists
-    existing = bd.execute('SELECT id FROM schema_fields WHERE id = ?', (field_id,)).fetchone()
+    existing = bd.execute('SELECT id, field_name, field_type FROM schema_fields WHERE id = ?',
+                          (field_id,)).fetchone()
     if not existing:
         return jsonify({'error': 'Campo não encontrado'}), 404
 
@@ -232,6 +251,11 @@ def update_schema_field(field_id):
     ))
     bd.commit()
 
+    # Re-derive the typed shadows of the field's values if its type changed
+    if dados.get('field_type') and dados['field_type'] != existing['field_type']:
+        from ...shared.asset_data import reconstruir_valores_tipados
+        reconstruir_valores_tipados(bd, [existing['field_name']])
+
     return jsonify({'message': 'Campo atualizado'}), 200
 
 
@@ -858,6 +882,7 @@ def _create_backup(tenant_id: str, user_email: str) -> dict:
         # Add database file
         db_path = os.path.join(tenant_data_path, 'database.db')
         if os.path.exists(db_path):
+            consolidar_wal(db_path)
             zipf.write(db_path, 'database.db')
 
         # Add uploads folder if exists
@@ -951,8 +976,11 @@ def _restore_backup(tenant_id: str, backup_filename: str) -> bool:
             target_db = os.path.join(tenant_data_path, 'database.db')
             # Create backup of current database before overwriting
             if os.path.exists(target_db):
+                libertar_bd_sqlite(target_db)
                 shutil.copy2(target_db, target_db + '.pre_restore')
-            shutil.copy2(extracted_db, target_db)
+            restaurar_bd_sqlite(extracted_db, target_db)
+            # Older backups predate the current schema; migrations only run at boot
+            migrar_tenant(tenant_id)
 
         # Restore uploads
         extracted_uploads = os.path.join(temp_dir, 'uploads')
@@ -1104,8 +1132,13 @@ def delete_backup(filename):
 @settings_bp.route('/audit-log', methods=['GET'])
 @requer_admin
 def get_audit_log():
-    """Get audit log entries with filtering and pagination."""
+    """Get audit log entries with filtering and pagination.
+
+    Pages by ?page= (offset) or, when ?after= is present, by keyset cursor:
+    pass the previous response's next_cursor ('' for the first page).
+    """
     bd = obter_bd()
+    after = request.args.get('after')
 
     # Pagination
     page = request.args.get('page', 1, type=int)
@@ -1152,37 +1185,33 @@ def get_audit_log():
 
     where_sql = ' AND '.join(where_clauses) if where_clauses else '1=1'
 
-    # Get total count
     count_query = f'''
         SELECT COUNT(*) as total
         FROM audit_log a
         LEFT JOIN users u ON a.user_id = u.id
         WHERE {where_sql}
     '''
-    total = bd.execute(count_query, params).fetchone()['total']
+    select_sql = _SELECT_AUDITORIA
 
-    # Get paginated entries
-    query = f'''
-        SELECT
-            a.id,
-            a.user_id,
-            a.action,
-            a.table_name,
-            a.record_id,
-            a.old_values,
-            a.new_values,
-            a.created_at,
-            (u.first_name || ' ' || u.last_name) as user_name,
-            u.email as user_email
-        FROM audit_log a
-        LEFT JOIN users u ON a.user_id = u.id
-        WHERE {where_sql}
-        ORDER BY a.created_at DESC
-        LIMIT ? OFFSET ?
-    '''
-    params.extend([per_page, offset])
+    if after is not None:
+        try:
+            entries, next_cursor = paginar_por_cursor(
+                bd, select_sql, f'WHERE {where_sql}', params, after, per_page,
+                'a.created_at', 'a.id'
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        total = obter_total(bd, 'audit_log', count_query, params, request.args.get('total'))
+    else:
+        # Get total count
+        total = bd.execute(count_query, params).fetchone()['total']
 
-    entries = bd.execute(query, params).fetchall()
+        # Get paginated entries
+        entries = bd.execute(
+            f'{select_sql} WHERE {where_sql} ORDER BY a.created_at DESC, a.id DESC LIMIT ? OFFSET ?',
+            params + [per_page + 1, offset]
+        ).fetchall()
+        entries, next_cursor = dividir_pagina(entries, per_page)
 
     result = []
     for entry in entries:
@@ -1200,12 +1229,21 @@ def get_audit_log():
                 pass
         result.append(entry_dict)
 
+    if after is not None:
+        return jsonify({
+            'entries': result,
+            'total': total,
+            'per_page': per_page,
+            'next_cursor': next_cursor
+        }), 200
+
     return jsonify({
         'entries': result,
         'total': total,
         'page': page,
         'per_page': per_page,
-        'pages': (total + per_page - 1) // per_page
+        'pages': (total + per_page - 1) // per_page,
+        'next_cursor': next_cursor
     }), 200
 
 
@@ -1496,6 +1534,18 @@ def run_scheduler_now():
     return jsonify({'message': 'Tarefas iniciadas em background'}), 200
 
 
+# =========================================================================
+# DATABASE DIAGNOSTICS (superadmin only)
+# =========================================================================
+
+@settings_bp.route('/database/stats', methods=['GET'])
+@requer_superadmin
+def get_database_stats():
+    """Get connection pool and query translation statistics."""
+    from ...shared.database import obter_estatisticas_bd
+    return jsonify(obter_estatisticas_bd()), 200
+
+
 # =========================================================================
 # NOTIFICATION SETTINGS (admin)
 # =========================================================================
@@ -16,6 +16,7 @@ from ...shared.database import (
 from ...shared.security import hash_password
 from ...shared.permissions import requer_superadmin, requer_autenticacao
 from ...shared.plans import PlanService, TenantPlanService
+from ...shared.directory import sincronizar_utilizadores_tenant
 from ...shared.config import Config
 
 logger = logging.getLogger(__name__)
@@ -81,6 +82,8 @@ def bootstrap():
             logger.info("Admin user created")
             message = 'Sistema inicializado com sucesso'
 
+        sincronizar_utilizadores_tenant(MASTER_TENANT_ID)
+
         logger.info("Bootstrap completed: tenant=%s, admin=%s", MASTER_TENANT_ID, admin_email)
         return jsonify({
             'message': message,
@@ -136,6 +139,7 @@ def reset_admin():
             UPDATE users SET password_hash = ?, active = 1 WHERE email = ?
         ''', (new_hash, 'admin@smartlamppost.com'))
         bd.commit()
+        sincronizar_utilizadores_tenant(MASTER_TENANT_ID)
 
         # Verify the user state
         user = bd.execute('SELECT id, email, role, active FROM users WHERE email = ?',
@@ -274,6 +278,7 @@ def create_tenant():
             VALUES (?, ?, 'admin', 'Administrador', 1)
         ''', (admin_email, hash_password(admin_password)))
         bd.commit()
+        sincronizar_utilizadores_tenant(tenant_id)
 
     logger.info("Tenant created: %s", tenant_id)
     return jsonify(novo_tenant), 201
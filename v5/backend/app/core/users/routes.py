@@ -8,13 +8,16 @@ from datetime import datetime
 
 from flask import Blueprint, request, jsonify, g
 
-from ...shared.database import obter_bd, registar_auditoria, extrair_valor
+from ...shared.database import obter_bd, registar_auditoria, extrair_valor, insert_returning_id
 from ...shared.security import hash_password
 from ...shared.permissions import (
-    requer_autenticacao, requer_admin,
+    requer_autenticacao, requer_admin, invalidar_permissoes,
     obter_permissoes_utilizador, definir_permissoes_utilizador
 )
 from ...shared.plans import TenantPlanService
+from ...shared.directory import (
+    invalidar_sessoes_utilizador, registar_utilizador, revogar_tokens_utilizador
+)
 
 logger = logging.getLogger(__name__)
 
@@ -77,7 +80,7 @@ def create_user():
         return jsonify({'error': 'Email já existe'}), 400
 
     # Create user
-    bd.execute('''
+    user_id = insert_returning_id(bd, '''
         INSERT INTO users (email, password_hash, role, first_name, last_name,
                           must_change_password, created_by)
         VALUES (?, ?, ?, ?, ?, 1, ?)
@@ -87,18 +90,12 @@ def create_user():
     ))
     bd.commit()
 
-    # Get the newly inserted ID (PostgreSQL compatible)
-    new_user = bd.execute(
-        'SELECT id FROM users WHERE email = ?',
-        (email,)
-    ).fetchone()
-    user_id = new_user['id'] if new_user else None
-
     # Log audit
     registar_auditoria(bd, g.utilizador_atual['user_id'], 'CREATE', 'users', user_id, None, {
         'email': email, 'role': role
     })
     bd.commit()
+    registar_utilizador(g.tenant_id, user_id, email)
 
     logger.info("User created: %s in tenant %s", email, g.tenant_id)
 
@@ -169,6 +166,7 @@ def update_user(user_id):
         updates.append('role = ?')
         params.append(new_role)
 
+    deactivating = 'active' in dados and not dados['active']
     if 'active' in dados:
         updates.append('active = ?')
         params.append(1 if dados['active'] else 0)
@@ -189,10 +187,21 @@ def update_user(user_id):
     params.append(user_id)
     bd.execute(f'UPDATE users SET {", ".join(updates)} WHERE id = ?', params)
 
+    if deactivating:
+        bd.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+
     # Log audit
     registar_auditoria(bd, g.utilizador_atual['user_id'], 'UPDATE', 'users', user_id,
                        old_values, dados)
     bd.commit()
+    if 'role' in dados:
+        invalidar_permissoes(g.tenant_id, user_id)
+        # Signed tokens carry the role; make the user log in again
+        revogar_tokens_utilizador(g.tenant_id, user_id)
+    if 'active' in dados:
+        registar_utilizador(g.tenant_id, user_id, user['email'], bool(dados['active']))
+    if deactivating:
+        invalidar_sessoes_utilizador(g.tenant_id, user_id)
 
     logger.info("User updated: %s", user_id)
     return jsonify({'message': 'Utilizador atualizado'}), 200
@@ -221,6 +230,8 @@ def delete_user(user_id):
     registar_auditoria(bd, g.utilizador_atual['user_id'], 'DELETE', 'users', user_id,
                        {'email': user['email']}, None)
     bd.commit()
+    invalidar_sessoes_utilizador(g.tenant_id, user_id)
+    registar_utilizador(g.tenant_id, user_id, user['email'], active=False)
 
     logger.info("User deactivated: %s", user_id)
     return jsonify({'message': 'Utilizador desativado'}), 200
@@ -282,6 +293,7 @@ def force_password_reset(user_id):
     # Invalidate sessions
     bd.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
     bd.commit()
+    invalidar_sessoes_utilizador(g.tenant_id, user_id)
 
     logger.info("Password reset forced for user: %s", user_id)
     return jsonify({'message': 'Password redefinida. O utilizador terá de alterar no próximo login.'}), 200
@@ -609,6 +621,8 @@ def anonymize_user(user_id):
     registar_auditoria(bd, g.utilizador_atual['user_id'], 'RGPD_ANONYMIZE', 'users', user_id,
                        {'original_email': user['email']}, {'anonymized_id': anon_id})
     bd.commit()
+    invalidar_sessoes_utilizador(g.tenant_id, user_id)
+    registar_utilizador(g.tenant_id, user_id, f"{anon_id}@anonymized.local", active=False)
 
     logger.info("User anonymized: %s -> %s", user['email'], anon_id)
     return jsonify({
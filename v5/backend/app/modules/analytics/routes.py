@@ -9,11 +9,20 @@ from flask import Blueprint, request, jsonify, g
 
 from ...shared.database import obter_bd, extrair_valor
 from ...shared.permissions import requer_autenticacao, requer_permissao
+from ...shared.query_plans import registar_consulta_critica
 
 logger = logging.getLogger(__name__)
 
 analytics_bp = Blueprint('analytics', __name__)
 
+_QUERY_MANUTENCAO_PREVISTA = '''
+    SELECT COUNT(*) as cnt
+    FROM asset_data
+    WHERE field_name IN ('next_maintenance_date', 'next_inspection_date')
+      AND value_date <= ?
+'''
+registar_consulta_critica('maintenance_due', _QUERY_MANUTENCAO_PREVISTA, ('2000-01-08',))
+
 
 @analytics_bp.route('/kpis', methods=['GET'])
 @requer_permissao('analytics', 'view')
@@ -129,10 +138,10 @@ def calculate_availability(bd, start_date, end_date):
 
     # Count assets by status
     operational = extrair_valor(bd.execute('''
-        SELECT COUNT(DISTINCT a.id) as cnt
+        SELECT COUNT(*) as cnt
         FROM assets a
-        LEFT JOIN asset_data ad ON a.id = ad.asset_id AND ad.field_name = 'condition_status'
-        WHERE ad.field_value = 'Operacional' OR ad.field_value IS NULL
+        LEFT JOIN assets_flat f ON f.asset_id = a.id
+        WHERE f.condition_status = 'Operacional' OR f.condition_status IS NULL
     ''').fetchone(), 0) or 0
 
     total = extrair_valor(bd.execute('SELECT COUNT(*) as cnt FROM assets').fetchone(), 0) or 0
@@ -279,35 +288,32 @@ def get_interventions_summary(bd, start_date, end_date):
 def get_asset_health(bd):
     """Get current asset health distribution."""
     health = bd.execute('''
-        SELECT ad.field_value as status, COUNT(*) as count
+        SELECT f.condition_status as status, COUNT(*) as count
         FROM assets a
-        LEFT JOIN asset_data ad ON a.id = ad.asset_id AND ad.field_name = 'condition_status'
-        GROUP BY ad.field_value
+        LEFT JOIN assets_flat f ON a.id = f.asset_id
+        GROUP BY f.condition_status
     ''').fetchall()
 
-    # Warranty status
-    today = datetime.now().date().isoformat()
+    # Warranty status (range scans on the typed value_date index)
+    today = datetime.now().date()
     warranty_expiring = extrair_valor(bd.execute('''
         SELECT COUNT(*) as cnt
         FROM asset_data
         WHERE field_name = 'warranty_end_date'
-          AND DATE(field_value) BETWEEN DATE('now') AND DATE('now', '+30 days')
-    ''').fetchone(), 0) or 0
+          AND value_date BETWEEN ? AND ?
+    ''', (today.isoformat(), (today + timedelta(days=30)).isoformat())).fetchone(), 0) or 0
 
     warranty_expired = extrair_valor(bd.execute('''
         SELECT COUNT(*) as cnt
         FROM asset_data
         WHERE field_name = 'warranty_end_date'
-          AND DATE(field_value) < DATE('now')
-    ''').fetchone(), 0) or 0
+          AND value_date < ?
+    ''', (today.isoformat(),)).fetchone(), 0) or 0
 
     # Maintenance due
-    maintenance_due = extrair_valor(bd.execute('''
-        SELECT COUNT(*) as cnt
-        FROM asset_data
-        WHERE field_name IN ('next_maintenance_date', 'next_inspection_date')
-          AND DATE(field_value) <= DATE('now', '+7 days')
-    ''').fetchone(), 0) or 0
+    maintenance_due = extrair_valor(bd.execute(
+        _QUERY_MANUTENCAO_PREVISTA, ((today + timedelta(days=7)).isoformat(),)
+    ).fetchone(), 0) or 0
 
     return {
         'by_status': [dict(h) for h in health],
@@ -370,45 +376,39 @@ def get_predictive_maintenance():
         SELECT a.id, a.serial_number,
                COUNT(i.id) as intervention_count,
                MAX(i.created_at) as last_intervention,
-               ad_loc.field_value as location
+               f.installation_location as location
         FROM assets a
         JOIN interventions i ON a.id = i.asset_id
-        LEFT JOIN asset_data ad_loc ON a.id = ad_loc.asset_id AND ad_loc.field_name = 'installation_location'
+        LEFT JOIN assets_flat f ON f.asset_id = a.id
         WHERE i.created_at >= DATE('now', '-365 days')
-        GROUP BY a.id
-        HAVING intervention_count >= 3
+        GROUP BY a.id, a.serial_number, f.installation_location
+        HAVING COUNT(i.id) >= 3
         ORDER BY intervention_count DESC
         LIMIT 20
     ''').fetchall()
 
     # Assets approaching maintenance/inspection dates
     upcoming_maintenance = bd.execute('''
-        SELECT a.id, a.serial_number,
-               ad_maint.field_value as next_maintenance,
-               ad_insp.field_value as next_inspection,
-               ad_loc.field_value as location
-        FROM assets a
-        LEFT JOIN asset_data ad_maint ON a.id = ad_maint.asset_id AND ad_maint.field_name = 'next_maintenance_date'
-        LEFT JOIN asset_data ad_insp ON a.id = ad_insp.asset_id AND ad_insp.field_name = 'next_inspection_date'
-        LEFT JOIN asset_data ad_loc ON a.id = ad_loc.asset_id AND ad_loc.field_name = 'installation_location'
-        WHERE DATE(ad_maint.field_value) <= DATE('now', '+14 days')
-           OR DATE(ad_insp.field_value) <= DATE('now', '+14 days')
-        ORDER BY COALESCE(ad_maint.field_value, ad_insp.field_value)
+        SELECT f.asset_id as id, f.serial_number,
+               CAST(f.next_maintenance_date AS TEXT) as next_maintenance,
+               CAST(f.next_inspection_date AS TEXT) as next_inspection,
+               f.installation_location as location
+        FROM assets_flat f
+        WHERE f.next_maintenance_date <= DATE('now', '+14 days')
+           OR f.next_inspection_date <= DATE('now', '+14 days')
+        ORDER BY COALESCE(f.next_maintenance_date, f.next_inspection_date)
         LIMIT 20
     ''').fetchall()
 
     # Assets without recent maintenance (overdue)
     overdue = bd.execute('''
-        SELECT a.id, a.serial_number,
-               ad_last.field_value as last_inspection,
-               ad_loc.field_value as location,
-               julianday('now') - julianday(ad_last.field_value) as days_since
-        FROM assets a
-        LEFT JOIN asset_data ad_last ON a.id = ad_last.asset_id AND ad_last.field_name = 'last_inspection_date'
-        LEFT JOIN asset_data ad_loc ON a.id = ad_loc.asset_id AND ad_loc.field_name = 'installation_location'
-        WHERE ad_last.field_value IS NOT NULL
-          AND julianday('now') - julianday(ad_last.field_value) > 365
-        ORDER BY days_since DESC
+        SELECT f.asset_id as id, f.serial_number,
+               CAST(f.last_inspection_date AS TEXT) as last_inspection,
+               f.installation_location as location,
+               julianday('now') - julianday(f.last_inspection_date) as days_since
+        FROM assets_flat f
+        WHERE f.last_inspection_date < DATE('now', '-365 days')
+        ORDER BY f.last_inspection_date
         LIMIT 20
     ''').fetchall()
 
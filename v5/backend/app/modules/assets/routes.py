@@ -9,104 +9,200 @@ from datetime import datetime
 
 from flask import Blueprint, request, jsonify, g
 
-from ...shared.database import obter_bd, obter_config, registar_auditoria, extrair_valor
-from ...shared.permissions import requer_autenticacao, requer_permissao
+from ...shared.database import (
+    obter_bd, obter_config, registar_auditoria, extrair_valor, carregar_dados_ativos, hidratar_ativos,
+    insert_returning_id, ASSET_DATA_CHUNK_SIZE
+)
+from ...shared.asset_data import (
+    guardar_dados_ativo, remover_dados_ativos, alterar_estado_ativos, eliminar_ativos,
+    registar_alteracoes, CONTADOR_ALTERACOES_PURGADAS
+)
+from ...shared.asset_filters import compilar_filtros, compilar_ordenacao
+from ...shared.jobs import submeter_tarefa, atualizar_progresso, obter_tarefa
+from ...shared.pagination import (
+    paginar_por_cursor, consulta_por_cursor, codificar_cursor, dividir_pagina, obter_total
+)
+from ...shared.query_plans import registar_consulta_critica
+from ...shared.search import filtro_pesquisa
+from ...shared.sequences import reservar_series_ativos
+from ...shared.permissions import requer_autenticacao, requer_permissao, filtrar_campos_registos
 from ...shared.plans import TenantPlanService
 
 logger = logging.getLogger(__name__)
 
 assets_bp = Blueprint('assets', __name__)
 
+# Most tags accepted by one /resolve-rfid call (a reader sweep)
+RFID_BATCH_MAX = 5000
 
-def gerar_proximo_numero():
-    """Generate the next serial number with collision detection."""
-    bd = obter_bd()
+# Bulk deletes above this size run as a background job
+BULK_DELETE_SYNC_MAX = 200
 
-    prefixo = obter_config('prefix_assets', 'SLP')
-    digitos = int(obter_config('prefix_assets_digits', '9'))
+# Changes returned by one /changes call (default, most accepted)
+CHANGES_PAGE_DEFAULT = 500
+CHANGES_PAGE_MAX = 2000
 
-    # Get current counter
-    contador = bd.execute(
-        'SELECT current_value FROM sequence_counters WHERE counter_type = ?',
-        ('assets',)
-    ).fetchone()
+# Asset keys returned even when a field permission hides them
+_CAMPOS_CHAVE = ('id', 'serial_number')
 
-    valor_atual = contador['current_value'] if contador else 0
-    proximo = valor_atual + 1
-
-    # Collision detection: check if serial already exists (e.g., from imports)
-    for _ in range(1000):  # Safety limit
-        serial = f"{prefixo}{str(proximo).zfill(digitos)}"
-        existente = bd.execute(
-            'SELECT 1 FROM assets WHERE serial_number = ?',
-            (serial,)
-        ).fetchone()
-        if not existente:
-            break
-        proximo += 1
-
-    # Update counter
-    if contador:
-        bd.execute(
-            'UPDATE sequence_counters SET current_value = ?, updated_at = ? WHERE counter_type = ?',
-            (proximo, datetime.now().isoformat(), 'assets')
-        )
-    else:
-        bd.execute(
-            'INSERT INTO sequence_counters (counter_type, current_value) VALUES (?, ?)',
-            ('assets', proximo)
-        )
 
-    bd.commit()
-    return f"{prefixo}{str(proximo).zfill(digitos)}"
+# =========================================================================
+# HOT QUERIES (checked by shared.query_plans)
+# =========================================================================
+
+_SELECT_ATIVOS = 'SELECT a.* FROM assets a'
+
+# Default listing order, also the keyset cursor order
+_ORDEM_ATIVOS = 'a.created_at DESC, a.id DESC'
+
+_QUERY_HISTORICO_ESTADOS = '''
+    SELECT scl.*, u.first_name, u.last_name
+    FROM status_change_log scl
+    LEFT JOIN users u ON scl.changed_by = u.id
+    WHERE scl.asset_id = ?
+    ORDER BY scl.changed_at DESC
+    LIMIT 10
+'''
+
+_QUERY_ALTERACOES = '''
+    SELECT asset_id, serial_number, change_seq, deleted FROM asset_changes
+    WHERE change_seq > ? ORDER BY change_seq LIMIT ?
+'''
+
+
+def _consulta_pagina_ativos(where_sql, params, per_page, offset,
+                            join_sql='', join_params=(), order_sql=_ORDEM_ATIVOS):
+    """Offset page query of the asset listing (one extra row to detect more)."""
+    return (f'{_SELECT_ATIVOS} {join_sql} {where_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?',
+            list(join_params) + list(params) + [per_page + 1, offset])
+
+
+def _campos_visiveis(ativos):
+    """Drop the asset fields the current user may not view."""
+    return filtrar_campos_registos(g.utilizador_atual['user_id'], 'assets', ativos,
+                                   manter=_CAMPOS_CHAVE)
+
+
+def _consulta_pesquisa(bd, termo):
+    """Quick search query (first 10 matches)."""
+    filtro, params = filtro_pesquisa(bd, termo)
+    return f'{_SELECT_ATIVOS} WHERE {filtro} LIMIT 10', params
+
+
+def _consulta_rfid(tags):
+    """Flat rows of the assets carrying any of the given RFID tags."""
+    return (f'''
+        SELECT ad.field_value as rfid_tag, f.serial_number, f.status, f.condition_status,
+               f.product_reference, f.municipality, f.street_address,
+               f.gps_latitude, f.gps_longitude
+        FROM asset_data ad
+        JOIN assets_flat f ON f.asset_id = ad.asset_id
+        WHERE ad.field_name = 'rfid_tag' AND ad.field_value IN ({', '.join('?' * len(tags))})
+    ''', list(tags))
+
+
+def _amostra_filtro(expressao):
+    """Plan-check builder of the listing page filtered by one expression."""
+    def construir(bd):
+        filtro, params = compilar_filtros(bd, [expressao])
+        return _consulta_pagina_ativos(f'WHERE 1=1{filtro}', params, 50, 0)
+    return construir
+
+
+registar_consulta_critica('asset_status_history', _QUERY_HISTORICO_ESTADOS, (1,))
+registar_consulta_critica('asset_changes_since', _QUERY_ALTERACOES, (0, 501))
+registar_consulta_critica('assets_by_rfid_batch', lambda bd: _consulta_rfid(['RFID-1', 'RFID-2', 'RFID-3']))
+registar_consulta_critica('asset_search', lambda bd: _consulta_pesquisa(bd, 'LMP'))
+registar_consulta_critica('assets_after_cursor', lambda bd: consulta_por_cursor(
+    _SELECT_ATIVOS, 'WHERE 1=1', [], codificar_cursor('2100-01-01', 1), 50, 'a.created_at', 'a.id'))
+registar_consulta_critica('assets_after_undated_cursor', lambda bd: consulta_por_cursor(
+    _SELECT_ATIVOS, 'WHERE 1=1', [], codificar_cursor(None, 1), 50, 'a.created_at', 'a.id'))
+registar_consulta_critica('assets_filter_flat', _amostra_filtro('municipality:eq:Lisboa'))
+registar_consulta_critica('assets_filter_eav', _amostra_filtro('power_watts:gte:100'))
 
 
 @assets_bp.route('', methods=['GET'])
 @requer_permissao('assets', 'view')
 def list_assets():
-    """List all assets with pagination."""
+    """List all assets with pagination.
+
+    Pages by ?page= (offset) or, when ?after= is present, by keyset cursor:
+    pass the previous response's next_cursor ('' for the first page).
+    ?total=exact|cached|none controls the count in cursor mode.
+
+    ?filter=field:op:value (repeatable, op in eq, ne, lt, lte, gt, gte,
+    contains, in with values separated by '|') and ?sort=[-]field work on
+    any asset field; a custom sort pages by ?page= only.
+    """
     bd = obter_bd()
 
     page = int(request.args.get('page', 1))
     per_page = min(int(request.args.get('per_page', 50)), 100)
     search = request.args.get('search', '')
     status = request.args.get('status', '')
+    sort = request.args.get('sort', '')
+    after = request.args.get('after')
 
     offset = (page - 1) * per_page
 
-    # Build query
-    query = 'SELECT a.* FROM assets a WHERE 1=1'
+    # Build filters
+    where_sql = 'WHERE 1=1'
     params = []
 
     if search:
-        query += ' AND a.serial_number LIKE ?'
-        params.append(f'%{search}%')
-
-    # Get total count
-    count_query = query.replace('SELECT a.*', 'SELECT COUNT(*) as cnt')
-    total = extrair_valor(bd.execute(count_query, params).fetchone(), 0) or 0
+        filtro, filtro_params = filtro_pesquisa(bd, search)
+        where_sql += f' AND {filtro}'
+        params.extend(filtro_params)
+
+    filtros = request.args.getlist('filter')
+    if status:
+        filtros.append(f'condition_status:eq:{status}')
+    try:
+        filtro, filtro_params = compilar_filtros(bd, filtros)
+        join_sql, join_params, order_sql = (
+            compilar_ordenacao(bd, sort) if sort else ('', [], _ORDEM_ATIVOS)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    where_sql += filtro
+    params.extend(filtro_params)
 
-    # Add pagination
-    query += ' ORDER BY a.created_at DESC LIMIT ? OFFSET ?'
-    params.extend([per_page, offset])
+    count_query = f'SELECT COUNT(*) as cnt FROM assets a {where_sql}'
 
-    assets = bd.execute(query, params).fetchall()
+    if after is not None:
+        if sort:
+            return jsonify({'error': 'O parâmetro sort não é compatível com after'}), 400
+        try:
+            assets, next_cursor = paginar_por_cursor(
+                bd, _SELECT_ATIVOS, where_sql, params, after, per_page,
+                'a.created_at', 'a.id'
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-    # Get dynamic field values for each asset
-    result = []
-    for asset in assets:
-        asset_dict = dict(asset)
+        return jsonify({
+            'data': _campos_visiveis(hidratar_ativos(bd, assets)),
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'total': obter_total(bd, 'assets', count_query, params, request.args.get('total'))
+            }
+        }), 200
 
-        # Get dynamic field values
-        fields = bd.execute(
-            'SELECT field_name, field_value FROM asset_data WHERE asset_id = ?',
-            (asset['id'],)
-        ).fetchall()
+    # Get total count
+    total = extrair_valor(bd.execute(count_query, params).fetchone(), 0) or 0
 
-        for field in fields:
-            asset_dict[field['field_name']] = field['field_value']
+    # Add pagination
+    assets = bd.execute(*_consulta_pagina_ativos(
+        where_sql, params, per_page, offset, join_sql, join_params, order_sql
+    )).fetchall()
+    assets, next_cursor = dividir_pagina(assets, per_page)
+    if sort:
+        # Cursors follow created_at order only
+        next_cursor = None
 
-        result.append(asset_dict)
+    # Get dynamic field values for the whole page at once
+    result = _campos_visiveis(hidratar_ativos(bd, assets))
 
     return jsonify({
         'data': result,
@@ -114,7 +210,8 @@ def list_assets():
             'page': page,
             'per_page': per_page,
             'total': total,
-            'pages': (total + per_page - 1) // per_page
+            'pages': (total + per_page - 1) // per_page,
+            'next_cursor': next_cursor
         }
     }), 200
 
@@ -122,44 +219,71 @@ def list_assets():
 @assets_bp.route('/search', methods=['GET'])
 @requer_permissao('assets', 'view')
 def search_assets():
-    """Search assets by RFID tag, product reference, or serial number."""
+    """Search assets by serial number, RFID tag, product reference, street
+    address or municipality (substring, served by the search index)."""
     bd = obter_bd()
     q = request.args.get('q', '').strip()
 
     if not q:
         return jsonify({'assets': []}), 200
 
-    # Search across multiple fields
-    assets = bd.execute('''
-        SELECT a.*, ad_rfid.field_value as rfid_tag, ad_ref.field_value as product_reference
-        FROM assets a
-        LEFT JOIN asset_data ad_rfid ON a.id = ad_rfid.asset_id AND ad_rfid.field_name = 'rfid_tag'
-        LEFT JOIN asset_data ad_ref ON a.id = ad_ref.asset_id AND ad_ref.field_name = 'product_reference'
-        WHERE a.serial_number = ?
-           OR ad_rfid.field_value = ?
-           OR ad_ref.field_value = ?
-           OR a.serial_number LIKE ?
-           OR ad_rfid.field_value LIKE ?
-           OR ad_ref.field_value LIKE ?
-        LIMIT 10
-    ''', (q, q, q, f'%{q}%', f'%{q}%', f'%{q}%')).fetchall()
+    assets = bd.execute(*_consulta_pesquisa(bd, q)).fetchall()
 
-    result = []
-    for asset in assets:
-        asset_dict = dict(asset)
+    # Get all dynamic field values
+    result = _campos_visiveis(hidratar_ativos(bd, assets))
 
-        # Get all dynamic field values
-        fields = bd.execute(
-            'SELECT field_name, field_value FROM asset_data WHERE asset_id = ?',
-            (asset['id'],)
-        ).fetchall()
+    return jsonify({'assets': result}), 200
 
-        for field in fields:
-            asset_dict[field['field_name']] = field['field_value']
 
-        result.append(asset_dict)
+@assets_bp.route('/changes', methods=['GET'])
+@requer_permissao('assets', 'view')
+def get_asset_changes():
+    """Delta sync: assets created, updated or deleted since a change token.
+
+    ?since= is the next_token of the previous call (0 or absent for a first
+    full sync); ?limit= caps the changes per response. Keep calling with
+    next_token while has_more is true. A 410 means deletions older than the
+    token have been purged and the client must sync again from 0.
+
+    Deletions come as deleted_ids (and their serials in deleted). A serial
+    deleted and created again shows up in both lists under two asset ids,
+    so clients should apply deletions by id.
+    """
+    bd = obter_bd()
 
-    return jsonify({'assets': result}), 200
+    try:
+        since = int(request.args.get('since') or 0)
+        limit = min(max(int(request.args.get('limit', CHANGES_PAGE_DEFAULT)), 1), CHANGES_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros since/limit inválidos'}), 400
+
+    purgado = bd.execute(
+        'SELECT current_value FROM sequence_counters WHERE counter_type = ?',
+        (CONTADOR_ALTERACOES_PURGADAS,)
+    ).fetchone()
+    if since and purgado and since < (purgado['current_value'] or 0):
+        return jsonify({'error': 'Token de sincronização expirado', 'reset': True}), 410
+
+    alteracoes = bd.execute(_QUERY_ALTERACOES, (since, limit + 1)).fetchall()
+    has_more = len(alteracoes) > limit
+    alteracoes = alteracoes[:limit]
+
+    ids = [a['asset_id'] for a in alteracoes if not a['deleted']]
+    assets = []
+    for inicio in range(0, len(ids), ASSET_DATA_CHUNK_SIZE):
+        bloco = ids[inicio:inicio + ASSET_DATA_CHUNK_SIZE]
+        assets.extend(bd.execute(
+            f"SELECT * FROM assets WHERE id IN ({', '.join('?' * len(bloco))})", bloco
+        ).fetchall())
+
+    eliminados = [a for a in alteracoes if a['deleted']]
+    return jsonify({
+        'changes': _campos_visiveis(hidratar_ativos(bd, assets)),
+        'deleted': [a['serial_number'] for a in eliminados],
+        'deleted_ids': [a['asset_id'] for a in eliminados],
+        'next_token': str(alteracoes[-1]['change_seq'] if alteracoes else since),
+        'has_more': has_more
+    }), 200
 
 
 @assets_bp.route('/<string:serial_number>', methods=['GET'])
@@ -186,16 +310,10 @@ def get_asset(serial_number):
 
     for field in fields:
         asset_dict[field['field_name']] = field['field_value']
+    asset_dict = _campos_visiveis([asset_dict])[0]
 
     # Get status history
-    history = bd.execute('''
-        SELECT scl.*, u.first_name, u.last_name
-        FROM status_change_log scl
-        LEFT JOIN users u ON scl.changed_by = u.id
-        WHERE scl.asset_id = ?
-        ORDER BY scl.changed_at DESC
-        LIMIT 10
-    ''', (asset['id'],)).fetchall()
+    history = bd.execute(_QUERY_HISTORICO_ESTADOS, (asset['id'],)).fetchall()
 
     asset_dict['status_history'] = [dict(h) for h in history]
 
@@ -245,7 +363,7 @@ def create_asset():
     # Get serial number
     serial_number = dados.get('serial_number')
     if not serial_number:
-        serial_number = gerar_proximo_numero()
+        serial_number = reservar_series_ativos(bd)[0]
 
     # Check if serial number exists
     existing = bd.execute(
@@ -257,18 +375,11 @@ def create_asset():
         return jsonify({'error': 'Número de série já existe'}), 400
 
     # Create asset
-    bd.execute('''
+    asset_id = insert_returning_id(bd, '''
         INSERT INTO assets (serial_number, created_by, created_at)
         VALUES (?, ?, ?)
     ''', (serial_number, g.utilizador_atual['user_id'], datetime.now().isoformat()))
 
-    # Get the newly inserted ID (PostgreSQL compatible)
-    new_asset = bd.execute(
-        'SELECT id FROM assets WHERE serial_number = ?',
-        (serial_number,)
-    ).fetchone()
-    asset_id = new_asset['id'] if new_asset else None
-
     # Save dynamic fields
     schema_fields = bd.execute('SELECT field_name FROM schema_fields').fetchall()
     field_names = {f['field_name'] for f in schema_fields}
@@ -278,12 +389,10 @@ def create_asset():
     field_names.add('gps_longitude')
     field_names.add('gps_coordinates')
 
-    for key, value in dados.items():
-        if key in field_names and key != 'serial_number':
-            bd.execute('''
-                INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                VALUES (?, ?, ?)
-            ''', (asset_id, key, str(value) if value is not None else None))
+    guardar_dados_ativo(bd, asset_id, {
+        key: value for key, value in dados.items()
+        if key in field_names and key != 'serial_number'
+    })
 
     # Log audit
     registar_auditoria(bd, g.utilizador_atual['user_id'], 'CREATE', 'assets', asset_id, None, dados)
@@ -349,12 +458,9 @@ def update_asset(serial_number):
     field_names.add('gps_longitude')
     field_names.add('gps_coordinates')
 
-    for key, value in dados.items():
-        if key in field_names:
-            bd.execute('''
-                INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                VALUES (?, ?, ?)
-            ''', (asset_id, key, str(value) if value is not None else None))
+    guardar_dados_ativo(bd, asset_id, {
+        key: value for key, value in dados.items() if key in field_names
+    })
 
     # Update timestamp
     bd.execute(
@@ -386,7 +492,8 @@ def delete_asset(serial_number):
         return jsonify({'error': 'Ativo não encontrado'}), 404
 
     # Delete asset data first (cascade should handle this, but be explicit)
-    bd.execute('DELETE FROM asset_data WHERE asset_id = ?', (asset['id'],))
+    registar_alteracoes(bd, [asset['id']], eliminados=True)
+    remover_dados_ativos(bd, [asset['id']])
     bd.execute('DELETE FROM assets WHERE id = ?', (asset['id'],))
 
     registar_auditoria(bd, g.utilizador_atual['user_id'], 'DELETE', 'assets', asset['id'],
@@ -426,14 +533,15 @@ def get_assets_for_map():
     # Get all assets first
     assets = bd.execute('SELECT id, serial_number FROM assets').fetchall()
 
+    # Get GPS and other fields for all assets
+    dados = carregar_dados_ativos(bd, [a['id'] for a in assets], [
+        'gps_latitude', 'gps_longitude', 'status', 'condition_status',
+        'installation_location', 'street_address'
+    ])
+
     result = []
     for asset in assets:
-        # Get GPS and other fields for each asset
-        fields = bd.execute('''
-            SELECT field_name, field_value FROM asset_data WHERE asset_id = ?
-        ''', (asset['id'],)).fetchall()
-
-        fields_dict = {f['field_name']: f['field_value'] for f in fields}
+        fields_dict = dados[asset['id']]
 
         lat = fields_dict.get('gps_latitude')
         lng = fields_dict.get('gps_longitude')
@@ -514,7 +622,7 @@ def add_schema_field():
     if options and isinstance(options, list):
         options = json.dumps(options)
 
-    bd.execute('''
+    new_id = insert_returning_id(bd, '''
         INSERT INTO schema_fields (field_name, field_type, field_label, required,
                                    field_order, field_category, field_options)
         VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -527,13 +635,6 @@ def add_schema_field():
     ))
     bd.commit()
 
-    # Get the newly inserted ID (PostgreSQL compatible)
-    new_field = bd.execute(
-        'SELECT id FROM schema_fields WHERE field_name = ?',
-        (field_name,)
-    ).fetchone()
-    new_id = new_field['id'] if new_field else None
-
     logger.info("Schema field added: %s", field_name)
     return jsonify({
         'id': new_id,
@@ -549,7 +650,12 @@ def add_schema_field():
 @assets_bp.route('/bulk', methods=['DELETE'])
 @requer_permissao('assets', 'delete')
 def delete_assets_bulk():
-    """Delete multiple assets at once."""
+    """Delete multiple assets at once.
+
+    Up to BULK_DELETE_SYNC_MAX serials are deleted within the request.
+    Larger lists (or ?async=1) are handed to a background job: the response
+    is 202 with the job id, and progress is read from /jobs/<job_id>.
+    """
     dados = request.get_json() or {}
     serial_numbers = dados.get('serial_numbers', [])
 
@@ -559,58 +665,87 @@ def delete_assets_bulk():
     if not isinstance(serial_numbers, list):
         return jsonify({'error': 'serial_numbers deve ser uma lista'}), 400
 
-    if len(serial_numbers) > 200:
-        return jsonify({'error': 'Máximo 200 ativos por pedido'}), 400
-
     bd = obter_bd()
     user_id = g.utilizador_atual['user_id']
 
-    deleted = []
-    failed = []
+    if len(serial_numbers) > BULK_DELETE_SYNC_MAX or request.args.get('async') == '1':
+        job_id = submeter_tarefa(bd, 'bulk_delete_assets', len(set(serial_numbers)),
+                                 _tarefa_eliminar_ativos, serial_numbers, user_id, user_id=user_id)
+        logger.info("Bulk delete of %d assets queued as job %s", len(serial_numbers), job_id)
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/assets/jobs/{job_id}'
+        }), 202
 
-    for sn in serial_numbers:
-        try:
-            asset = bd.execute(
-                'SELECT id FROM assets WHERE serial_number = ?',
-                (sn,)
-            ).fetchone()
+    resultado = eliminar_ativos(bd, serial_numbers, user_id)
+    deleted, failed = resultado['deleted'], resultado['failed']
 
-            if not asset:
-                failed.append({'serial_number': sn, 'error': 'Ativo não encontrado'})
-                continue
+    logger.info("Bulk delete: %d deleted, %d failed", len(deleted), len(failed))
 
-            # Get old data for audit
-            old_data = bd.execute(
-                'SELECT field_name, field_value FROM asset_data WHERE asset_id = ?',
-                (asset['id'],)
-            ).fetchall()
-            old_data_dict = {d['field_name']: d['field_value'] for d in old_data}
+    return jsonify({
+        'success': True,
+        'deleted': len(deleted),
+        'failed': len(failed),
+        'deleted_serials': deleted,
+        'failed_details': failed
+    }), 200
 
-            # Delete related data
-            bd.execute('DELETE FROM asset_data WHERE asset_id = ?', (asset['id'],))
-            bd.execute('DELETE FROM asset_module_serials WHERE asset_id = ?', (asset['id'],))
-            bd.execute('DELETE FROM status_change_log WHERE asset_id = ?', (asset['id'],))
-            bd.execute('DELETE FROM assets WHERE id = ?', (asset['id'],))
 
-            # Audit
-            registar_auditoria(bd, user_id, 'BULK_DELETE', 'assets', asset['id'],
-                               {'serial_number': sn, **old_data_dict}, None)
+def _tarefa_eliminar_ativos(bd, job_id, serial_numbers, user_id):
+    """Background job body of an async bulk delete."""
+    resultado = eliminar_ativos(
+        bd, serial_numbers, user_id,
+        progresso=lambda processados, falhados: atualizar_progresso(bd, job_id, processados, falhados)
+    )
+    logger.info("Bulk delete job %s: %d deleted, %d failed",
+                job_id, len(resultado['deleted']), len(resultado['failed']))
+    return {'deleted': len(resultado['deleted']), 'failed': len(resultado['failed']),
+            'failed_details': resultado['failed']}
 
-            deleted.append(sn)
 
-        except Exception as e:
-            failed.append({'serial_number': sn, 'error': str(e)})
+@assets_bp.route('/jobs/<string:job_id>', methods=['GET'])
+@requer_permissao('assets', 'view')
+def get_asset_job(job_id):
+    """Get the status and progress of a background asset job."""
+    tarefa = obter_tarefa(obter_bd(), job_id)
+    if not tarefa:
+        return jsonify({'error': 'Tarefa não encontrada'}), 404
+    return jsonify(tarefa), 200
 
-    bd.commit()
 
-    logger.info("Bulk delete: %d deleted, %d failed", len(deleted), len(failed))
+@assets_bp.route('/resolve-rfid', methods=['POST'])
+@requer_permissao('assets', 'view')
+def resolve_rfid_batch():
+    """Resolve a batch of RFID tags (reader sweep) to compact asset summaries.
+
+    Body: {"tags": ["...", ...]} with up to RFID_BATCH_MAX tags. Tags are
+    looked up on the (field_name, field_value) index of asset_data, joined
+    to assets_flat for the summary, in chunks of ASSET_DATA_CHUNK_SIZE.
+    """
+    dados = request.get_json() or {}
+    tags = dados.get('tags')
+
+    if not isinstance(tags, list) or not tags:
+        return jsonify({'error': 'tags deve ser uma lista não vazia'}), 400
+
+    if len(tags) > RFID_BATCH_MAX:
+        return jsonify({'error': f'Máximo {RFID_BATCH_MAX} tags por pedido'}), 400
+
+    # Readers report the same tag many times per sweep
+    tags = list(dict.fromkeys(str(t).strip() for t in tags if t is not None and str(t).strip()))
+
+    bd = obter_bd()
+    encontrados = {}
+    for inicio in range(0, len(tags), ASSET_DATA_CHUNK_SIZE):
+        rows = bd.execute(*_consulta_rfid(tags[inicio:inicio + ASSET_DATA_CHUNK_SIZE])).fetchall()
+        for row in rows:
+            encontrados.setdefault(row['rfid_tag'], dict(row))
 
     return jsonify({
-        'success': True,
-        'deleted': len(deleted),
-        'failed': len(failed),
-        'deleted_serials': deleted,
-        'failed_details': failed
+        'assets': [encontrados[t] for t in tags if t in encontrados],
+        'unknown': [t for t in tags if t not in encontrados],
+        'total': len(tags)
     }), 200
 
 
@@ -670,43 +805,26 @@ def duplicate_asset():
     created_serials = []
     failed = []
 
-    for i in range(quantity):
+    # One reservation for the whole batch
+    new_serials = reservar_series_ativos(bd, quantity)
+
+    for i, new_serial in enumerate(new_serials):
         try:
-            # Generate new serial
-            new_serial = gerar_proximo_numero()
 
             # Create new asset
-            bd.execute(
+            new_id = insert_returning_id(
+                bd,
                 'INSERT INTO assets (serial_number, created_by, created_at) VALUES (?, ?, ?)',
                 (new_serial, user_id, datetime.now().isoformat())
             )
 
-            # Get the newly inserted ID (PostgreSQL compatible)
-            new_asset = bd.execute(
-                'SELECT id FROM assets WHERE serial_number = ?',
-                (new_serial,)
-            ).fetchone()
-            new_id = new_asset['id'] if new_asset else None
-
-            # Copy data (except excluded fields)
-            for field_name, field_value in data_dict.items():
-                if field_name in exclude_fields:
-                    continue
-                # Force condition_status = 'Suspenso'
-                if field_name == 'condition_status':
-                    field_value = 'Suspenso'
-                if field_value is not None:
-                    bd.execute(
-                        'INSERT INTO asset_data (asset_id, field_name, field_value) VALUES (?, ?, ?)',
-                        (new_id, field_name, field_value)
-                    )
-
-            # Ensure condition_status exists as Suspenso
-            if 'condition_status' not in data_dict:
-                bd.execute(
-                    'INSERT INTO asset_data (asset_id, field_name, field_value) VALUES (?, ?, ?)',
-                    (new_id, 'condition_status', 'Suspenso')
-                )
+            # Copy data (except excluded fields), forcing condition_status = 'Suspenso'
+            novos_campos = {
+                field_name: field_value for field_name, field_value in data_dict.items()
+                if field_name not in exclude_fields and field_value is not None
+            }
+            novos_campos['condition_status'] = 'Suspenso'
+            guardar_dados_ativo(bd, new_id, novos_campos)
 
             # Copy modules without serial_number
             for mod in original_modules:
@@ -765,59 +883,11 @@ def change_assets_status():
     if new_status not in valid_statuses:
         return jsonify({'error': f'Estado inválido. Estados válidos: {", ".join(valid_statuses)}'}), 400
 
-    bd = obter_bd()
-    user_id = g.utilizador_atual['user_id']
-
-    results = {'success': [], 'errors': []}
-
-    for sn in serial_numbers:
-        try:
-            asset = bd.execute(
-                'SELECT id FROM assets WHERE serial_number = ?',
-                (sn,)
-            ).fetchone()
-
-            if not asset:
-                results['errors'].append({'serial_number': sn, 'error': 'Ativo não encontrado'})
-                continue
-
-            asset_id = asset['id']
-
-            # Get previous status
-            prev_status_row = bd.execute('''
-                SELECT field_value FROM asset_data
-                WHERE asset_id = ? AND field_name = 'condition_status'
-            ''', (asset_id,)).fetchone()
-            prev_status = prev_status_row['field_value'] if prev_status_row else None
-
-            # Update status
-            bd.execute('''
-                INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                VALUES (?, 'condition_status', ?)
-            ''', (asset_id, new_status))
-
-            # Update timestamp
-            bd.execute('''
-                UPDATE assets SET updated_at = CURRENT_TIMESTAMP, updated_by = ?
-                WHERE id = ?
-            ''', (user_id, asset_id))
-
-            # Log status change
-            bd.execute('''
-                INSERT INTO status_change_log (asset_id, previous_status, new_status, description, changed_by)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (asset_id, prev_status, new_status, description, user_id))
-
-            results['success'].append({
-                'serial_number': sn,
-                'previous_status': prev_status,
-                'new_status': new_status
-            })
-
-        except Exception as e:
-            results['errors'].append({'serial_number': sn, 'error': str(e)})
+    if not isinstance(serial_numbers, list):
+        return jsonify({'error': 'serial_numbers deve ser uma lista'}), 400
 
-    bd.commit()
+    results = alterar_estado_ativos(obter_bd(), serial_numbers, new_status, description,
+                                    g.utilizador_atual['user_id'])
 
     return jsonify({
         'message': f'{len(results["success"])} ativo(s) atualizado(s)',
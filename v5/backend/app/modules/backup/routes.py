@@ -6,13 +6,19 @@ Database backup management with automatic scheduled backups.
 import os
 import shutil
 import logging
+import tempfile
 import zipfile
 import json
 import threading
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, send_file, current_app, g
 
-from ...shared.database import obter_bd, obter_config
+from ...shared.database import (
+    obter_bd, obter_config, obter_bd_para_tenant, consolidar_wal, libertar_bd_sqlite,
+    restaurar_bd_sqlite
+)
+from ...shared.directory import sincronizar_utilizadores_tenant
+from ...shared.migrations import migrar_tenant
 from ...shared.permissions import requer_admin
 
 logger = logging.getLogger(__name__)
@@ -86,6 +92,7 @@ def create_automatic_backup(base_path, tenant_id='smartlamppost'):
             logger.error(f"Database not found at {db_path}")
             return None
 
+        consolidar_wal(db_path)
         with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zf:
             # Add database
             zf.write(db_path, 'database.db')
@@ -164,6 +171,7 @@ def create_backup():
         backup_path = os.path.join(backup_dir, backup_filename)
 
         # Copy database
+        consolidar_wal(db_path)
         shutil.copy2(db_path, backup_path)
 
         # Get file size
@@ -294,14 +302,18 @@ def restore_backup(filename):
         # Create backup of current before restore
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         pre_restore_backup = os.path.join(backup_dir, f'pre_restore_{timestamp}.db')
+        # Closes pooled connections and folds the WAL into the file
+        libertar_bd_sqlite(db_path)
         shutil.copy2(db_path, pre_restore_backup)
 
         # Check if it's a ZIP backup or plain DB
         if filename.endswith('.zip'):
             # Extract ZIP backup
             with zipfile.ZipFile(backup_path, 'r') as zf:
-                # Extract database
-                zf.extract('database.db', tenant_dir)
+                # Extract database next to the live one, then copy it in
+                with tempfile.TemporaryDirectory(dir=tenant_dir) as temp_dir:
+                    zf.extract('database.db', temp_dir)
+                    restaurar_bd_sqlite(os.path.join(temp_dir, 'database.db'), db_path)
 
                 # Extract uploads if present
                 for name in zf.namelist():
@@ -309,7 +321,18 @@ def restore_backup(filename):
                         zf.extract(name, tenant_dir)
         else:
             # Plain DB file
-            shutil.copy2(backup_path, db_path)
+            restaurar_bd_sqlite(backup_path, db_path)
+
+        # Older backups predate the current schema; migrations only run at boot
+        migrar_tenant('smartlamppost')
+
+        # Restored users replace the current ones - reindex their emails
+        bd_restaurada = obter_bd_para_tenant('smartlamppost')
+        if bd_restaurada:
+            try:
+                sincronizar_utilizadores_tenant('smartlamppost', bd_restaurada)
+            finally:
+                bd_restaurada.close()
 
         return jsonify({
             'message': 'Backup restaurado com sucesso',
@@ -503,6 +526,7 @@ def create_full_backup():
         if not os.path.exists(db_path):
             return jsonify({'error': 'Base de dados não encontrada'}), 404
 
+        consolidar_wal(db_path)
         backup_dir = get_backup_dir()
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_filename = f'backup_{timestamp}.zip'
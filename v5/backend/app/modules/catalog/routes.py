@@ -17,7 +17,7 @@ import json
 import logging
 from flask import Blueprint, request, jsonify
 
-from ...shared.database import obter_bd_catalogo, extrair_valor
+from ...shared.database import obter_bd_catalogo, extrair_valor, insert_returning_id
 from ...shared.permissions import requer_autenticacao, requer_admin
 
 logger = logging.getLogger(__name__)
@@ -221,19 +221,12 @@ def add_pack():
         return jsonify({'error': 'Pack já existe'}), 400
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_packs (pack_name, pack_description, active)
             VALUES (?, ?, 1)
         ''', (dados['pack_name'], dados.get('pack_description', '')))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_pack = bd.execute(
-            'SELECT id FROM catalog_packs WHERE pack_name = ?',
-            (dados['pack_name'],)
-        ).fetchone()
-        new_id = new_pack['id'] if new_pack else None
-
         return jsonify({
             'message': 'Pack adicionado',
             'id': new_id
@@ -301,7 +294,7 @@ def add_column():
         return jsonify({'error': 'Referência já existe'}), 400
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_columns (
                 reference, description, pack, column_type, fixing, height_m, arm_count,
                 mod1, mod2, mod3, mod4, mod5, mod6, mod7, mod8, active
@@ -325,13 +318,6 @@ def add_column():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_col = bd.execute(
-            'SELECT id FROM catalog_columns WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_col['id'] if new_col else None
-
         return jsonify({
             'message': 'Coluna adicionada',
             'id': new_id
@@ -441,7 +427,7 @@ def add_luminaire():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_luminaires (
                 reference, description, luminaire_type, manufacturer_ref,
                 power_watts, voltage, current_amps, type_1, type_2, column_height_m, active
@@ -460,13 +446,6 @@ def add_luminaire():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_luminaires WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Luminária adicionada',
             'id': new_id
@@ -556,7 +535,7 @@ def add_electrical_panel():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_electrical_panels (
                 reference, description, panel_type, short_reference,
                 max_power_total, max_power_per_phase, phases, voltage, active
@@ -573,13 +552,6 @@ def add_electrical_panel():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_electrical_panels WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Quadro elétrico adicionado',
             'id': new_id
@@ -665,7 +637,7 @@ def add_fuse_box():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_fuse_boxes (
                 reference, description, fuse_type, short_reference,
                 max_power, voltage, type_s, type_d, active
@@ -682,13 +654,6 @@ def add_fuse_box():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_fuse_boxes WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Cofrete adicionado',
             'id': new_id
@@ -737,7 +702,7 @@ def add_telemetry_panel():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_telemetry_panels (
                 reference, description, panel_type, short_reference,
                 power_watts, voltage, active
@@ -752,13 +717,6 @@ def add_telemetry_panel():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_telemetry_panels WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Painel de telemetria adicionado',
             'id': new_id
@@ -807,7 +765,7 @@ def add_ev_charger():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_module_ev (
                 reference, description, module_type, short_reference,
                 power_watts, current_amps, voltage, connector_type, active
@@ -824,13 +782,6 @@ def add_ev_charger():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_module_ev WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Carregador EV adicionado',
             'id': new_id
@@ -879,7 +830,7 @@ def add_mupi():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_module_mupi (
                 reference, description, module_type, short_reference,
                 power_watts, size, active
@@ -894,13 +845,6 @@ def add_mupi():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_module_mupi WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'MUPI adicionado',
             'id': new_id
@@ -949,7 +893,7 @@ def add_lateral():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_module_lateral (
                 reference, description, module_type, short_reference,
                 lateral_type, active
@@ -963,13 +907,6 @@ def add_lateral():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_module_lateral WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Módulo lateral adicionado',
             'id': new_id
@@ -1018,7 +955,7 @@ def add_antenna():
     bd = obter_bd_catalogo()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO catalog_module_antenna (
                 reference, description, module_type, short_reference,
                 column_height_m, frequency, power_watts, active
@@ -1034,13 +971,6 @@ def add_antenna():
         ))
         bd.commit()
 
-        # Get the newly inserted ID
-        new_item = bd.execute(
-            'SELECT id FROM catalog_module_antenna WHERE reference = ?',
-            (dados['reference'],)
-        ).fetchone()
-        new_id = new_item['id'] if new_item else None
-
         return jsonify({
             'message': 'Antena adicionada',
             'id': new_id
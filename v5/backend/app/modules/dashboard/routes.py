@@ -10,11 +10,21 @@ from flask import Blueprint, jsonify, g
 
 from ...shared.database import obter_bd, extrair_valor
 from ...shared.permissions import requer_autenticacao
+from ...shared.query_plans import registar_consulta_critica
 
 logger = logging.getLogger(__name__)
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+_QUERY_ATIVIDADE_RECENTE = '''
+    SELECT al.*, u.email, u.first_name, u.last_name
+    FROM audit_log al
+    LEFT JOIN users u ON al.user_id = u.id
+    ORDER BY al.created_at DESC
+    LIMIT 20
+'''
+registar_consulta_critica('recent_audit_log', _QUERY_ATIVIDADE_RECENTE)
+
 
 @dashboard_bp.route('/stats', methods=['GET'])
 @requer_autenticacao
@@ -28,12 +38,11 @@ def get_stats():
     # Assets by status
     status_counts = bd.execute('''
         SELECT
-            COALESCE(ad.field_value, 'Sem estado') as status,
+            COALESCE(f.condition_status, f.status, 'Sem estado') as status,
             COUNT(*) as count
         FROM assets a
-        LEFT JOIN asset_data ad ON a.id = ad.asset_id
-            AND (ad.field_name = 'status' OR ad.field_name = 'condition_status')
-        GROUP BY ad.field_value
+        LEFT JOIN assets_flat f ON f.asset_id = a.id
+        GROUP BY COALESCE(f.condition_status, f.status, 'Sem estado')
     ''').fetchall()
 
     # Recent assets (last 30 days)
@@ -71,13 +80,7 @@ def get_recent_activity():
     """Get recent activity log."""
     bd = obter_bd()
 
-    activity = bd.execute('''
-        SELECT al.*, u.email, u.first_name, u.last_name
-        FROM audit_log al
-        LEFT JOIN users u ON al.user_id = u.id
-        ORDER BY al.created_at DESC
-        LIMIT 20
-    ''').fetchall()
+    activity = bd.execute(_QUERY_ATIVIDADE_RECENTE).fetchall()
 
     return jsonify([dict(a) for a in activity]), 200
 
@@ -9,7 +9,11 @@ import logging
 from datetime import datetime
 from flask import Blueprint, request, jsonify, send_file, g
 
-from ...shared.database import obter_bd, obter_bd_catalogo, extrair_valor, table_exists
+from ...shared.database import (
+    obter_bd, obter_bd_catalogo, extrair_valor, table_exists, insert_returning_id
+)
+from ...shared.asset_data import guardar_dados_ativo, sincronizar_assets_flat, registar_alteracoes
+from ...shared.sequences import reservar_series_ativos
 from ...shared.permissions import requer_admin, requer_autenticacao
 
 logger = logging.getLogger(__name__)
@@ -478,7 +482,8 @@ def get_import_template():
 def import_excel_preview():
     """
     Preview Excel import without committing changes.
-    Returns parsed data with validation status.
+    Returns parsed data with validation status. Takes the same
+    generate_serials option as the import.
     """
     try:
         import openpyxl
@@ -489,6 +494,7 @@ def import_excel_preview():
         return jsonify({'error': 'Ficheiro não fornecido'}), 400
 
     file = request.files['file']
+    gerar_series = request.form.get('generate_serials', 'false') == 'true'
     if not file.filename.endswith(('.xlsx', '.xls')):
         return jsonify({'error': 'Formato de ficheiro inválido. Use .xlsx ou .xls'}), 400
 
@@ -554,7 +560,10 @@ def import_excel_preview():
             warnings = []
 
             if not serial_number:
-                errors.append('Número de série vazio')
+                if gerar_series:
+                    warnings.append('Número de série vazio, será gerado automaticamente')
+                else:
+                    errors.append('Número de série vazio')
 
             if status and status not in ['ativo', 'inativo', 'manutencao', 'abatido', 'suspenso']:
                 warnings.append(f'Status "{status}" inválido, será convertido para "ativo"')
@@ -573,7 +582,7 @@ def import_excel_preview():
                     dynamic_fields[field_name] = str(row_data[label])
 
             # Check if exists
-            is_existing = serial_number in existing_serials
+            is_existing = bool(serial_number) and serial_number in existing_serials
             action = 'update' if is_existing else 'create'
 
             if errors:
@@ -627,6 +636,8 @@ def import_excel():
     - 'create_only': Only insert new records, skip existing
     - 'update_only': Only update existing records, skip new
     - 'upsert': Insert new and update existing (default)
+    With generate_serials=true, new rows without a serial number get one
+    from the asset counter; otherwise they are reported as errors.
     """
     try:
         import openpyxl
@@ -639,6 +650,7 @@ def import_excel():
     file = request.files['file']
     mode = request.form.get('mode', 'upsert')  # create_only, update_only, upsert
     convert_suspended = request.form.get('convert_suspended', 'true') == 'true'
+    gerar_series = request.form.get('generate_serials', 'false') == 'true'
 
     if mode not in ['create_only', 'update_only', 'upsert']:
         return jsonify({'error': 'Modo inválido. Use: create_only, update_only, upsert'}), 400
@@ -685,15 +697,26 @@ def import_excel():
         updated = 0
         skipped = 0
         errors = []
+        ativos_alterados = []
 
-        for row_num, row in enumerate(ws.iter_rows(min_row=data_start_row, values_only=True), data_start_row):
-            if not row or all(cell is None for cell in row):
-                continue
+        linhas = [
+            (row_num, dict(zip(headers, row)))
+            for row_num, row in enumerate(ws.iter_rows(min_row=data_start_row, values_only=True), data_start_row)
+            if row and not all(cell is None for cell in row)
+        ]
 
-            row_data = dict(zip(headers, row))
+        # Opt-in: new rows without a serial number take one from a single reserved block
+        series_geradas = iter(())
+        if gerar_series and mode != 'update_only':
+            sem_serie = sum(1 for _, row_data in linhas if not str(row_data.get(serial_col, '') or '').strip())
+            if sem_serie:
+                series_geradas = iter(reservar_series_ativos(bd, sem_serie))
 
+        for row_num, row_data in linhas:
             # Use detected column names
             serial_number = str(row_data.get(serial_col, '') or '').strip()
+            if not serial_number:
+                serial_number = next(series_geradas, None)
             if not serial_number:
                 errors.append(f'Linha {row_num}: Número de série vazio')
                 continue
@@ -742,19 +765,12 @@ def import_excel():
                         WHERE serial_number = ?
                     ''', (serial_number,))
 
-                    # Update dynamic fields in asset_data table
-                    for field_name, field_value in dynamic_fields.items():
-                        bd.execute('''
-                            INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                            VALUES (?, ?, ?)
-                        ''', (asset_id, field_name, str(field_value) if field_value is not None else None))
-
-                    # Store status as condition_status
+                    # Update dynamic fields in asset_data table (status stored as condition_status)
+                    campos = dict(dynamic_fields)
                     if status:
-                        bd.execute('''
-                            INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                            VALUES (?, 'condition_status', ?)
-                        ''', (asset_id, status))
+                        campos['condition_status'] = status
+                    guardar_dados_ativo(bd, asset_id, campos, sincronizar=False)
+                    ativos_alterados.append(asset_id)
 
                     updated += 1
                 else:
@@ -764,36 +780,25 @@ def import_excel():
                         continue
 
                     # Insert into assets table
-                    bd.execute('''
+                    asset_id = insert_returning_id(bd, '''
                         INSERT INTO assets (serial_number, created_at)
                         VALUES (?, CURRENT_TIMESTAMP)
                     ''', (serial_number,))
 
-                    # Get the newly inserted asset_id (PostgreSQL compatible)
-                    new_asset = bd.execute(
-                        'SELECT id FROM assets WHERE serial_number = ?',
-                        (serial_number,)
-                    ).fetchone()
-                    asset_id = new_asset['id'] if new_asset else None
-
-                    # Insert dynamic fields into asset_data table
-                    for field_name, field_value in dynamic_fields.items():
-                        bd.execute('''
-                            INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                            VALUES (?, ?, ?)
-                        ''', (asset_id, field_name, str(field_value) if field_value is not None else None))
-
-                    # Store status as condition_status
+                    # Insert dynamic fields into asset_data table (status stored as condition_status)
+                    campos = dict(dynamic_fields)
                     if status:
-                        bd.execute('''
-                            INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-                            VALUES (?, 'condition_status', ?)
-                        ''', (asset_id, status))
+                        campos['condition_status'] = status
+                    guardar_dados_ativo(bd, asset_id, campos, sincronizar=False)
+                    ativos_alterados.append(asset_id)
 
                     imported += 1
             except Exception as e:
                 errors.append(f'Linha {row_num}: {str(e)}')
 
+        # Refresh the flat projection once for every imported/updated asset
+        sincronizar_assets_flat(bd, ativos_alterados)
+        registar_alteracoes(bd, ativos_alterados)
         bd.commit()
 
         logger.info(f"Import completed: imported={imported}, updated={updated}, skipped={skipped}, errors={len(errors)}")
@@ -10,7 +10,11 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, g, send_file, current_app
 from werkzeug.utils import secure_filename
 
-from ...shared.database import obter_bd, obter_config
+from ...shared.database import obter_bd, obter_config, extrair_valor, insert_returning_id
+from ...shared.asset_data import guardar_dados_ativo
+from ...shared.pagination import paginar_por_cursor, dividir_pagina, obter_total
+from ...shared.query_plans import registar_consulta_critica
+from ...shared.sequences import reservar_numeros
 from ...shared.permissions import requer_autenticacao, requer_permissao
 
 logger = logging.getLogger(__name__)
@@ -20,32 +24,40 @@ interventions_bp = Blueprint('interventions', __name__)
 INTERVENTION_TYPES = ['preventiva', 'corretiva', 'substituicao', 'inspecao']
 INTERVENTION_STATUS = ['em_curso', 'concluida', 'cancelada']
 
+_SELECT_INTERVENCOES = '''
+    SELECT i.*, a.serial_number as asset_serial,
+           u.email as created_by_email, u.first_name as created_by_name
+    FROM interventions i
+    LEFT JOIN assets a ON i.asset_id = a.id
+    LEFT JOIN users u ON i.created_by = u.id
+'''
 
-def get_next_intervention_number(bd, int_type):
-    """Generate next intervention number."""
-    prefix_key = f'prefix_int_{int_type}'
-    prefix = obter_config(prefix_key, f'INT{int_type[0].upper()}')
-    digits = int(obter_config('prefix_int_digits', '9'))
 
-    counter = bd.execute(
-        'SELECT current_value FROM sequence_counters WHERE counter_type = ?',
-        (f'int_{int_type}',)
-    ).fetchone()
+def _consulta_pagina_intervencoes(where_sql, params, per_page, offset):
+    """Offset page query of the intervention listing (one extra row to detect more)."""
+    return (f'{_SELECT_INTERVENCOES} {where_sql} ORDER BY i.created_at DESC, i.id DESC LIMIT ? OFFSET ?',
+            list(params) + [per_page + 1, offset])
 
-    next_val = (counter['current_value'] if counter else 0) + 1
 
-    bd.execute('''
-        INSERT OR REPLACE INTO sequence_counters (counter_type, current_value, updated_at)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-    ''', (f'int_{int_type}', next_val))
+registar_consulta_critica('interventions_by_status', lambda bd: _consulta_pagina_intervencoes(
+    'WHERE 1=1 AND i.status = ?', ['em_curso'], 20, 0))
 
-    return f"{prefix}{str(next_val).zfill(digits)}"
+
+def get_next_intervention_number(bd, int_type):
+    """Reserve the next intervention number (committed with the intervention)."""
+    prefix = obter_config(f'prefix_int_{int_type}', f'INT{int_type[0].upper()}')
+    digits = int(obter_config('prefix_int_digits', '9'))
+    return reservar_numeros(bd, f'int_{int_type}', prefix, digits)[0]
 
 
 @interventions_bp.route('', methods=['GET'])
 @requer_autenticacao
 def list_interventions():
-    """List interventions with filters."""
+    """List interventions with filters.
+
+    Pages by ?page= (offset) or, when ?after= is present, by keyset cursor
+    (see assets.list_assets).
+    """
     bd = obter_bd()
 
     # Filters
@@ -54,40 +66,55 @@ def list_interventions():
     asset = request.args.get('asset')
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 20))
+    after = request.args.get('after')
 
     # Build query
-    query = '''
-        SELECT i.*, a.serial_number as asset_serial,
-               u.email as created_by_email, u.first_name as created_by_name
-        FROM interventions i
-        LEFT JOIN assets a ON i.asset_id = a.id
-        LEFT JOIN users u ON i.created_by = u.id
-        WHERE 1=1
-    '''
+    where_sql = 'WHERE 1=1'
     params = []
 
     if status:
-        query += ' AND i.status = ?'
+        where_sql += ' AND i.status = ?'
         params.append(status)
 
     if int_type:
-        query += ' AND i.intervention_type = ?'
+        where_sql += ' AND i.intervention_type = ?'
         params.append(int_type)
 
     if asset:
-        query += ' AND a.serial_number LIKE ?'
+        where_sql += ' AND a.serial_number LIKE ?'
         params.append(f'%{asset}%')
 
+    count_query = f'''
+        SELECT COUNT(*) as cnt FROM interventions i
+        LEFT JOIN assets a ON i.asset_id = a.id
+        {where_sql}
+    '''
+
+    if after is not None:
+        try:
+            interventions, next_cursor = paginar_por_cursor(
+                bd, _SELECT_INTERVENCOES, where_sql, params, after, per_page, 'i.created_at', 'i.id'
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify({
+            'data': [dict(i) for i in interventions],
+            'pagination': {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'total': obter_total(bd, 'interventions', count_query, params, request.args.get('total'))
+            }
+        }), 200
+
     # Count total
-    count_query = query.replace('SELECT i.*, a.serial_number as asset_serial, u.email as created_by_email, u.first_name as created_by_name', 'SELECT COUNT(*)')
-    count_result = bd.execute(count_query, params).fetchone()
-    total = count_result[0] if count_result else 0
+    total = extrair_valor(bd.execute(count_query, params).fetchone(), 0) or 0
 
     # Pagination
-    query += ' ORDER BY i.created_at DESC LIMIT ? OFFSET ?'
-    params.extend([per_page, (page - 1) * per_page])
-
-    interventions = bd.execute(query, params).fetchall()
+    interventions = bd.execute(
+        *_consulta_pagina_intervencoes(where_sql, params, per_page, (page - 1) * per_page)
+    ).fetchall()
+    interventions, next_cursor = dividir_pagina(interventions, per_page)
 
     return jsonify({
         'data': [dict(i) for i in interventions],
@@ -95,7 +122,8 @@ def list_interventions():
             'page': page,
             'per_page': per_page,
             'total': total,
-            'pages': (total + per_page - 1) // per_page
+            'pages': (total + per_page - 1) // per_page,
+            'next_cursor': next_cursor
         }
     }), 200
 
@@ -187,8 +215,7 @@ def create_intervention():
     if not asset:
         return jsonify({'error': 'Ativo nao encontrado'}), 404
 
-    # Generate intervention code
-    # Note: We use a simple approach here - in production you might want a transaction
+    # Generate intervention code (the counter stays locked until the commit below)
     int_code = get_next_intervention_number(bd, int_type)
 
     # Get current asset status
@@ -199,7 +226,7 @@ def create_intervention():
     previous_status = asset_data['field_value'] if asset_data else None
 
     # Insert intervention
-    bd.execute('''
+    intervention_id = insert_returning_id(bd, '''
         INSERT INTO interventions (
             asset_id, intervention_type, problem_description, notes,
             status, previous_asset_status, created_by, created_at
@@ -213,13 +240,6 @@ def create_intervention():
         user_id
     ))
 
-    # Get the newly inserted ID (PostgreSQL compatible)
-    new_intervention = bd.execute(
-        'SELECT id FROM interventions WHERE asset_id = ? ORDER BY id DESC LIMIT 1',
-        (asset['id'],)
-    ).fetchone()
-    intervention_id = new_intervention['id'] if new_intervention else None
-
     # Add technicians if provided
     technicians = dados.get('technicians', [])
     for tech in technicians:
@@ -234,10 +254,7 @@ def create_intervention():
         ))
 
     # Update asset status to "Em Reparação"
-    bd.execute('''
-        INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-        VALUES (?, 'condition_status', 'Em Reparação')
-    ''', (asset['id'],))
+    guardar_dados_ativo(bd, asset['id'], {'condition_status': 'Em Reparação'})
 
     # Log status change
     bd.execute('''
@@ -340,10 +357,7 @@ def complete_intervention(intervention_id):
     ''', (solution, final_status, total_hours, user_id, intervention_id))
 
     # Update asset status
-    bd.execute('''
-        INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-        VALUES (?, 'condition_status', ?)
-    ''', (intervention['asset_id'], final_status))
+    guardar_dados_ativo(bd, intervention['asset_id'], {'condition_status': final_status})
 
     # Log status change
     bd.execute('''
@@ -382,10 +396,8 @@ def cancel_intervention(intervention_id):
 
     # Restore previous asset status
     if intervention['previous_asset_status']:
-        bd.execute('''
-            INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value)
-            VALUES (?, 'condition_status', ?)
-        ''', (intervention['asset_id'], intervention['previous_asset_status']))
+        guardar_dados_ativo(bd, intervention['asset_id'],
+                            {'condition_status': intervention['previous_asset_status']})
 
     bd.commit()
     return jsonify({'message': 'Intervencao cancelada'}), 200
@@ -453,7 +465,7 @@ def upload_file(intervention_id):
     file.save(file_path)
 
     # Save to database
-    bd.execute('''
+    file_id = insert_returning_id(bd, '''
         INSERT INTO intervention_files (
             intervention_id, file_category, file_name, original_name,
             file_path, file_type, file_size, description, uploaded_by
@@ -469,13 +481,6 @@ def upload_file(intervention_id):
         request.form.get('description', ''),
         user_id
     ))
-
-    # Get the newly inserted ID (PostgreSQL compatible)
-    new_file = bd.execute(
-        'SELECT id FROM intervention_files WHERE file_name = ?',
-        (unique_name,)
-    ).fetchone()
-    file_id = new_file['id'] if new_file else None
     bd.commit()
 
     return jsonify({'id': file_id, 'message': 'Ficheiro carregado'}), 201
@@ -759,7 +764,7 @@ def upload_multiple_files(intervention_id):
             file.save(file_path)
 
             # Save to database
-            bd.execute('''
+            file_id = insert_returning_id(bd, '''
                 INSERT INTO intervention_files (
                     intervention_id, file_category, file_name, original_name,
                     file_path, file_type, file_size, description, uploaded_by
@@ -775,13 +780,6 @@ def upload_multiple_files(intervention_id):
                 description,
                 user_id
             ))
-
-            # Get the newly inserted ID (PostgreSQL compatible)
-            new_file = bd.execute(
-                'SELECT id FROM intervention_files WHERE file_name = ?',
-                (unique_name,)
-            ).fetchone()
-            file_id = new_file['id'] if new_file else None
             uploaded.append({
                 'id': file_id,
                 'name': original_name,
@@ -11,8 +11,9 @@ from datetime import datetime
 
 from flask import Blueprint, request, jsonify, g
 
-from ...shared.database import obter_bd, extrair_valor
+from ...shared.database import obter_bd, extrair_valor, carregar_dados_ativos
 from ...shared.permissions import requer_autenticacao, requer_permissao
+from ...shared.query_plans import registar_consulta_critica
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +22,15 @@ OSRM_API_URL = "https://router.project-osrm.org"
 
 map_bp = Blueprint('map', __name__)
 
+_QUERY_INTERVENCOES_ATIVO = '''
+    SELECT id, intervention_type, status, created_at
+    FROM interventions
+    WHERE asset_id = ?
+    ORDER BY created_at DESC
+    LIMIT 5
+'''
+registar_consulta_critica('asset_interventions', _QUERY_INTERVENCOES_ATIVO, (1,))
+
 
 @map_bp.route('/assets', methods=['GET'])
 @requer_permissao('assets', 'view')
@@ -35,14 +45,15 @@ def get_map_assets():
     # Get all assets
     assets = bd.execute('SELECT * FROM assets ORDER BY serial_number').fetchall()
 
+    # Get the fields shown on the map for all assets
+    dados = carregar_dados_ativos(bd, [a['id'] for a in assets], [
+        'gps_latitude', 'gps_longitude', 'condition_status', 'municipality',
+        'street_address', 'model', 'manufacturer'
+    ])
+
     result = []
     for asset in assets:
-        # Get asset fields
-        fields_data = bd.execute('''
-            SELECT field_name, field_value FROM asset_data WHERE asset_id = ?
-        ''', (asset['id'],)).fetchall()
-
-        fields = {f['field_name']: f['field_value'] for f in fields_data}
+        fields = dados[asset['id']]
 
         # Only include assets with GPS coordinates
         lat = fields.get('gps_latitude')
@@ -103,13 +114,7 @@ def get_map_asset_detail(serial_number):
     fields = {f['field_name']: f['field_value'] for f in fields_data}
 
     # Get recent interventions
-    interventions = bd.execute('''
-        SELECT id, intervention_type, status, created_at
-        FROM interventions
-        WHERE asset_serial = ?
-        ORDER BY created_at DESC
-        LIMIT 5
-    ''', (serial_number,)).fetchall()
+    interventions = bd.execute(_QUERY_INTERVENCOES_ATIVO, (asset['id'],)).fetchall()
 
     return jsonify({
         'id': asset['id'],
@@ -152,19 +157,20 @@ def get_map_interventions():
 
     interventions = bd.execute(query, params).fetchall()
 
+    # Get asset GPS coordinates using asset_id directly
+    dados = carregar_dados_ativos(
+        bd,
+        [i['asset_id'] for i in interventions if i['asset_id']],
+        ['gps_latitude', 'gps_longitude', 'street_address', 'municipality']
+    )
+
     result = []
     for intervention in interventions:
-        # Get asset GPS coordinates using asset_id directly
         asset_id = intervention['asset_id']
         if not asset_id:
             continue
 
-        fields_data = bd.execute('''
-            SELECT field_name, field_value FROM asset_data
-            WHERE asset_id = ? AND field_name IN ('gps_latitude', 'gps_longitude', 'street_address', 'municipality')
-        ''', (asset_id,)).fetchall()
-
-        fields = {f['field_name']: f['field_value'] for f in fields_data}
+        fields = dados[asset_id]
 
         lat = fields.get('gps_latitude')
         lng = fields.get('gps_longitude')
@@ -299,13 +305,14 @@ def get_map_statistics():
     municipalities = {}
     statuses = {}
 
-    for asset in assets:
-        fields_data = bd.execute('''
-            SELECT field_name, field_value FROM asset_data
-            WHERE asset_id = ? AND field_name IN ('gps_latitude', 'gps_longitude', 'municipality', 'condition_status')
-        ''', (asset['id'],)).fetchall()
+    dados = carregar_dados_ativos(
+        bd,
+        [a['id'] for a in assets],
+        ['gps_latitude', 'gps_longitude', 'municipality', 'condition_status']
+    )
 
-        fields = {f['field_name']: f['field_value'] for f in fields_data}
+    for asset in assets:
+        fields = dados[asset['id']]
 
         if fields.get('gps_latitude') and fields.get('gps_longitude'):
             assets_with_gps += 1
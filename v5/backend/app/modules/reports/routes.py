@@ -8,7 +8,7 @@ import logging
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify
 
-from ...shared.database import obter_bd, extrair_valor
+from ...shared.database import obter_bd, extrair_valor, hidratar_ativos
 from ...shared.permissions import requer_autenticacao
 
 logger = logging.getLogger(__name__)
@@ -528,19 +528,7 @@ def _build_assets_report(bd, columns, filters, group_by, order_by, order_dir, in
     assets = bd.execute(query, params).fetchall()
 
     # Enrich with asset_data fields
-    result_data = []
-    for asset in assets:
-        asset_dict = dict(asset)
-
-        # Get dynamic fields
-        fields = bd.execute('''
-            SELECT field_name, field_value FROM asset_data WHERE asset_id = ?
-        ''', (asset['id'],)).fetchall()
-
-        for f in fields:
-            asset_dict[f['field_name']] = f['field_value']
-
-        result_data.append(asset_dict)
+    result_data = hidratar_ativos(bd, assets)
 
     # Apply filters on enriched data
     if filters:
@@ -6,7 +6,7 @@ Technician management for interventions.
 import logging
 from flask import Blueprint, request, jsonify
 
-from ...shared.database import obter_bd, extrair_valor
+from ...shared.database import obter_bd, extrair_valor, insert_returning_id
 from ...shared.permissions import requer_login, requer_permissao
 
 logger = logging.getLogger(__name__)
@@ -96,7 +96,7 @@ def create_technician():
     bd = obter_bd()
 
     try:
-        bd.execute('''
+        new_id = insert_returning_id(bd, '''
             INSERT INTO technicians (nome, tipo, empresa, telefone, email, especialidade, notas, ativo)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
@@ -111,13 +111,6 @@ def create_technician():
         ))
         bd.commit()
 
-        # Get the newly inserted ID (PostgreSQL compatible)
-        new_tech = bd.execute(
-            'SELECT id FROM technicians WHERE nome = ? AND email = ?',
-            (dados['nome'], dados.get('email', ''))
-        ).fetchone()
-        new_id = new_tech['id'] if new_tech else None
-
         return jsonify({
             'message': 'Técnico criado com sucesso',
             'id': new_id
@@ -0,0 +1,458 @@
+"""
+SmartLamppost v5.0 - Asset Data Write Path
+Single place where dynamic asset fields (asset_data) are written, keeping
+the assets_flat projection and the asset_changes log in the same
+transaction.
+
+assets_flat holds one row per asset with typed columns for the fields that
+analytics, alerts and the map filter on, so those queries use plain
+indexed columns instead of pivoting asset_data several times.
+
+asset_changes holds one row per asset with the sequence number of its last
+change (or deletion), which is what GET /api/assets/changes pages through.
+It is written by the mutators only; rebuilding assets_flat leaves it alone.
+"""
+
+import re
+import json
+import logging
+from datetime import datetime
+
+from flask import g
+
+from .database import carregar_dados_ativos, obter_bd_catalogo, inserir_em_massa, ASSET_DATA_CHUNK_SIZE
+from .sequences import reservar_bloco
+
+logger = logging.getLogger(__name__)
+
+
+# Hot fields projected into assets_flat, by column type
+COLUNAS_FLAT_TEXTO = (
+    'status', 'condition_status', 'installation_location', 'municipality',
+    'street_address', 'rfid_tag', 'product_reference', 'manufacturer', 'model'
+)
+COLUNAS_FLAT_NUMERO = ('gps_latitude', 'gps_longitude')
+COLUNAS_FLAT_DATA = (
+    'installation_date', 'last_inspection_date', 'next_inspection_date',
+    'next_maintenance_date', 'warranty_end_date'
+)
+CAMPOS_FLAT = COLUNAS_FLAT_TEXTO + COLUNAS_FLAT_NUMERO + COLUNAS_FLAT_DATA
+
+COLUNAS_ASSET_DATA = ('asset_id', 'field_name', 'field_value', 'value_num', 'value_date')
+
+# field_type values whose asset_data rows get a value_num / value_date shadow
+TIPOS_NUMERO = ('number', 'decimal', 'integer')
+TIPOS_DATA = ('date', 'datetime')
+
+_RE_DATA_ISO = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})')
+_RE_DATA_PT = re.compile(r'^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})')
+
+
+# =========================================================================
+# VALUE NORMALIZATION
+# =========================================================================
+
+def normalizar_numero(valor):
+    """Parse a stored field value as a number (accepts decimal commas)."""
+    if valor is None:
+        return None
+    texto = str(valor).strip().replace(',', '.')
+    if not texto:
+        return None
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+
+def normalizar_data(valor):
+    """Parse a stored field value as a date and return it as YYYY-MM-DD.
+
+    Accepts ISO dates/datetimes (as written by the UI and Excel imports)
+    and DD/MM/YYYY. Anything else returns None.
+    """
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    m = _RE_DATA_ISO.match(texto)
+    if m:
+        ano, mes, dia = m.groups()
+    else:
+        m = _RE_DATA_PT.match(texto)
+        if not m:
+            return None
+        dia, mes, ano = m.groups()
+    try:
+        return datetime(int(ano), int(mes), int(dia)).date().isoformat()
+    except ValueError:
+        return None
+
+
+# =========================================================================
+# FIELD TYPES
+# =========================================================================
+
+def _ler_tipos_campos(bd):
+    """Read {field_name: field_type} of the typed fields of a tenant."""
+    tipos = {}
+    try:
+        for row in obter_bd_catalogo().execute('SELECT field_name, field_type FROM field_catalog').fetchall():
+            tipos[row['field_name']] = row['field_type']
+    except Exception as e:
+        logger.debug("Field catalog not available for field types: %s", e)
+    for row in bd.execute('SELECT field_name, field_type FROM schema_fields').fetchall():
+        tipos[row['field_name']] = row['field_type']
+
+    tipados = TIPOS_NUMERO + TIPOS_DATA
+    return {nome: tipo for nome, tipo in tipos.items() if tipo in tipados}
+
+
+def obter_tipos_campos(bd):
+    """Return {field_name: field_type} for the typed (number/date) fields.
+
+    Types come from the shared field_catalog, overridden by the tenant's
+    own schema_fields. Cached per connection for the duration of the request.
+    """
+    if not g:
+        return _ler_tipos_campos(bd)
+
+    cache = g.setdefault('_tipos_campos', {})
+    if id(bd) not in cache:
+        cache[id(bd)] = _ler_tipos_campos(bd)
+    return cache[id(bd)]
+
+
+def valores_tipados(field_type, valor):
+    """Return the (value_num, value_date) shadow values of a field value."""
+    if field_type in TIPOS_NUMERO:
+        return normalizar_numero(valor), None
+    if field_type in TIPOS_DATA:
+        return None, normalizar_data(valor)
+    return None, None
+
+
+# =========================================================================
+# WRITES
+# =========================================================================
+
+def guardar_dados_ativo(bd, asset_id, campos, sincronizar=True):
+    """Write dynamic fields of one asset, refresh its flat row and log the change.
+
+    Does not commit: callers keep controlling the transaction.
+
+    Args:
+        bd: Tenant database connection
+        asset_id: Asset id
+        campos: dict {field_name: value}; values are stored as text
+        sincronizar: Refresh assets_flat and log the change now. Bulk writers
+            pass False and call sincronizar_assets_flat and
+            registar_alteracoes once for all touched assets.
+    """
+    guardar_dados_ativos(bd, {asset_id: campos}, sincronizar)
+
+
+def guardar_dados_ativos(bd, campos_por_ativo, sincronizar=True):
+    """Write dynamic fields of many assets in one bulk upsert (no commit).
+
+    Args:
+        bd: Tenant database connection
+        campos_por_ativo: dict {asset_id: {field_name: value}}
+        sincronizar: Refresh the assets_flat rows of those assets and log
+            them in asset_changes now
+    """
+    linhas = [
+        (asset_id, field_name, str(value) if value is not None else None, value)
+        for asset_id, campos in campos_por_ativo.items()
+        for field_name, value in campos.items()
+    ]
+    tipos = obter_tipos_campos(bd) if linhas else {}
+    inserir_em_massa(
+        bd, 'asset_data', COLUNAS_ASSET_DATA,
+        [(asset_id, field_name, texto, *valores_tipados(tipos.get(field_name), value))
+         for asset_id, field_name, texto, value in linhas],
+        chave_conflito=('asset_id', 'field_name'),
+        atualizar=COLUNAS_ASSET_DATA[2:]
+    )
+
+    if sincronizar:
+        sincronizar_assets_flat(bd, list(campos_por_ativo))
+        registar_alteracoes(bd, list(campos_por_ativo))
+
+
+def alterar_estado_ativos(bd, serial_numbers, novo_estado, descricao, user_id,
+                          tamanho_lote=ASSET_DATA_CHUNK_SIZE):
+    """Set condition_status of many assets with set-based statements.
+
+    Each chunk of tamanho_lote serials is one transaction: ids and previous
+    statuses are read with one query each, then asset_data/assets_flat,
+    assets.updated_at and status_change_log are written in bulk and the
+    chunk is committed. A failing chunk is rolled back and reported.
+
+    Returns:
+        dict: {'success': [{serial_number, previous_status, new_status}],
+               'errors': [{serial_number, error}]}, in input order
+    """
+    serials = list(dict.fromkeys(serial_numbers))
+    sucesso = {}
+    erros = {}
+
+    for inicio in range(0, len(serials), tamanho_lote):
+        bloco = serials[inicio:inicio + tamanho_lote]
+        try:
+            marcadores = ', '.join('?' * len(bloco))
+            ids = {
+                row['serial_number']: row['id'] for row in bd.execute(
+                    f'SELECT id, serial_number FROM assets WHERE serial_number IN ({marcadores})', bloco
+                ).fetchall()
+            }
+            if not ids:
+                erros.update((sn, 'Ativo não encontrado') for sn in bloco)
+                continue
+
+            marcadores_ids = ', '.join('?' * len(ids))
+            anteriores = {
+                row['asset_id']: row['field_value'] for row in bd.execute(f'''
+                    SELECT asset_id, field_value FROM asset_data
+                    WHERE field_name = 'condition_status' AND asset_id IN ({marcadores_ids})
+                ''', list(ids.values())).fetchall()
+            }
+
+            guardar_dados_ativos(bd, {asset_id: {'condition_status': novo_estado} for asset_id in ids.values()})
+            bd.execute(f'''
+                UPDATE assets SET updated_at = CURRENT_TIMESTAMP, updated_by = ?
+                WHERE id IN ({marcadores_ids})
+            ''', [user_id] + list(ids.values()))
+            inserir_em_massa(
+                bd, 'status_change_log',
+                ('asset_id', 'previous_status', 'new_status', 'description', 'changed_by'),
+                [(asset_id, anteriores.get(asset_id), novo_estado, descricao, user_id)
+                 for asset_id in ids.values()]
+            )
+            bd.commit()
+        except Exception as e:
+            bd.rollback()
+            logger.error("Status change failed for %d assets: %s", len(bloco), e)
+            erros.update((sn, str(e)) for sn in bloco)
+            continue
+
+        for sn in bloco:
+            if sn in ids:
+                sucesso[sn] = anteriores.get(ids[sn])
+            else:
+                erros[sn] = 'Ativo não encontrado'
+
+    return {
+        'success': [{'serial_number': sn, 'previous_status': sucesso[sn], 'new_status': novo_estado}
+                    for sn in serials if sn in sucesso],
+        'errors': [{'serial_number': sn, 'error': erros[sn]} for sn in serials if sn in erros]
+    }
+
+
+def eliminar_ativos(bd, serial_numbers, user_id, tamanho_lote=ASSET_DATA_CHUNK_SIZE, progresso=None):
+    """Delete many assets with set-based statements, one transaction per chunk.
+
+    Each chunk resolves its ids and loads the old field values for the audit
+    trail in one query each, deletes asset_data/assets_flat, module serials,
+    status history and the assets with IN (...) statements, writes the
+    BULK_DELETE audit rows in one batch and commits.
+
+    Args:
+        progresso: Optional callable progresso(processed, failed) called
+            after every chunk
+
+    Returns:
+        dict: {'deleted': [serials], 'failed': [{serial_number, error}]}
+    """
+    serials = list(dict.fromkeys(serial_numbers))
+    apagados = []
+    falhados = []
+
+    for inicio in range(0, len(serials), tamanho_lote):
+        bloco = serials[inicio:inicio + tamanho_lote]
+        try:
+            marcadores = ', '.join('?' * len(bloco))
+            ids = {
+                row['serial_number']: row['id'] for row in bd.execute(
+                    f'SELECT id, serial_number FROM assets WHERE serial_number IN ({marcadores})', bloco
+                ).fetchall()
+            }
+            if ids:
+                lista_ids = list(ids.values())
+                marcadores_ids = ', '.join('?' * len(lista_ids))
+                dados_antigos = carregar_dados_ativos(bd, lista_ids)
+
+                registar_alteracoes(bd, lista_ids, eliminados=True)
+                remover_dados_ativos(bd, lista_ids)
+                for tabela in ('asset_module_serials', 'status_change_log'):
+                    bd.execute(f'DELETE FROM {tabela} WHERE asset_id IN ({marcadores_ids})', lista_ids)
+                bd.execute(f'DELETE FROM assets WHERE id IN ({marcadores_ids})', lista_ids)
+
+                inserir_em_massa(
+                    bd, 'audit_log',
+                    ('user_id', 'action', 'table_name', 'record_id', 'old_values', 'new_values'),
+                    [(user_id, 'BULK_DELETE', 'assets', asset_id,
+                      json.dumps({'serial_number': sn, **dados_antigos[asset_id]}, default=str), None)
+                     for sn, asset_id in ids.items()]
+                )
+            bd.commit()
+        except Exception as e:
+            bd.rollback()
+            logger.error("Bulk delete failed for %d assets: %s", len(bloco), e)
+            falhados.extend({'serial_number': sn, 'error': str(e)} for sn in bloco)
+        else:
+            for sn in bloco:
+                if sn in ids:
+                    apagados.append(sn)
+                else:
+                    falhados.append({'serial_number': sn, 'error': 'Ativo não encontrado'})
+
+        if progresso:
+            progresso(len(apagados) + len(falhados), len(falhados))
+
+    return {'deleted': apagados, 'failed': falhados}
+
+
+def remover_dados_ativos(bd, asset_ids):
+    """Delete the dynamic fields and flat rows of the given assets (no commit)."""
+    ids = list(asset_ids)
+    for inicio in range(0, len(ids), ASSET_DATA_CHUNK_SIZE):
+        bloco = ids[inicio:inicio + ASSET_DATA_CHUNK_SIZE]
+        marcadores = ', '.join('?' * len(bloco))
+        bd.execute(f'DELETE FROM asset_data WHERE asset_id IN ({marcadores})', bloco)
+        bd.execute(f'DELETE FROM assets_flat WHERE asset_id IN ({marcadores})', bloco)
+
+
+# =========================================================================
+# FLAT PROJECTION
+# =========================================================================
+
+_COLUNAS_INSERT = ('asset_id', 'serial_number') + CAMPOS_FLAT + ('updated_at',)
+
+
+def _linha_flat(asset_id, serial_number, campos, agora):
+    """Build the typed assets_flat row of one asset."""
+    linha = [asset_id, serial_number]
+    linha.extend(campos.get(c) for c in COLUNAS_FLAT_TEXTO)
+    linha.extend(normalizar_numero(campos.get(c)) for c in COLUNAS_FLAT_NUMERO)
+    linha.extend(normalizar_data(campos.get(c)) for c in COLUNAS_FLAT_DATA)
+    linha.append(agora)
+    return linha
+
+
+def sincronizar_assets_flat(bd, asset_ids):
+    """Recompute the assets_flat rows of the given assets (no commit).
+
+    Assets that no longer exist lose their flat row. Only the projection is
+    touched: rebuilds and backfills do not count as asset changes.
+    """
+    ids = list(dict.fromkeys(asset_ids))
+    agora = datetime.now().isoformat()
+
+    for inicio in range(0, len(ids), ASSET_DATA_CHUNK_SIZE):
+        bloco = ids[inicio:inicio + ASSET_DATA_CHUNK_SIZE]
+        marcadores = ', '.join('?' * len(bloco))
+
+        assets = bd.execute(
+            f'SELECT id, serial_number FROM assets WHERE id IN ({marcadores})', bloco
+        ).fetchall()
+        dados = carregar_dados_ativos(bd, [a['id'] for a in assets], CAMPOS_FLAT)
+
+        bd.execute(f'DELETE FROM assets_flat WHERE asset_id IN ({marcadores})', bloco)
+        inserir_em_massa(bd, 'assets_flat', _COLUNAS_INSERT, [
+            _linha_flat(asset['id'], asset['serial_number'], dados[asset['id']], agora)
+            for asset in assets
+        ])
+
+
+# =========================================================================
+# CHANGE LOG
+# =========================================================================
+
+# sequence_counters entries: last change sequence handed out, and the
+# highest sequence whose deletion record has been purged
+CONTADOR_ALTERACOES = 'asset_changes'
+CONTADOR_ALTERACOES_PURGADAS = 'asset_changes_purged'
+
+_COLUNAS_ALTERACOES = ('asset_id', 'serial_number', 'change_seq', 'deleted', 'changed_at')
+
+
+def registar_alteracoes(bd, asset_ids, eliminados=False):
+    """Stamp assets with new change sequence numbers (no commit).
+
+    Called by the asset mutators; deletions must be logged before the
+    assets rows go, while their serial numbers can still be read.
+
+    The block comes from sequence_counters, whose row stays locked until
+    the caller commits, so sequence order matches commit order and a
+    client that has seen sequence N never misses a later commit below N.
+
+    Args:
+        asset_ids: Ids of the created/updated (or deleted) assets
+        eliminados: Log the assets as deleted
+    """
+    ids = list(dict.fromkeys(asset_ids))
+    agora = datetime.now().isoformat()
+
+    for inicio in range(0, len(ids), ASSET_DATA_CHUNK_SIZE):
+        bloco = ids[inicio:inicio + ASSET_DATA_CHUNK_SIZE]
+        assets = bd.execute(
+            f"SELECT id, serial_number FROM assets WHERE id IN ({', '.join('?' * len(bloco))})", bloco
+        ).fetchall()
+        if not assets:
+            continue
+        primeiro = reservar_bloco(bd, CONTADOR_ALTERACOES, len(assets))
+        inserir_em_massa(
+            bd, 'asset_changes', _COLUNAS_ALTERACOES,
+            [(asset['id'], asset['serial_number'], primeiro + i, 1 if eliminados else 0, agora)
+             for i, asset in enumerate(assets)],
+            chave_conflito=('asset_id',),
+            atualizar=_COLUNAS_ALTERACOES[1:]
+        )
+
+
+def reconstruir_assets_flat(bd):
+    """Rebuild the whole assets_flat table of a tenant from asset_data.
+
+    Not an asset change: nothing is written to asset_changes.
+
+    Returns:
+        int: Number of assets projected
+    """
+    bd.execute('DELETE FROM assets_flat')
+    ids = [row['id'] for row in bd.execute('SELECT id FROM assets').fetchall()]
+    sincronizar_assets_flat(bd, ids)
+    bd.commit()
+    logger.info("assets_flat rebuilt with %d assets", len(ids))
+    return len(ids)
+
+
+def reconstruir_valores_tipados(bd, campos=None):
+    """Recompute value_num/value_date of asset_data from field_value.
+
+    Args:
+        bd: Tenant database connection
+        campos: Only these field names (e.g. after a field_type change);
+            default is every typed field.
+
+    Returns:
+        int: Number of rows updated
+    """
+    tipos = _ler_tipos_campos(bd)
+    if g:
+        g.pop('_tipos_campos', None)
+    nomes = list(campos) if campos is not None else list(tipos)
+    if not nomes:
+        return 0
+
+    marcadores = ', '.join('?' * len(nomes))
+    rows = bd.execute(
+        f'SELECT id, field_name, field_value FROM asset_data WHERE field_name IN ({marcadores})',
+        nomes
+    ).fetchall()
+    bd.executemany(
+        'UPDATE asset_data SET value_num = ?, value_date = ? WHERE id = ?',
+        [(*valores_tipados(tipos.get(row['field_name']), row['field_value']), row['id']) for row in rows]
+    )
+    bd.commit()
+    logger.info("asset_data typed values rebuilt for %d rows", len(rows))
+    return len(rows)
@@ -0,0 +1,191 @@
+"""
+SmartLamppost v5.0 - Asset Listing Filters
+Compiles ?filter=field:op:value and ?sort=[-]field into SQL over the
+assets listing (outer alias a).
+
+Each field is answered from the cheapest indexed source:
+
+- assets columns (serial_number, created_at, updated_at)
+- assets_flat typed columns for the hot fields
+- asset_data for every other field, on its (field_name, value_num /
+  value_date / field_value) indexes
+
+Filters become 'a.id IN (...)' subqueries, so the count query uses them
+unchanged; sorting adds one LEFT JOIN to the page query only.
+
+'ne' is the complement of 'eq' (a.id NOT IN (... eq ...)), so assets
+without the field match it. Sorting puts assets without the field last in
+both directions, on SQLite and PostgreSQL alike.
+"""
+
+import re
+from datetime import date, timedelta
+
+from .asset_data import (
+    COLUNAS_FLAT_NUMERO, COLUNAS_FLAT_DATA, CAMPOS_FLAT, TIPOS_NUMERO, TIPOS_DATA,
+    normalizar_numero, normalizar_data, obter_tipos_campos
+)
+
+# op -> SQL comparison ('in' takes values separated by '|')
+OPERADORES = {
+    'eq': '=', 'ne': '<>', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>=',
+    'contains': 'LIKE', 'in': 'IN',
+}
+
+# Most values accepted by one 'in' filter
+FILTRO_IN_MAX = 500
+
+COLUNAS_ASSETS = ('serial_number', 'created_at', 'updated_at')
+
+# Timestamp columns: a day value matches the whole day [day, day + 1)
+COLUNAS_TIMESTAMP = ('created_at', 'updated_at')
+
+_RE_CAMPO = re.compile(r'^[a-z][a-z0-9_]{0,63}$')
+
+
+def _escapar_like(valor):
+    return valor.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _tipo_campo(bd, campo):
+    """Return 'number', 'date' or 'text' for a field."""
+    if campo in COLUNAS_FLAT_NUMERO:
+        return 'number'
+    if campo in COLUNAS_FLAT_DATA:
+        return 'date'
+    tipo = obter_tipos_campos(bd).get(campo)
+    if tipo in TIPOS_NUMERO:
+        return 'number'
+    if tipo in TIPOS_DATA:
+        return 'date'
+    return 'text'
+
+
+def _converter(tipo, campo, valor):
+    if tipo == 'number':
+        convertido = normalizar_numero(valor)
+    elif tipo == 'date':
+        convertido = normalizar_data(valor)
+    else:
+        return valor
+    if convertido is None:
+        raise ValueError(f'Valor inválido para {campo}: {valor}')
+    return convertido
+
+
+def _coluna_asset_data(tipo):
+    return {'number': 'value_num', 'date': 'value_date'}.get(tipo, 'field_value')
+
+
+def _filtro_timestamp(campo, op, valor):
+    """Compile a filter on a timestamp column, comparing on day ranges."""
+    if op == 'contains':
+        raise ValueError(f'Operador contains só se aplica a campos de texto: {campo}')
+    dias = [_converter('date', campo, v) for v in valor.split('|')] if op == 'in' else \
+        [_converter('date', campo, valor)]
+    if len(dias) > FILTRO_IN_MAX:
+        raise ValueError(f'Máximo de {FILTRO_IN_MAX} valores por filtro in')
+    seguinte = [(date.fromisoformat(d) + timedelta(days=1)).isoformat() for d in dias]
+    coluna = f'a.{campo}'
+
+    if op in ('eq', 'in'):
+        partes = [f'({coluna} >= ? AND {coluna} < ?)'] * len(dias)
+        params = [p for par in zip(dias, seguinte) for p in par]
+        return f"({' OR '.join(partes)})", params
+    if op == 'ne':
+        return f'({coluna} IS NULL OR {coluna} < ? OR {coluna} >= ?)', [dias[0], seguinte[0]]
+    return {
+        'lt': (f'{coluna} < ?', [dias[0]]),
+        'lte': (f'{coluna} < ?', [seguinte[0]]),
+        'gt': (f'{coluna} >= ?', [seguinte[0]]),
+        'gte': (f'{coluna} >= ?', [dias[0]]),
+    }[op]
+
+
+def _validar_campo(campo):
+    if not _RE_CAMPO.match(campo):
+        raise ValueError(f'Campo inválido: {campo}')
+
+
+def compilar_filtro(bd, expressao):
+    """Compile one 'field:op:value' expression.
+
+    Returns:
+        tuple: (sql fragment on a.id / a.<column>, params)
+
+    Raises:
+        ValueError: If the field, operator or value is invalid
+    """
+    partes = expressao.split(':', 2)
+    if len(partes) != 3:
+        raise ValueError(f'Filtro inválido: {expressao} (use campo:operador:valor)')
+    campo, op, valor = partes[0].strip(), partes[1].strip().lower(), partes[2]
+    _validar_campo(campo)
+    if op not in OPERADORES:
+        raise ValueError(f'Operador inválido: {op} (use {", ".join(OPERADORES)})')
+
+    if campo in COLUNAS_TIMESTAMP:
+        return _filtro_timestamp(campo, op, valor)
+
+    tipo = _tipo_campo(bd, campo)
+    if op == 'contains':
+        if tipo != 'text':
+            raise ValueError(f'Operador contains só se aplica a campos de texto: {campo}')
+        valores = [f'%{_escapar_like(valor)}%']
+        comparacao = "LIKE ? ESCAPE '\\'"
+    elif op == 'in':
+        valores = [_converter(tipo, campo, v) for v in valor.split('|')]
+        if len(valores) > FILTRO_IN_MAX:
+            raise ValueError(f'Máximo de {FILTRO_IN_MAX} valores por filtro in')
+        comparacao = f"IN ({', '.join('?' * len(valores))})"
+    else:
+        valores = [_converter(tipo, campo, valor)]
+        # ne is compiled as the complement of eq
+        comparacao = f"{OPERADORES['eq' if op == 'ne' else op]} ?"
+    pertence = 'NOT IN' if op == 'ne' else 'IN'
+
+    if campo in COLUNAS_ASSETS:
+        if op == 'ne':
+            return f'(a.{campo} IS NULL OR a.{campo} <> ?)', valores
+        return f'a.{campo} {comparacao}', valores
+    if campo in CAMPOS_FLAT:
+        return f'a.id {pertence} (SELECT asset_id FROM assets_flat WHERE {campo} {comparacao})', valores
+    coluna = _coluna_asset_data(tipo)
+    return (f'a.id {pertence} (SELECT asset_id FROM asset_data WHERE field_name = ? AND {coluna} {comparacao})',
+            [campo] + valores)
+
+
+def compilar_filtros(bd, expressoes):
+    """Compile several filter expressions into (' AND ...' sql, params)."""
+    sql, params = '', []
+    for expressao in expressoes:
+        fragmento, valores = compilar_filtro(bd, expressao)
+        sql += f' AND {fragmento}'
+        params.extend(valores)
+    return sql, params
+
+
+def compilar_ordenacao(bd, ordenacao):
+    """Compile '[-]field' into (join sql, join params, ORDER BY expression).
+
+    A leading '-' sorts descending; a.id breaks ties in the same direction.
+    Missing values sort last either way (SQLite would put them first on ASC,
+    PostgreSQL last).
+
+    Raises:
+        ValueError: If the field is invalid
+    """
+    direcao = 'DESC' if ordenacao.startswith('-') else 'ASC'
+    campo = ordenacao.lstrip('-+').strip()
+    _validar_campo(campo)
+
+    def ordem(expressao):
+        return f'CASE WHEN {expressao} IS NULL THEN 1 ELSE 0 END, {expressao} {direcao}, a.id {direcao}'
+
+    if campo in COLUNAS_ASSETS:
+        return '', [], ordem(f'a.{campo}')
+    if campo in CAMPOS_FLAT:
+        return 'LEFT JOIN assets_flat srt ON srt.asset_id = a.id', [], ordem(f'srt.{campo}')
+    coluna = _coluna_asset_data(_tipo_campo(bd, campo))
+    return ('LEFT JOIN asset_data srt ON srt.asset_id = a.id AND srt.field_name = ?', [campo],
+            ordem(f'srt.{coluna}'))
@@ -25,6 +25,10 @@ class Config:
 
     # Session/Token
     TOKEN_EXPIRATION_HOURS = int(os.environ.get('TOKEN_EXPIRATION_HOURS', '24'))
+    # 'session': opaque tokens backed by the sessions table; 'signed':
+    # HMAC-signed tokens verified without DB access (needs SECRET_KEY set in
+    # the environment). Both are accepted.
+    AUTH_TOKEN_MODE = os.environ.get('AUTH_TOKEN_MODE', 'session')
 
     # Multi-tenant paths - use relative paths that work in container
     DATA_PATH = os.path.join(BACKEND_PATH, 'data')
@@ -37,6 +41,18 @@ class Config:
     # Master tenant
     MASTER_TENANT_ID = 'smartlamppost'
 
+    # Per-request DB instrumentation: Server-Timing header, plus a warning
+    # when a request exceeds these totals or repeats one statement shape
+    QUERY_INSTRUMENTATION = os.environ.get('QUERY_INSTRUMENTATION', 'true').lower() == 'true'
+    QUERY_LOG_MIN_MS = int(os.environ.get('QUERY_LOG_MIN_MS', '500'))
+    QUERY_LOG_MIN_COUNT = int(os.environ.get('QUERY_LOG_MIN_COUNT', '100'))
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', '20'))
+
+    # Also migrate every tenant database at startup. Off by default: each
+    # worker would check every tenant and race the others on the same DDL;
+    # the start command runs scripts/maintenance.py migrate once instead
+    SCHEMA_AUTO_MIGRATE = os.environ.get('SCHEMA_AUTO_MIGRATE', 'false').lower() == 'true'
+
     # File upload limits
     MAX_FILE_SIZE = 3 * 1024 * 1024  # 3MB
     ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png'}
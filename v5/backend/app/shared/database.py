@@ -4,22 +4,37 @@ Handles multi-tenant database connections, initialization, and migrations.
 Supports both SQLite (local development) and PostgreSQL (Railway production).
 """
 
+import io
 import os
+import copy
+import re
 import json
 import sqlite3
+import tempfile
+import time
 import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from urllib.parse import urlparse
 
 from flask import g
 
+from .instrumentation import registar_consulta
+
 logger = logging.getLogger(__name__)
 
 # Database mode detection
 DATABASE_URL = os.environ.get('DATABASE_URL')
 USE_POSTGRES = DATABASE_URL is not None and DATABASE_URL.startswith('postgres')
 
-# PostgreSQL connection pool (only if using Postgres)
-_pg_pool = None
+# PostgreSQL connection manager (only if using Postgres)
+_pg_manager = None
+
+# Pool sizing, overridable per deployment
+PG_POOL_MIN = int(os.environ.get('PG_POOL_MIN', '1'))
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', '10'))
+PG_POOL_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', '30'))
 
 RealDictCursor = None
 
@@ -27,7 +42,8 @@ if USE_POSTGRES:
     try:
         import psycopg2
         from psycopg2 import pool
-        from psycopg2.extras import RealDictCursor as _RealDictCursor
+        from psycopg2.extensions import connection as _PgConnection, TRANSACTION_STATUS_IDLE
+        from psycopg2.extras import RealDictCursor as _RealDictCursor, execute_values, execute_batch
         RealDictCursor = _RealDictCursor
         logger.info("PostgreSQL mode enabled")
     except ImportError:
@@ -40,11 +56,113 @@ PASTA_TENANTS = None
 PASTA_SHARED = None
 PASTA_CONFIG = None
 CATALOGO_PARTILHADO = None
+DIRETORIO_PARTILHADO = None
 FICHEIRO_TENANTS = None
 MASTER_TENANT_ID = 'smartlamppost'
 
-# Current schema version for migration tracking
-SCHEMA_VERSION = 5
+# Current tenant schema version; bump together with a new step in
+# migrations.MIGRACOES_TENANT
+SCHEMA_VERSION = 13
+
+# Indexed columns of the assets_flat projection
+_INDICES_ASSETS_FLAT = (
+    'condition_status', 'municipality', 'next_maintenance_date',
+    'next_inspection_date', 'last_inspection_date', 'warranty_end_date'
+)
+
+
+# =========================================================================
+# SQL DIALECT TRANSLATION - SQLite -> PostgreSQL
+# =========================================================================
+
+# The app issues a fixed set of query strings, so each one is translated
+# once and served from an LRU afterwards.
+TRADUCAO_SQL_CACHE_SIZE = 2048
+
+# INSERT OR REPLACE targets with a known conflict key
+_UPSERT_CONFLITOS = (
+    ('asset_data', ' ON CONFLICT (asset_id, field_name) DO UPDATE SET field_value = EXCLUDED.field_value, '
+                   'value_num = EXCLUDED.value_num, value_date = EXCLUDED.value_date'),
+    ('notification_settings', ' ON CONFLICT (setting_key) DO UPDATE SET setting_value = EXCLUDED.setting_value, updated_at = EXCLUDED.updated_at'),
+    ('system_config', ' ON CONFLICT (config_key) DO UPDATE SET config_value = EXCLUDED.config_value'),
+)
+
+_IDENT = r"([a-zA-Z_][a-zA-Z0-9_.]*)"
+
+# (compiled pattern, replacement) applied in order
+_REGRAS_REGEX = (
+    # strftime('%Y-%m', col) -> TO_CHAR(col, 'YYYY-MM')
+    (re.compile(r"strftime\s*\(\s*'%Y-%m'\s*,\s*(\w+)\s*\)"), r"TO_CHAR(\1::timestamp, 'YYYY-MM')"),
+    # strftime('%Y-%m', col) for expressions like i.created_at
+    (re.compile(r"strftime\s*\(\s*'%Y-%m'\s*,\s*" + _IDENT + r"\s*\)"), r"TO_CHAR(\1::timestamp, 'YYYY-MM')"),
+    # strftime('%m', col) -> TO_CHAR(col, 'MM')
+    (re.compile(r"strftime\s*\(\s*'%m'\s*,\s*" + _IDENT + r"\s*\)"), r"TO_CHAR(\1::timestamp, 'MM')"),
+    # strftime('%w', col) -> EXTRACT(DOW FROM col)
+    (re.compile(r"strftime\s*\(\s*'%w'\s*,\s*" + _IDENT + r"\s*\)"), r"EXTRACT(DOW FROM \1::timestamp)::text"),
+)
+
+_REGRAS_DATAS = (
+    # DATE('now', '-X days') -> CURRENT_DATE - INTERVAL 'X days'
+    (re.compile(r"DATE\s*\(\s*'now'\s*,\s*'(-?\d+)\s+days?'\s*\)"), r"CURRENT_DATE + INTERVAL '\1 days'"),
+    (re.compile(r"DATE\s*\(\s*'now'\s*,\s*'\+(\d+)\s+days?'\s*\)"), r"CURRENT_DATE + INTERVAL '\1 days'"),
+    # date('now', '-X months')
+    (re.compile(r"date\s*\(\s*'now'\s*,\s*'(-?\d+)\s+months?'\s*\)", re.IGNORECASE), r"CURRENT_DATE + INTERVAL '\1 months'"),
+    (re.compile(r"DATE\s*\(\s*'now'\s*,\s*'(-?\d+)\s+years?'\s*\)"), r"CURRENT_DATE + INTERVAL '\1 years'"),
+    # julianday('now') - julianday(col) -> EXTRACT(EPOCH FROM NOW() - col) / 86400
+    (re.compile(r"julianday\s*\(\s*'now'\s*\)\s*-\s*julianday\s*\(\s*" + _IDENT + r"\s*\)"),
+     r"EXTRACT(EPOCH FROM NOW() - \1::timestamp) / 86400"),
+    # julianday(col2) - julianday(col1)
+    (re.compile(r"julianday\s*\(\s*" + _IDENT + r"\s*\)\s*-\s*julianday\s*\(\s*" + _IDENT + r"\s*\)"),
+     r"EXTRACT(EPOCH FROM \1::timestamp - \2::timestamp) / 86400"),
+)
+
+
+@lru_cache(maxsize=TRADUCAO_SQL_CACHE_SIZE)
+def traduzir_sql_postgres(query):
+    """Translate a SQLite query into its PostgreSQL form (memoised per query text)."""
+    # Convert ? to %s for PostgreSQL
+    query = query.replace('?', '%s')
+    # Handle AUTOINCREMENT -> SERIAL
+    query = query.replace('AUTOINCREMENT', '')
+    query = query.replace('INTEGER PRIMARY KEY', 'SERIAL PRIMARY KEY')
+
+    # Handle INSERT OR REPLACE -> INSERT ON CONFLICT DO UPDATE
+    if 'INSERT OR REPLACE' in query:
+        query = query.replace('INSERT OR REPLACE', 'INSERT')
+        for tabela, conflito in _UPSERT_CONFLITOS:
+            if tabela in query:
+                query = query.rstrip().rstrip(';') + conflito
+                break
+        # Generic fallback - just replace without ON CONFLICT
+
+    # Handle INSERT OR IGNORE -> INSERT ON CONFLICT DO NOTHING
+    if 'INSERT OR IGNORE' in query:
+        query = query.replace('INSERT OR IGNORE', 'INSERT')
+        if 'ON CONFLICT' not in query:
+            query = query.rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
+
+    # Handle SQLite strftime -> PostgreSQL TO_CHAR
+    for padrao, substituicao in _REGRAS_REGEX:
+        query = padrao.sub(substituicao, query)
+
+    # Handle SQLite date functions -> PostgreSQL
+    # DATE('now') -> CURRENT_DATE
+    query = query.replace("DATE('now')", "CURRENT_DATE")
+    for padrao, substituicao in _REGRAS_DATAS:
+        query = padrao.sub(substituicao, query)
+
+    return query
+
+
+def obter_estatisticas_traducao():
+    """Return hit/miss counters of the SQL translation cache."""
+    info = traduzir_sql_postgres.cache_info()
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize
+    }
 
 
 # =========================================================================
@@ -54,95 +172,63 @@ SCHEMA_VERSION = 5
 class DatabaseAdapter:
     """Adapter to provide consistent interface for SQLite and PostgreSQL."""
 
-    def __init__(self, connection, is_postgres=False, schema_name=None):
+    def __init__(self, connection, is_postgres=False, schema_name=None, gestor=None):
         self.conn = connection
         self.is_postgres = is_postgres
         self._cursor = None
-        self.schema_name = schema_name  # Store schema for re-setting search_path
+        self.schema_name = schema_name  # search_path is set once at checkout
+        self._gestor = gestor  # pool that owns the connection, close() returns it there
 
     def execute(self, query, params=None):
         """Execute query with automatic parameter placeholder conversion."""
+        inicio = time.perf_counter()
         if self.is_postgres:
-            # Convert ? to %s for PostgreSQL
-            query = query.replace('?', '%s')
-            # Handle AUTOINCREMENT -> SERIAL
-            query = query.replace('AUTOINCREMENT', '')
-            query = query.replace('INTEGER PRIMARY KEY', 'SERIAL PRIMARY KEY')
-            # Handle INSERT OR REPLACE -> INSERT ON CONFLICT DO UPDATE
-            if 'INSERT OR REPLACE' in query:
-                # Special handling for known tables
-                if 'asset_data' in query:
-                    query = query.replace('INSERT OR REPLACE', 'INSERT')
-                    query = query.rstrip().rstrip(';')
-                    query += ' ON CONFLICT (asset_id, field_name) DO UPDATE SET field_value = EXCLUDED.field_value'
-                elif 'notification_settings' in query:
-                    query = query.replace('INSERT OR REPLACE', 'INSERT')
-                    query = query.rstrip().rstrip(';')
-                    query += ' ON CONFLICT (setting_key) DO UPDATE SET setting_value = EXCLUDED.setting_value, updated_at = EXCLUDED.updated_at'
-                elif 'system_config' in query:
-                    query = query.replace('INSERT OR REPLACE', 'INSERT')
-                    query = query.rstrip().rstrip(';')
-                    query += ' ON CONFLICT (config_key) DO UPDATE SET config_value = EXCLUDED.config_value'
-                else:
-                    # Generic fallback - just replace without ON CONFLICT
-                    query = query.replace('INSERT OR REPLACE', 'INSERT')
-            # Handle INSERT OR IGNORE -> INSERT ON CONFLICT DO NOTHING
-            if 'INSERT OR IGNORE' in query:
-                query = query.replace('INSERT OR IGNORE', 'INSERT')
-                if 'ON CONFLICT' not in query:
-                    query = query.rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
-
-            # Handle SQLite strftime -> PostgreSQL TO_CHAR
-            import re
-            # strftime('%Y-%m', col) -> TO_CHAR(col, 'YYYY-MM')
-            query = re.sub(r"strftime\s*\(\s*'%Y-%m'\s*,\s*(\w+)\s*\)", r"TO_CHAR(\1::timestamp, 'YYYY-MM')", query)
-            # strftime('%Y-%m', col) for expressions like i.created_at
-            query = re.sub(r"strftime\s*\(\s*'%Y-%m'\s*,\s*([a-zA-Z_][a-zA-Z0-9_.]*)\s*\)", r"TO_CHAR(\1::timestamp, 'YYYY-MM')", query)
-            # strftime('%m', col) -> TO_CHAR(col, 'MM')
-            query = re.sub(r"strftime\s*\(\s*'%m'\s*,\s*([a-zA-Z_][a-zA-Z0-9_.]*)\s*\)", r"TO_CHAR(\1::timestamp, 'MM')", query)
-            # strftime('%w', col) -> EXTRACT(DOW FROM col)
-            query = re.sub(r"strftime\s*\(\s*'%w'\s*,\s*([a-zA-Z_][a-zA-Z0-9_.]*)\s*\)", r"EXTRACT(DOW FROM \1::timestamp)::text", query)
-
-            # Handle SQLite date functions -> PostgreSQL
-            # DATE('now') -> CURRENT_DATE
-            query = query.replace("DATE('now')", "CURRENT_DATE")
-            # DATE('now', '-X days') -> CURRENT_DATE - INTERVAL 'X days'
-            query = re.sub(r"DATE\s*\(\s*'now'\s*,\s*'(-?\d+)\s+days?'\s*\)", r"CURRENT_DATE + INTERVAL '\1 days'", query)
-            query = re.sub(r"DATE\s*\(\s*'now'\s*,\s*'\+(\d+)\s+days?'\s*\)", r"CURRENT_DATE + INTERVAL '\1 days'", query)
-            # date('now', '-X months')
-            query = re.sub(r"date\s*\(\s*'now'\s*,\s*'(-?\d+)\s+months?'\s*\)", r"CURRENT_DATE + INTERVAL '\1 months'", query, flags=re.IGNORECASE)
-            query = re.sub(r"DATE\s*\(\s*'now'\s*,\s*'(-?\d+)\s+years?'\s*\)", r"CURRENT_DATE + INTERVAL '\1 years'", query)
-
-            # julianday('now') - julianday(col) -> EXTRACT(EPOCH FROM NOW() - col) / 86400
-            query = re.sub(r"julianday\s*\(\s*'now'\s*\)\s*-\s*julianday\s*\(\s*([a-zA-Z_][a-zA-Z0-9_.]*)\s*\)",
-                          r"EXTRACT(EPOCH FROM NOW() - \1::timestamp) / 86400", query)
-            # julianday(col2) - julianday(col1)
-            query = re.sub(r"julianday\s*\(\s*([a-zA-Z_][a-zA-Z0-9_.]*)\s*\)\s*-\s*julianday\s*\(\s*([a-zA-Z_][a-zA-Z0-9_.]*)\s*\)",
-                          r"EXTRACT(EPOCH FROM \1::timestamp - \2::timestamp) / 86400", query)
+            query = traduzir_sql_postgres(query)
 
         if self.is_postgres and RealDictCursor:
             cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            # Ensure search_path is set for this cursor if we have a specific schema
-            if self.schema_name and self.schema_name != 'public':
-                try:
-                    cursor.execute(f"SET search_path TO {self.schema_name}, public")
-                except Exception as e:
-                    logger.warning(f"Could not set search_path in execute: {e}")
         else:
             cursor = self.conn.cursor()
 
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+        finally:
+            registar_consulta(query, time.perf_counter() - inicio)
         return cursor
 
+    def insert_returning_id(self, query, params=None):
+        """Run an INSERT and return the id of the new row (None if nothing was inserted)."""
+        if not self.is_postgres:
+            cursor = self.execute(query, params)
+            return cursor.lastrowid if cursor.rowcount else None
+        # Appended after translation so it follows any ON CONFLICT clause
+        inicio = time.perf_counter()
+        query = traduzir_sql_postgres(query).rstrip().rstrip(';') + ' RETURNING id'
+        cursor = self.conn.cursor(cursor_factory=RealDictCursor) if RealDictCursor else self.conn.cursor()
+        try:
+            cursor.execute(query, params or None)
+        finally:
+            registar_consulta(query, time.perf_counter() - inicio)
+        return extrair_valor(cursor.fetchone(), 'id')
+
     def executemany(self, query, params_list):
-        """Execute many with automatic conversion."""
-        if self.is_postgres:
-            query = query.replace('?', '%s')
+        """Execute a statement for many parameter sets with the same translation as execute.
+
+        On PostgreSQL the statements are sent in pages (execute_batch)
+        instead of one round-trip per row.
+        """
+        inicio = time.perf_counter()
         cursor = self.conn.cursor()
-        cursor.executemany(query, params_list)
+        try:
+            if self.is_postgres:
+                execute_batch(cursor, traduzir_sql_postgres(query), params_list, page_size=BULK_PAGE_SIZE)
+            else:
+                cursor.executemany(query, params_list)
+        finally:
+            registar_consulta(query, time.perf_counter() - inicio)
         return cursor
 
     def commit(self):
@@ -152,16 +238,25 @@ class DatabaseAdapter:
         self.conn.rollback()
 
     def close(self):
-        self.conn.close()
+        if self._gestor is None:
+            self.conn.close()
+            return
+        # Standalone checkout: give the slot back instead of closing the socket
+        gestor, self._gestor = self._gestor, None
+        gestor.devolver(self.conn)
 
-    @property
-    def lastrowid(self):
-        """Get last inserted row ID (PostgreSQL compatibility)."""
-        if self.is_postgres:
-            # For PostgreSQL, we need to use RETURNING in the INSERT statement
-            # or call currval on the sequence
-            return None  # Caller should use RETURNING instead
-        return None
+
+def insert_returning_id(bd, query, params=None):
+    """Run an INSERT and return the id of the new row.
+
+    Uses cursor.lastrowid on SQLite and RETURNING id on PostgreSQL, so
+    callers don't re-select the row by a natural key. Returns None when
+    nothing was inserted (e.g. INSERT OR IGNORE on a conflict).
+    """
+    if isinstance(bd, DatabaseAdapter):
+        return bd.insert_returning_id(query, params)
+    cursor = bd.execute(query, params or ())
+    return cursor.lastrowid if cursor.rowcount else None
 
 
 def get_count(bd, query, params=None):
@@ -192,51 +287,558 @@ def table_exists(bd, table_name):
         return result is not None
 
 
-def _get_pg_connection(schema_name='public'):
-    """Get a PostgreSQL connection for a specific schema (tenant)."""
-    global _pg_pool
-
-    if _pg_pool is None:
-        # Parse DATABASE_URL
-        result = urlparse(DATABASE_URL)
-        _pg_pool = pool.ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
+# =========================================================================
+# BULK WRITES
+# =========================================================================
+
+# Rows per execute_values / execute_batch page on PostgreSQL
+BULK_PAGE_SIZE = 1000
+
+# Plain inserts at least this large are streamed with COPY on PostgreSQL
+BULK_COPY_MIN_ROWS = 5000
+
+# ON CONFLICT ... DO UPDATE exists in SQLite since 3.24
+_SQLITE_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+
+def _clausula_conflito(chave_conflito, atualizar):
+    """Build the ON CONFLICT clause shared by SQLite (3.24+) and PostgreSQL."""
+    if not chave_conflito:
+        return ''
+    chave = ', '.join(chave_conflito)
+    if not atualizar:
+        return f' ON CONFLICT ({chave}) DO NOTHING'
+    sets = ', '.join(f'{c} = excluded.{c}' for c in atualizar)
+    return f' ON CONFLICT ({chave}) DO UPDATE SET {sets}'
+
+
+def _valor_copy(valor):
+    """Format one value for COPY ... FROM STDIN (text format)."""
+    if valor is None:
+        return '\\N'
+    return (str(valor).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def inserir_em_massa(bd, tabela, colunas, linhas, chave_conflito=None, atualizar=None):
+    """Insert or upsert many rows in one call (does not commit).
+
+    Args:
+        bd: Database connection (SQLite connection or DatabaseAdapter)
+        tabela: Target table (trusted identifier, never user input)
+        colunas: Column names, in the order of each row
+        linhas: Iterable of row tuples
+        chave_conflito: Unique columns to detect existing rows; None for a
+            plain INSERT
+        atualizar: Columns overwritten on conflict; empty/None keeps the
+            existing row (DO NOTHING)
+
+    SQLite runs a single executemany inside the caller's transaction.
+    PostgreSQL uses execute_values pages, or COPY for large plain inserts.
+
+    Returns:
+        int: Number of rows sent
+    """
+    linhas = [tuple(l) for l in linhas]
+    if chave_conflito:
+        # One row per key (last wins): PostgreSQL rejects a statement that
+        # updates the same row twice
+        posicoes = [list(colunas).index(c) for c in chave_conflito]
+        linhas = list({tuple(l[i] for i in posicoes): l for l in linhas}.values())
+    if not linhas:
+        return 0
+
+    lista_colunas = ', '.join(colunas)
+    conflito = _clausula_conflito(chave_conflito, atualizar)
+
+    if getattr(bd, 'is_postgres', False):
+        cursor = bd.conn.cursor()
+        inicio = time.perf_counter()
+        if not conflito and len(linhas) >= BULK_COPY_MIN_ROWS:
+            dados = io.StringIO(''.join(
+                '\t'.join(_valor_copy(v) for v in linha) + '\n' for linha in linhas
+            ))
+            cursor.copy_expert(f'COPY {tabela} ({lista_colunas}) FROM STDIN', dados)
+        else:
+            execute_values(cursor, f'INSERT INTO {tabela} ({lista_colunas}) VALUES %s{conflito}',
+                           linhas, page_size=BULK_PAGE_SIZE)
+        registar_consulta(f'INSERT INTO {tabela} ({lista_colunas}) [bulk]', time.perf_counter() - inicio)
+        return len(linhas)
+
+    marcadores = ', '.join('?' * len(colunas))
+    if conflito and not _SQLITE_UPSERT:
+        verbo = 'INSERT OR REPLACE' if atualizar else 'INSERT OR IGNORE'
+        query = f'{verbo} INTO {tabela} ({lista_colunas}) VALUES ({marcadores})'
+    else:
+        query = f'INSERT INTO {tabela} ({lista_colunas}) VALUES ({marcadores}){conflito}'
+    bd.executemany(query, linhas)
+    return len(linhas)
+
+
+# =========================================================================
+# ASSET DATA (EAV) HYDRATION
+# =========================================================================
+
+# Keeps every IN (...) list well below SQLite's bound-parameter limit
+ASSET_DATA_CHUNK_SIZE = 500
+
+
+def carregar_dados_ativos(bd, asset_ids, campos=None, chunk_size=ASSET_DATA_CHUNK_SIZE):
+    """Load the dynamic (asset_data) fields of many assets at once.
+
+    Replaces the per-asset ``SELECT ... FROM asset_data WHERE asset_id = ?``
+    loop with a handful of chunked ``IN (...)`` queries.
+
+    Args:
+        bd: Tenant database connection
+        asset_ids: Iterable of asset ids
+        campos: Optional whitelist of field names to load
+        chunk_size: Maximum number of ids per query
+
+    Returns:
+        dict: {asset_id: {field_name: field_value}}, with an (possibly empty)
+        entry for every requested id
+    """
+    ids = list(dict.fromkeys(asset_ids))
+    resultado = {asset_id: {} for asset_id in ids}
+    if not ids:
+        return resultado
+
+    filtro_campos = ''
+    params_campos = []
+    if campos:
+        params_campos = list(campos)
+        filtro_campos = f" AND field_name IN ({', '.join('?' * len(params_campos))})"
+
+    for inicio in range(0, len(ids), chunk_size):
+        bloco = ids[inicio:inicio + chunk_size]
+        rows = bd.execute(
+            f"SELECT asset_id, field_name, field_value FROM asset_data "
+            f"WHERE asset_id IN ({', '.join('?' * len(bloco))}){filtro_campos}",
+            bloco + params_campos
+        ).fetchall()
+        for row in rows:
+            resultado[row['asset_id']][row['field_name']] = row['field_value']
+
+    return resultado
+
+
+def hidratar_ativos(bd, assets, campos=None):
+    """Turn asset rows into dicts merged with their asset_data fields."""
+    linhas = [dict(asset) for asset in assets]
+    dados = carregar_dados_ativos(bd, [linha['id'] for linha in linhas], campos)
+    for linha in linhas:
+        linha.update(dados[linha['id']])
+    return linhas
+
+
+# =========================================================================
+# POSTGRESQL CONNECTION MANAGER
+# =========================================================================
+
+class PostgresConnectionManager:
+    """Pool of PostgreSQL connections that knows about tenant schemas.
+
+    - Each schema is created at most once per process.
+    - Every pooled connection remembers its session search_path, so a
+      checkout for the schema it already points at costs no round-trip.
+    - Checkouts block (up to PG_POOL_TIMEOUT) instead of failing when all
+      PG_POOL_MAX connections are in use; wait time is recorded.
+    """
+
+    def __init__(self, dsn_url, minconn=PG_POOL_MIN, maxconn=PG_POOL_MAX, timeout=PG_POOL_TIMEOUT):
+        result = urlparse(dsn_url)
+
+        class _LigacaoPostgres(_PgConnection):
+            search_path = None
+
+        self._pool = pool.ThreadedConnectionPool(
+            minconn=minconn,
+            maxconn=maxconn,
+            connection_factory=_LigacaoPostgres,
             host=result.hostname,
             port=result.port or 5432,
             database=result.path[1:],  # Remove leading /
             user=result.username,
             password=result.password
         )
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._schemas = set()
+        self._stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'wait_total_ms': 0.0,
+            'wait_max_ms': 0.0,
+            'search_path_sets': 0,
+            'search_path_reused': 0
+        }
+
+    def obter(self, schema_name='public'):
+        """Check out a connection whose search_path points at schema_name."""
+        inicio = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"Timed out after {self.timeout}s waiting for a database connection")
+        espera_ms = (time.monotonic() - inicio) * 1000
 
-    conn = _pg_pool.getconn()
-    cursor = conn.cursor()
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_total_ms'] += espera_ms
+            self._stats['wait_max_ms'] = max(self._stats['wait_max_ms'], espera_ms)
 
-    # Ensure the schema exists before setting search_path
-    if schema_name != 'public':
+        try:
+            self._garantir_schema(conn, schema_name)
+            self.definir_search_path(conn, schema_name)
+        except Exception:
+            self.devolver(conn)
+            raise
+        return conn
+
+    def _garantir_schema(self, conn, schema_name):
+        """Create the schema once per process."""
+        if schema_name == 'public' or schema_name in self._schemas:
+            return
+        cursor = conn.cursor()
         try:
             cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
             conn.commit()
         except Exception as e:
             logger.warning(f"Could not create schema {schema_name}: {e}")
             conn.rollback()
+            return
+        finally:
+            cursor.close()
+        with self._lock:
+            self._schemas.add(schema_name)
+
+    def definir_search_path(self, conn, schema_name):
+        """Point the connection at schema_name, skipping the SET if it already is."""
+        search_path = f"{schema_name}, public"
+        if conn.search_path == search_path:
+            with self._lock:
+                self._stats['search_path_reused'] += 1
+            return
+
+        cursor = conn.cursor()
+        try:
+            # Committed so it survives later rollbacks in the session
+            cursor.execute(f"SET search_path TO {search_path}")
+            conn.commit()
+            conn.search_path = search_path
+        except Exception as e:
+            logger.error(f"Error setting search_path to {schema_name}: {e}")
+            conn.rollback()
+            conn.search_path = None
+        finally:
+            cursor.close()
+        with self._lock:
+            self._stats['search_path_sets'] += 1
+
+    def devolver(self, conn):
+        """Return a connection to the pool."""
+        # A rollback on return could undo an uncommitted SET: forget the tag
+        if conn.closed or conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            conn.search_path = None
+        try:
+            self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
 
-    # Set search_path persistently for this connection
-    try:
-        cursor.execute(f"SET search_path TO {schema_name}, public")
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Error setting search_path to {schema_name}: {e}")
-        conn.rollback()
+    def adaptador(self, schema_name='public'):
+        """Check out a connection wrapped for use outside a request.
+
+        The adapter's close() returns the connection to this pool; the
+        caller must close it (scheduler jobs, background tasks, boot).
+        """
+        conn = self.obter(schema_name)
+        if RealDictCursor:
+            conn.cursor_factory = RealDictCursor
+        return DatabaseAdapter(conn, is_postgres=True, schema_name=schema_name, gestor=self)
+
+    def estatisticas(self):
+        """Return checkout counters, wait times and search_path reuse."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['schemas_known'] = len(self._schemas)
+        stats['max_size'] = self.maxconn
+        stats['wait_avg_ms'] = stats['wait_total_ms'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+
+def _obter_gestor_pg():
+    """Return the process-wide PostgreSQL connection manager, creating it on first use."""
+    global _pg_manager
+
+    if _pg_manager is None:
+        _pg_manager = PostgresConnectionManager(DATABASE_URL)
 
-    cursor.close()
-    return conn
+    return _pg_manager
+
+
+def _get_pg_connection(schema_name='public'):
+    """Get a PostgreSQL connection for a specific schema (tenant)."""
+    return _obter_gestor_pg().obter(schema_name)
 
 
 def _return_pg_connection(conn):
     """Return connection to pool."""
-    if _pg_pool:
-        _pg_pool.putconn(conn)
+    if _pg_manager:
+        _pg_manager.devolver(conn)
+
+
+def obter_estatisticas_pool_postgres():
+    """Return PostgreSQL pool statistics (None in SQLite mode or before first use)."""
+    return _pg_manager.estatisticas() if _pg_manager else None
+
+
+def obter_estatisticas_bd():
+    """Return connection pool and SQL translation statistics."""
+    return {
+        'mode': 'postgresql' if USE_POSTGRES else 'sqlite',
+        'postgres_pool': obter_estatisticas_pool_postgres(),
+        'sqlite_pool': _sqlite_pool.estatisticas(),
+        'sql_translation': obter_estatisticas_traducao()
+    }
+
+
+# =========================================================================
+# SQLITE CONNECTION POOL
+# =========================================================================
+
+# Per-connection tuning applied once when a pooled connection is created
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 8192
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+SQLITE_CACHED_STATEMENTS = 256
+SQLITE_POOL_MAX_IDLE = 8
+
+
+class _LigacaoSQLite(sqlite3.Connection):
+    """sqlite3 connection that remembers which pool it belongs to.
+
+    execute/executemany are timed into the per-request query metrics.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.caminho_pool = None
+        self.geracao_pool = 0
+        self.identidade_ficheiro = None
+        self.fechada = False
+
+    def execute(self, sql, parameters=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            registar_consulta(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, seq_of_parameters):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            registar_consulta(sql, time.perf_counter() - inicio)
+
+    def close(self):
+        self.fechada = True
+        super().close()
+
+
+def _configurar_ligacao_sqlite(conn, foreign_keys=True):
+    """Apply the standard PRAGMAs to a new SQLite connection."""
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    # WAL lets readers proceed while a writer holds the lock
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if foreign_keys:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+def _identidade_ficheiro(caminho):
+    """Return (device, inode) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(caminho)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+class SQLiteConnectionPool:
+    """Thread-safe pool of tuned SQLite connections, keyed by database file.
+
+    Connections are checked out for the duration of a request and returned
+    by fechar_ligacoes, so the connect cost and the page cache survive
+    between requests. Any uncommitted work is rolled back on return,
+    matching the previous close-per-request behaviour.
+
+    Idle connections whose file was replaced on disk (new inode at the same
+    path) are dropped at checkout instead of reading the unlinked file.
+    """
+
+    def __init__(self, max_idle=SQLITE_POOL_MAX_IDLE):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._geracao = {}
+        self._lock = threading.Lock()
+        self.criadas = 0
+        self.reutilizadas = 0
+        self.substituidas = 0
+
+    def adquirir(self, caminho, foreign_keys=True):
+        """Check out a connection to the given database file."""
+        caminho = os.path.abspath(caminho)
+        identidade = _identidade_ficheiro(caminho)
+        substituidas = []
+        with self._lock:
+            livres = self._idle.get(caminho)
+            if livres and livres[-1].identidade_ficheiro != identidade:
+                # Replaced behind the pool: retire idle and checked-out ones
+                substituidas = self._idle.pop(caminho)
+                self._geracao[caminho] = self._geracao.get(caminho, 0) + 1
+                self.substituidas += 1
+                livres = None
+            if livres:
+                self.reutilizadas += 1
+                return livres.pop()
+            geracao = self._geracao.get(caminho, 0)
+            self.criadas += 1
+
+        for antiga in substituidas:
+            antiga.close()
+
+        conn = sqlite3.connect(
+            caminho,
+            factory=_LigacaoSQLite,
+            check_same_thread=False,
+            cached_statements=SQLITE_CACHED_STATEMENTS
+        )
+        _configurar_ligacao_sqlite(conn, foreign_keys)
+        conn.caminho_pool = caminho
+        conn.geracao_pool = geracao
+        conn.identidade_ficheiro = _identidade_ficheiro(caminho)
+        return conn
+
+    def devolver(self, conn):
+        """Return a connection to the pool (closing it if it can't be reused)."""
+        if conn.fechada:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            conn.close()
+            return
+
+        with self._lock:
+            livres = self._idle.setdefault(conn.caminho_pool, [])
+            reutilizavel = (
+                conn.geracao_pool == self._geracao.get(conn.caminho_pool, 0)
+                and len(livres) < self.max_idle
+            )
+            if reutilizavel:
+                livres.append(conn)
+        if not reutilizavel:
+            conn.close()
+
+    def descartar(self, caminho=None):
+        """Close idle connections (of one file, or all) and retire checked-out ones."""
+        with self._lock:
+            if caminho is None:
+                caminhos = list(self._idle.keys())
+            else:
+                caminhos = [os.path.abspath(caminho)]
+            fechar = []
+            for c in caminhos:
+                fechar.extend(self._idle.pop(c, []))
+                self._geracao[c] = self._geracao.get(c, 0) + 1
+        for conn in fechar:
+            conn.close()
+
+    def estatisticas(self):
+        """Return pool counters."""
+        with self._lock:
+            return {
+                'created': self.criadas,
+                'reused': self.reutilizadas,
+                'replaced_files': self.substituidas,
+                'idle': sum(len(v) for v in self._idle.values()),
+                'databases': len(self._idle)
+            }
+
+
+_sqlite_pool = SQLiteConnectionPool()
+
+
+def consolidar_wal(caminho_bd):
+    """Checkpoint the WAL into the main database file.
+
+    Must be called before copying a database file (backups), otherwise
+    recent commits that still live in the -wal file would be missing.
+    """
+    if USE_POSTGRES or not os.path.exists(caminho_bd):
+        return
+    conn = sqlite3.connect(caminho_bd, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def libertar_bd_sqlite(caminho_bd):
+    """Release this process's pooled connections to a database file before a restore.
+
+    Closes idle and request-held connections and folds the WAL back into the
+    file, so the pre-restore copy is complete. Other workers' connections are
+    kept coherent by restaurar_bd_sqlite.
+    """
+    if USE_POSTGRES:
+        return
+    caminho_bd = os.path.abspath(caminho_bd)
+    _sqlite_pool.descartar(caminho_bd)
+
+    if g:
+        for attr in list(vars(g).keys()):
+            bd = getattr(g, attr, None)
+            if attr.startswith('_database_') and getattr(bd, 'caminho_pool', None) == caminho_bd:
+                bd.close()
+                delattr(g, attr)
+
+    consolidar_wal(caminho_bd)
+
+
+def restaurar_bd_sqlite(origem, caminho_bd):
+    """Copy the database file origem into caminho_bd through SQLite's backup API.
+
+    The pages are written under SQLite's own locks and WAL instead of
+    overwriting the file, so connections other worker processes keep open
+    (page cache, mmap) read the restored content on their next transaction.
+    Replacing the file would leave them on stale pages, and its old -wal
+    could be applied to the new file.
+    """
+    conn_origem = sqlite3.connect(origem)
+    conn_destino = sqlite3.connect(caminho_bd, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    try:
+        conn_origem.backup(conn_destino)
+    finally:
+        conn_destino.close()
+        conn_origem.close()
 
 
 # =========================================================================
@@ -246,7 +848,11 @@ def _return_pg_connection(conn):
 def init_paths(base_path):
     """Initialize all database paths from the application base path (v5 root)."""
     global PASTA_BASE, PASTA_TENANTS, PASTA_SHARED, PASTA_CONFIG
-    global CATALOGO_PARTILHADO, FICHEIRO_TENANTS
+    global CATALOGO_PARTILHADO, DIRETORIO_PARTILHADO, FICHEIRO_TENANTS
+
+    # Paths may change (tests), pooled connections point at the old files
+    _sqlite_pool.descartar()
+    _registo_tenants.invalidar()
 
     PASTA_BASE = base_path
     data_path = os.path.join(base_path, 'data')
@@ -254,6 +860,7 @@ def init_paths(base_path):
     PASTA_SHARED = os.path.join(data_path, 'shared')
     PASTA_CONFIG = os.path.join(data_path, 'config')
     CATALOGO_PARTILHADO = os.path.join(PASTA_SHARED, 'catalog.db')
+    DIRETORIO_PARTILHADO = os.path.join(PASTA_SHARED, 'directory.db')
     FICHEIRO_TENANTS = os.path.join(PASTA_CONFIG, 'tenants.json')
 
     # Create directories if they don't exist (SQLite mode)
@@ -301,10 +908,8 @@ def obter_bd(tenant_id=None):
             # SQLite: file per tenant
             caminho_bd = obter_caminho_bd_tenant(tenant_id)
             os.makedirs(os.path.dirname(caminho_bd), exist_ok=True)
-            conn = sqlite3.connect(caminho_bd)
-            conn.row_factory = sqlite3.Row
-            conn.execute("PRAGMA foreign_keys = ON")
-            bd = conn  # Return raw connection for SQLite (backward compatible)
+            # Return raw connection for SQLite (backward compatible)
+            bd = _sqlite_pool.adquirir(caminho_bd)
 
         setattr(g, cache_key, bd)
 
@@ -319,40 +924,91 @@ def obter_bd_catalogo():
             conn = _get_pg_connection('catalog')
             bd = DatabaseAdapter(conn, is_postgres=True, schema_name='catalog')
         else:
-            bd = sqlite3.connect(CATALOGO_PARTILHADO)
-            bd.row_factory = sqlite3.Row
+            bd = _sqlite_pool.adquirir(CATALOGO_PARTILHADO, foreign_keys=False)
         g._database_catalog = bd
     return bd
 
 
+def obter_bd_diretorio():
+    """Get a connection to the global directory database.
+
+    The directory maps cross-tenant lookup keys (session tokens, user
+    emails) to the tenant that owns them, so callers don't have to scan
+    every tenant.
+    """
+    bd = getattr(g, '_database_directory', None)
+    if bd is None:
+        if USE_POSTGRES:
+            conn = _get_pg_connection('directory')
+            bd = DatabaseAdapter(conn, is_postgres=True, schema_name='directory')
+        else:
+            bd = _sqlite_pool.adquirir(DIRETORIO_PARTILHADO, foreign_keys=False)
+        g._database_directory = bd
+    return bd
+
+
 def obter_bd_para_tenant(tenant_id: str):
     """
     Get a standalone database connection for a tenant (outside of Flask request context).
-    Used by scheduler and background tasks.
+    Used by scheduler and background tasks; the caller closes it, which on
+    PostgreSQL returns the connection to the pool.
     """
     try:
         if USE_POSTGRES:
-            schema_name = f"tenant_{tenant_id.replace('-', '_')}"
-            conn = _get_pg_connection(schema_name)
-            return DatabaseAdapter(conn, is_postgres=True, schema_name=schema_name)
+            return _obter_gestor_pg().adaptador(f"tenant_{tenant_id.replace('-', '_')}")
         else:
             caminho_bd = obter_caminho_bd_tenant(tenant_id)
             if not os.path.exists(caminho_bd):
                 return None
-            bd = sqlite3.connect(caminho_bd)
-            bd.row_factory = sqlite3.Row
-            bd.execute("PRAGMA foreign_keys = ON")
+            bd = sqlite3.connect(caminho_bd, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            _configurar_ligacao_sqlite(bd)
             return bd
     except Exception as e:
         logger.error("Error connecting to tenant %s database: %s", tenant_id, e)
         return None
 
 
+@contextmanager
+def bd_tarefa_tenant(tenant_id: str):
+    """Standalone tenant connection for a with block (None if it can't be opened).
+
+    Closed on exit, which returns a PostgreSQL connection to the pool.
+    """
+    bd = obter_bd_para_tenant(tenant_id)
+    try:
+        yield bd
+    finally:
+        if bd is not None:
+            bd.close()
+
+
+def obter_bd_diretorio_para_tarefa():
+    """Get a standalone directory database connection (outside of Flask request context).
+
+    Used by scheduler and background tasks; the caller closes it.
+    """
+    if USE_POSTGRES:
+        return _obter_gestor_pg().adaptador('directory')
+    bd = sqlite3.connect(DIRETORIO_PARTILHADO, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+    _configurar_ligacao_sqlite(bd, foreign_keys=False)
+    return bd
+
+
+@contextmanager
+def bd_tarefa_diretorio():
+    """Standalone directory connection for a with block, closed on exit."""
+    bd = obter_bd_diretorio_para_tarefa()
+    try:
+        yield bd
+    finally:
+        bd.close()
+
+
 def obter_lista_tenants():
     """Get list of all tenant IDs."""
     if USE_POSTGRES:
         # Get from tenants.json or query pg_catalog
-        dados = carregar_tenants()
+        dados = _registo_tenants.dados()
         return [t['id'] for t in dados.get('tenants', [])]
     else:
         if not PASTA_TENANTS or not os.path.exists(PASTA_TENANTS):
@@ -366,14 +1022,11 @@ def obter_lista_tenants():
 
 
 def fechar_ligacoes(excecao):
-    """Close all database connections at end of request."""
-    bd_catalog = getattr(g, '_database_catalog', None)
-    if bd_catalog is not None:
-        if USE_POSTGRES and hasattr(bd_catalog, 'conn'):
-            _return_pg_connection(bd_catalog.conn)
-        elif hasattr(bd_catalog, 'close'):
-            bd_catalog.close()
+    """Release all database connections at end of request.
 
+    PostgreSQL connections go back to the psycopg2 pool and SQLite
+    connections back to the SQLite pool.
+    """
     for attr in list(vars(g).keys()):
         if attr.startswith('_database_'):
             bd = getattr(g, attr, None)
@@ -381,6 +1034,8 @@ def fechar_ligacoes(excecao):
                 try:
                     if USE_POSTGRES and hasattr(bd, 'conn'):
                         _return_pg_connection(bd.conn)
+                    elif isinstance(bd, _LigacaoSQLite):
+                        _sqlite_pool.devolver(bd)
                     elif hasattr(bd, 'close'):
                         bd.close()
                 except Exception:
@@ -443,36 +1098,122 @@ def extrair_valor(row, key_or_index=0):
 # TENANT MANAGEMENT
 # =========================================================================
 
+# Seconds between stat() calls on tenants.json; writes made by this process
+# are visible immediately, writes by other workers within this interval.
+TENANT_REGISTRY_CHECK_SECONDS = float(os.environ.get('TENANT_REGISTRY_CHECK_SECONDS', '1'))
+
+
+class RegistoTenants:
+    """Process-wide cache of tenants.json, indexed by tenant id.
+
+    The parsed file is reused until its (mtime, size, inode) changes, checked
+    at most every TENANT_REGISTRY_CHECK_SECONDS. guardar() writes through a
+    temp file + rename, so readers never see a half-written registry, and
+    bumps versao so this process drops its cache at once.
+    """
+
+    def __init__(self, intervalo=TENANT_REGISTRY_CHECK_SECONDS):
+        self.intervalo = intervalo
+        self.versao = 0
+        self._lock = threading.Lock()
+        self._caminho = None
+        self._assinatura = None
+        self._verificado_em = 0.0
+        self._dados = None
+        self._indice = {}
+        self.leituras = 0
+
+    @staticmethod
+    def _assinatura_ficheiro(caminho):
+        try:
+            st = os.stat(caminho)
+        except (OSError, TypeError):
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _atualizar(self):
+        """Re-read the file if it changed; must hold the lock."""
+        agora = time.monotonic()
+        if (self._dados is not None and self._caminho == FICHEIRO_TENANTS
+                and agora - self._verificado_em < self.intervalo):
+            return
+        assinatura = self._assinatura_ficheiro(FICHEIRO_TENANTS)
+        self._verificado_em = agora
+        if (self._dados is not None and self._caminho == FICHEIRO_TENANTS
+                and assinatura == self._assinatura):
+            return
+
+        dados = {'tenants': [], 'version': '1.0.0'}
+        if assinatura is not None:
+            with open(FICHEIRO_TENANTS, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
+            self.leituras += 1
+        self._caminho = FICHEIRO_TENANTS
+        self._assinatura = assinatura
+        self._dados = dados
+        self._indice = {t['id']: t for t in dados.get('tenants', []) if 'id' in t}
+        self.versao += 1
+
+    def dados(self):
+        """Return the cached registry (shared, do not mutate)."""
+        with self._lock:
+            self._atualizar()
+            return self._dados
+
+    def obter(self, tenant_id):
+        """Return the cached entry of a tenant (shared, do not mutate) or None."""
+        with self._lock:
+            self._atualizar()
+            return self._indice.get(tenant_id)
+
+    def guardar(self, dados):
+        """Atomically replace tenants.json and invalidate the cache."""
+        pasta = os.path.dirname(FICHEIRO_TENANTS) or '.'
+        os.makedirs(pasta, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(prefix='.tenants-', suffix='.json', dir=pasta)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(dados, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporario, FICHEIRO_TENANTS)
+        except BaseException:
+            try:
+                os.unlink(temporario)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._dados = None
+            self.versao += 1
+
+    def invalidar(self):
+        """Drop the cache so the next read goes to disk."""
+        with self._lock:
+            self._dados = None
+
+
+_registo_tenants = RegistoTenants()
+
+
 def carregar_tenants():
-    """Load the tenant list from the configuration file or database."""
-    if USE_POSTGRES:
-        # For PostgreSQL, we still use JSON file for tenant registry
-        # This allows tenant list to persist without needing a special table
-        pass
+    """Load the tenant registry (tenants.json).
 
-    if FICHEIRO_TENANTS and os.path.exists(FICHEIRO_TENANTS):
-        with open(FICHEIRO_TENANTS, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {'tenants': [], 'version': '1.0.0'}
+    Returns a private copy that callers may modify and pass to
+    guardar_tenants; read-only lookups should use obter_tenant.
+    """
+    # PostgreSQL mode also keeps the registry in the JSON file
+    return copy.deepcopy(_registo_tenants.dados())
 
 
 def guardar_tenants(dados):
-    """Save the tenant list to the configuration file."""
-    # Ensure config directory exists
-    if PASTA_CONFIG:
-        os.makedirs(PASTA_CONFIG, exist_ok=True)
-
-    with open(FICHEIRO_TENANTS, 'w', encoding='utf-8') as f:
-        json.dump(dados, f, indent=2, ensure_ascii=False)
+    """Save the tenant list to the configuration file (atomic replace)."""
+    _registo_tenants.guardar(dados)
 
 
 def obter_tenant(tenant_id):
-    """Get information about a specific tenant."""
-    dados = carregar_tenants()
-    for tenant in dados.get('tenants', []):
-        if tenant['id'] == tenant_id:
-            return tenant
-    return None
+    """Get information about a specific tenant (cached, do not mutate)."""
+    return _registo_tenants.obter(tenant_id)
 
 
 def tenant_existe(tenant_id):
@@ -488,21 +1229,19 @@ def _criar_schema_postgres(tenant_id):
     """Create PostgreSQL schema for a tenant."""
     schema_name = f"tenant_{tenant_id.replace('-', '_')}"
 
-    conn = _get_pg_connection('public')
-    cursor = conn.cursor()
-
-    # Create schema if not exists
-    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name}")
-    conn.commit()
-
-    # Set search path to new schema
-    cursor.execute(f"SET search_path TO {schema_name}")
+    # The connection manager creates the schema and points search_path at it
+    conn = _get_pg_connection(schema_name)
 
     return conn, schema_name
 
 
 def _criar_tabelas_postgres(conn, schema_name):
-    """Create all tables in PostgreSQL schema."""
+    """Create all tables in PostgreSQL schema.
+
+    Returns:
+        bool: True if asset_data just gained its typed value columns and
+        needs a backfill.
+    """
     cursor = conn.cursor()
 
     # Users table
@@ -629,9 +1368,47 @@ def _criar_tabelas_postgres(conn, schema_name):
             asset_id INTEGER NOT NULL,
             field_name TEXT NOT NULL,
             field_value TEXT,
+            value_num DOUBLE PRECISION,
+            value_date DATE,
             UNIQUE(asset_id, field_name)
         )
     ''')
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = 'asset_data' AND column_name = 'value_num'
+    ''', (schema_name,))
+    valores_tipados_em_falta = not extrair_valor(cursor.fetchone(), 0)
+    cursor.execute('ALTER TABLE asset_data ADD COLUMN IF NOT EXISTS value_num DOUBLE PRECISION')
+    cursor.execute('ALTER TABLE asset_data ADD COLUMN IF NOT EXISTS value_date DATE')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_asset_data_value_date ON asset_data(field_name, value_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_asset_data_value_num ON asset_data(field_name, value_num)')
+
+    # Flat asset projection (typed hot fields, maintained by shared.asset_data)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assets_flat (
+            asset_id INTEGER PRIMARY KEY REFERENCES assets(id) ON DELETE CASCADE,
+            serial_number TEXT,
+            status TEXT,
+            condition_status TEXT,
+            installation_location TEXT,
+            municipality TEXT,
+            street_address TEXT,
+            rfid_tag TEXT,
+            product_reference TEXT,
+            manufacturer TEXT,
+            model TEXT,
+            gps_latitude DOUBLE PRECISION,
+            gps_longitude DOUBLE PRECISION,
+            installation_date DATE,
+            last_inspection_date DATE,
+            next_inspection_date DATE,
+            next_maintenance_date DATE,
+            warranty_end_date DATE,
+            updated_at TIMESTAMP
+        )
+    ''')
+    for coluna in _INDICES_ASSETS_FLAT:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_assets_flat_{coluna} ON assets_flat({coluna})')
 
     # Maintenance Log
     cursor.execute('''
@@ -872,6 +1649,7 @@ def _criar_tabelas_postgres(conn, schema_name):
     ''')
 
     conn.commit()
+    return valores_tipados_em_falta
 
 
 # =========================================================================
@@ -879,16 +1657,35 @@ def _criar_tabelas_postgres(conn, schema_name):
 # =========================================================================
 
 def inicializar_bd_tenant(tenant_id):
-    """Initialize the database schema for a specific tenant.
+    """Bring a tenant database up to SCHEMA_VERSION.
 
-    This is the single source of truth for the tenant database schema.
-    Uses CREATE TABLE IF NOT EXISTS and ALTER TABLE for safe migration.
+    Only pending migration steps run; an up-to-date tenant costs a single
+    version lookup. See shared/migrations.py.
+    """
+    from .migrations import migrar_tenant
+    migrar_tenant(tenant_id)
+    return None if USE_POSTGRES else obter_bd(tenant_id)
+
+
+def aplicar_esquema_base_tenant(tenant_id):
+    """Apply the baseline tenant schema (migrations.VERSAO_BASE_TENANT).
+
+    Uses CREATE TABLE IF NOT EXISTS and ALTER TABLE, so it also upgrades
+    databases created before versioned migrations existed. New schema
+    changes go into migrations.MIGRACOES_TENANT, not here.
     """
     if USE_POSTGRES:
         conn, schema_name = _criar_schema_postgres(tenant_id)
-        _criar_tabelas_postgres(conn, schema_name)
-        _inserir_dados_iniciais_postgres(conn)
-        _return_pg_connection(conn)
+        try:
+            valores_tipados_em_falta = _criar_tabelas_postgres(conn, schema_name)
+            _inserir_dados_iniciais_postgres(conn)
+            adapter = DatabaseAdapter(conn, is_postgres=True, schema_name=schema_name)
+            _preencher_assets_flat(adapter)
+            if valores_tipados_em_falta:
+                from .asset_data import reconstruir_valores_tipados
+                reconstruir_valores_tipados(adapter)
+        finally:
+            _return_pg_connection(conn)
         logger.info("PostgreSQL tenant schema initialized: %s", tenant_id)
         return None
 
@@ -1041,11 +1838,47 @@ def inicializar_bd_tenant(tenant_id):
             asset_id INTEGER NOT NULL,
             field_name TEXT NOT NULL,
             field_value TEXT,
+            value_num REAL,
+            value_date DATE,
             FOREIGN KEY (asset_id) REFERENCES assets(id) ON DELETE CASCADE,
             UNIQUE(asset_id, field_name)
         )
     ''')
 
+    # Typed shadows of field_value (number/date fields), for index range scans
+    colunas_asset_data = {c['name'] for c in bd.execute('PRAGMA table_info(asset_data)').fetchall()}
+    _safe_add_columns(bd, 'asset_data', [('value_num', 'REAL'), ('value_date', 'DATE')])
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_asset_data_value_date ON asset_data(field_name, value_date)')
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_asset_data_value_num ON asset_data(field_name, value_num)')
+
+    # --- Flat asset projection (typed hot fields, maintained by shared.asset_data) ---
+    bd.execute('''
+        CREATE TABLE IF NOT EXISTS assets_flat (
+            asset_id INTEGER PRIMARY KEY,
+            serial_number TEXT,
+            status TEXT,
+            condition_status TEXT,
+            installation_location TEXT,
+            municipality TEXT,
+            street_address TEXT,
+            rfid_tag TEXT,
+            product_reference TEXT,
+            manufacturer TEXT,
+            model TEXT,
+            gps_latitude REAL,
+            gps_longitude REAL,
+            installation_date DATE,
+            last_inspection_date DATE,
+            next_inspection_date DATE,
+            next_maintenance_date DATE,
+            warranty_end_date DATE,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (asset_id) REFERENCES assets(id) ON DELETE CASCADE
+        )
+    ''')
+    for coluna in _INDICES_ASSETS_FLAT:
+        bd.execute(f'CREATE INDEX IF NOT EXISTS idx_assets_flat_{coluna} ON assets_flat({coluna})')
+
     # --- Maintenance Log ---
     bd.execute('''
         CREATE TABLE IF NOT EXISTS maintenance_log (
@@ -1411,11 +2244,25 @@ def inicializar_bd_tenant(tenant_id):
         )
     ''')
 
+    # --- Backfill projections of databases created before them ---
+    _preencher_assets_flat(bd)
+    if 'value_num' not in colunas_asset_data:
+        from .asset_data import reconstruir_valores_tipados
+        reconstruir_valores_tipados(bd)
+
     bd.commit()
     logger.info("Tenant database initialized: %s", tenant_id)
     return bd
 
 
+def _preencher_assets_flat(bd):
+    """Build assets_flat once for tenants that already have assets."""
+    if get_count(bd, 'SELECT COUNT(*) as cnt FROM assets_flat') == 0 \
+            and get_count(bd, 'SELECT COUNT(*) as cnt FROM assets') > 0:
+        from .asset_data import reconstruir_assets_flat
+        reconstruir_assets_flat(bd)
+
+
 def _inserir_dados_iniciais_postgres(conn):
     """Insert initial data for PostgreSQL tenant."""
     cursor = conn.cursor()
@@ -1722,12 +2569,18 @@ def inicializar_catalogo():
 
 def _inicializar_catalogo_postgres():
     """Initialize catalog schema in PostgreSQL."""
-    conn = _get_pg_connection('public')
-    cursor = conn.cursor()
+    # Creates the catalog schema and sets search_path
+    conn = _get_pg_connection('catalog')
+    try:
+        _criar_tabelas_catalogo_postgres(conn)
+    finally:
+        _return_pg_connection(conn)
+    logger.info("PostgreSQL catalog schema initialized")
 
-    # Create catalog schema
-    cursor.execute("CREATE SCHEMA IF NOT EXISTS catalog")
-    cursor.execute("SET search_path TO catalog")
+
+def _criar_tabelas_catalogo_postgres(conn):
+    """Create the catalog tables and seed the default packs (commits)."""
+    cursor = conn.cursor()
 
     # Catalog Packs
     cursor.execute('''
@@ -1942,8 +2795,61 @@ def _inicializar_catalogo_postgres():
         ''', (pack_name, pack_desc))
 
     conn.commit()
-    _return_pg_connection(conn)
-    logger.info("PostgreSQL catalog schema initialized")
+
+
+def inicializar_diretorio():
+    """Initialize the global directory database schema."""
+    if USE_POSTGRES:
+        # close() returns the connection to the pool
+        bd = _obter_gestor_pg().adaptador('directory')
+    else:
+        bd = sqlite3.connect(DIRETORIO_PARTILHADO)
+
+    try:
+        # --- Session tokens -> owning tenant ---
+        bd.execute('''
+            CREATE TABLE IF NOT EXISTS session_directory (
+                token TEXT PRIMARY KEY,
+                tenant_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                expires_at TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        bd.execute('''
+            CREATE INDEX IF NOT EXISTS idx_session_directory_user
+            ON session_directory (tenant_id, user_id)
+        ''')
+
+        # --- User emails -> owning tenant ---
+        bd.execute('''
+            CREATE TABLE IF NOT EXISTS user_directory (
+                email TEXT NOT NULL,
+                tenant_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                active INTEGER DEFAULT 1,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (email, tenant_id)
+            )
+        ''')
+        bd.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_directory_user
+            ON user_directory (tenant_id, user_id)
+        ''')
+
+        # --- Directory bookkeeping (backfill markers) ---
+        bd.execute('''
+            CREATE TABLE IF NOT EXISTS directory_state (
+                state_key TEXT PRIMARY KEY,
+                state_value TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        bd.commit()
+    finally:
+        bd.close()
+    logger.info("Directory database initialized")
 
 
 def _safe_add_columns_catalog(bd, table_name, columns):
@@ -0,0 +1,384 @@
+"""
+SmartLamppost v5.0 - Global Directory
+Cross-tenant index that resolves session tokens and user emails to their
+owning tenant without scanning every tenant database.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+from .cache import TTLCache
+from .config import Config
+from .database import obter_bd, obter_bd_diretorio, carregar_tenants
+
+logger = logging.getLogger(__name__)
+
+# token -> {'tenant_id', 'user_id', 'expires_at'}
+_cache_sessoes = TTLCache(ttl_seconds=300, max_entries=50000)
+
+# Set once the user directory has been backfilled from existing tenants
+_utilizadores_sincronizados = False
+
+# Set once pre-directory session rows have been indexed
+_sessoes_sincronizadas = False
+
+# Revoked signed tokens: jti -> exp (logout) and (tenant_id, user_id) ->
+# (issued-before ms, exp) cut-offs (password reset, deactivation). Revocations
+# made by this process apply at once; other workers pick them up within the
+# refresh interval.
+REVOGACOES_REFRESH_SECONDS = float(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', '30'))
+_revogacoes = {'jtis': {}, 'utilizadores': {}, 'carregado_em': float('-inf')}
+_revogacoes_lock = threading.Lock()
+
+
+# =========================================================================
+# SESSION TOKENS
+# =========================================================================
+
+def registar_sessao(token, tenant_id, user_id, expires_at):
+    """Record a new session token in the directory.
+
+    Called after the session row has been committed in the tenant database.
+    Tokens missing from the directory are rejected, so a failure here is
+    logged and the session cannot be used.
+    """
+    try:
+        bd = obter_bd_diretorio()
+        bd.execute('''
+            INSERT INTO session_directory (token, tenant_id, user_id, expires_at)
+            VALUES (?, ?, ?, ?)
+        ''', (token, tenant_id, user_id, expires_at))
+        bd.commit()
+    except Exception as e:
+        logger.warning("Could not register session in directory: %s", e)
+        return
+
+    _cache_sessoes.set(token, {
+        'tenant_id': tenant_id,
+        'user_id': user_id,
+        'expires_at': expires_at
+    })
+
+
+def resolver_sessao(token):
+    """Resolve a session token to its directory entry.
+
+    Returns:
+        dict with tenant_id, user_id and expires_at, or None if unknown/expired.
+    """
+    agora = datetime.now().isoformat()
+
+    entrada = _cache_sessoes.get(token)
+    if entrada is not None:
+        if entrada['expires_at'] > agora:
+            return entrada
+        _cache_sessoes.delete(token)
+        return None
+
+    try:
+        _garantir_backfill_sessoes()
+        bd = obter_bd_diretorio()
+        row = bd.execute('''
+            SELECT tenant_id, user_id, expires_at FROM session_directory
+            WHERE token = ? AND expires_at > ?
+        ''', (token, agora)).fetchone()
+    except Exception as e:
+        logger.warning("Session directory lookup failed: %s", e)
+        return None
+
+    if not row:
+        return None
+
+    entrada = {
+        'tenant_id': row['tenant_id'],
+        'user_id': row['user_id'],
+        'expires_at': str(row['expires_at'])
+    }
+    _cache_sessoes.set(token, entrada)
+    return entrada
+
+
+def invalidar_sessao(token):
+    """Remove a single session token from the directory and cache."""
+    _cache_sessoes.delete(token)
+    try:
+        bd = obter_bd_diretorio()
+        bd.execute('DELETE FROM session_directory WHERE token = ?', (token,))
+        bd.commit()
+    except Exception as e:
+        logger.warning("Could not remove session from directory: %s", e)
+
+
+def invalidar_sessoes_utilizador(tenant_id, user_id):
+    """Remove every session of a user (logout everywhere, reset, deactivation).
+
+    Also revokes the user's signed tokens.
+    """
+    revogar_tokens_utilizador(tenant_id, user_id)
+    _cache_sessoes.delete_where(
+        lambda _token, e: e['tenant_id'] == tenant_id and e['user_id'] == user_id
+    )
+    try:
+        bd = obter_bd_diretorio()
+        bd.execute(
+            'DELETE FROM session_directory WHERE tenant_id = ? AND user_id = ?',
+            (tenant_id, user_id)
+        )
+        bd.commit()
+    except Exception as e:
+        logger.warning("Could not remove user sessions from directory: %s", e)
+
+
+def sincronizar_sessoes_tenant(tenant_id, bd_tenant=None):
+    """Index the unexpired session rows of one tenant in the directory.
+
+    Returns:
+        int: Number of sessions indexed
+    """
+    if bd_tenant is None:
+        bd_tenant = obter_bd(tenant_id)
+
+    sessoes = bd_tenant.execute(
+        'SELECT token, user_id, expires_at FROM sessions WHERE expires_at > ?',
+        (datetime.now().isoformat(),)
+    ).fetchall()
+
+    bd = obter_bd_diretorio()
+    bd.executemany('''
+        INSERT OR IGNORE INTO session_directory (token, tenant_id, user_id, expires_at)
+        VALUES (?, ?, ?, ?)
+    ''', [(s['token'], tenant_id, s['user_id'], str(s['expires_at'])) for s in sessoes])
+    bd.commit()
+    return len(sessoes)
+
+
+def _garantir_backfill_sessoes():
+    """Index sessions created before the directory existed, once.
+
+    After this, a token missing from the directory is unknown and is
+    rejected without looking at any tenant database.
+    """
+    global _sessoes_sincronizadas
+
+    if _sessoes_sincronizadas:
+        return
+
+    bd = obter_bd_diretorio()
+    marcador = bd.execute(
+        "SELECT state_value FROM directory_state WHERE state_key = 'sessions_backfilled'"
+    ).fetchone()
+
+    if not marcador:
+        total = 0
+        for tenant in carregar_tenants().get('tenants', []):
+            try:
+                total += sincronizar_sessoes_tenant(tenant['id'])
+            except Exception as e:
+                logger.debug("Error indexing sessions of tenant %s: %s", tenant['id'], str(e))
+        bd.execute(
+            "INSERT OR IGNORE INTO directory_state (state_key, state_value) VALUES ('sessions_backfilled', ?)",
+            (datetime.now().isoformat(),)
+        )
+        bd.commit()
+        logger.info("Session directory backfilled with %d sessions", total)
+
+    _sessoes_sincronizadas = True
+
+
+# =========================================================================
+# USER EMAILS
+# =========================================================================
+
+def registar_utilizador(tenant_id, user_id, email, active=True):
+    """Create or refresh the directory entry of a user.
+
+    Replaces any previous entry of the same user, so email changes
+    (e.g. anonymisation) don't leave the old address resolvable, and takes
+    over a stale entry of the same email in the tenant (e.g. after two
+    users swapped addresses).
+    """
+    bd = obter_bd_diretorio()
+    try:
+        bd.execute(
+            'DELETE FROM user_directory WHERE tenant_id = ? AND user_id = ?',
+            (tenant_id, user_id)
+        )
+        bd.execute('''
+            INSERT INTO user_directory (email, tenant_id, user_id, active, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (email, tenant_id) DO UPDATE SET
+                user_id = excluded.user_id, active = excluded.active, updated_at = excluded.updated_at
+        ''', (email, tenant_id, user_id, 1 if active else 0, datetime.now().isoformat()))
+        bd.commit()
+    except Exception:
+        bd.rollback()
+        # The user can't log in until the next directory resync
+        logger.exception("Could not register user %s of tenant %s in directory", email, tenant_id)
+
+
+def remover_utilizador(tenant_id, user_id):
+    """Remove a user from the directory."""
+    try:
+        bd = obter_bd_diretorio()
+        bd.execute(
+            'DELETE FROM user_directory WHERE tenant_id = ? AND user_id = ?',
+            (tenant_id, user_id)
+        )
+        bd.commit()
+    except Exception as e:
+        logger.warning("Could not remove user from directory: %s", e)
+
+
+def sincronizar_utilizadores_tenant(tenant_id, bd_tenant=None):
+    """Rebuild the directory entries of one tenant from its users table.
+
+    Used by tenant bootstrap, backup restore and the initial backfill.
+
+    Returns:
+        int: Number of users indexed
+    """
+    if bd_tenant is None:
+        bd_tenant = obter_bd(tenant_id)
+
+    users = bd_tenant.execute('SELECT id, email, active FROM users').fetchall()
+    agora = datetime.now().isoformat()
+
+    bd = obter_bd_diretorio()
+    bd.execute('DELETE FROM user_directory WHERE tenant_id = ?', (tenant_id,))
+    for user in users:
+        bd.execute('''
+            INSERT INTO user_directory (email, tenant_id, user_id, active, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user['email'], tenant_id, user['id'], 1 if user['active'] else 0, agora))
+    bd.commit()
+    return len(users)
+
+
+def _garantir_backfill_utilizadores():
+    """Index users of every registered tenant once, the first time it's needed."""
+    global _utilizadores_sincronizados
+
+    if _utilizadores_sincronizados:
+        return
+
+    bd = obter_bd_diretorio()
+    marcador = bd.execute(
+        "SELECT state_value FROM directory_state WHERE state_key = 'users_backfilled'"
+    ).fetchone()
+
+    if not marcador:
+        total = 0
+        for tenant in carregar_tenants().get('tenants', []):
+            try:
+                total += sincronizar_utilizadores_tenant(tenant['id'])
+            except Exception as e:
+                logger.debug("Error indexing users of tenant %s: %s", tenant['id'], str(e))
+        bd.execute(
+            "INSERT OR IGNORE INTO directory_state (state_key, state_value) VALUES ('users_backfilled', ?)",
+            (datetime.now().isoformat(),)
+        )
+        bd.commit()
+        logger.info("User directory backfilled with %d users", total)
+
+    _utilizadores_sincronizados = True
+
+
+def procurar_tenant_por_email(email):
+    """Resolve the tenant of an active user by email (one indexed lookup)."""
+    try:
+        _garantir_backfill_utilizadores()
+        bd = obter_bd_diretorio()
+        row = bd.execute(
+            'SELECT tenant_id FROM user_directory WHERE email = ? AND active = 1 LIMIT 1',
+            (email,)
+        ).fetchone()
+    except Exception as e:
+        logger.warning("User directory lookup failed: %s", e)
+        return None
+    return row['tenant_id'] if row else None
+
+
+# =========================================================================
+# SIGNED TOKEN REVOCATIONS
+# =========================================================================
+
+def _carregar_revogacoes():
+    """Reload the revocation list from the directory into memory.
+
+    Entries recorded locally while the query ran are kept until they expire.
+    """
+    agora = int(time.time())
+    bd = obter_bd_diretorio()
+    rows = bd.execute('''
+        SELECT revocation_key, tenant_id, user_id, issued_before, expires_at
+        FROM token_revocations WHERE expires_at > ?
+    ''', (agora,)).fetchall()
+
+    with _revogacoes_lock:
+        jtis = {k: v for k, v in _revogacoes['jtis'].items() if v > agora}
+        utilizadores = {k: v for k, v in _revogacoes['utilizadores'].items() if v[1] > agora}
+        for row in rows:
+            if row['issued_before'] is None:
+                jtis[row['revocation_key']] = row['expires_at']
+            else:
+                chave = (row['tenant_id'], row['user_id'])
+                atual = utilizadores.get(chave)
+                if atual is None or row['issued_before'] > atual[0]:
+                    utilizadores[chave] = (row['issued_before'], row['expires_at'])
+        _revogacoes.update(jtis=jtis, utilizadores=utilizadores, carregado_em=time.monotonic())
+
+
+def _obter_revogacoes():
+    """Return the in-memory revocation list, refreshing it when it is stale."""
+    if time.monotonic() - _revogacoes['carregado_em'] >= REVOGACOES_REFRESH_SECONDS:
+        try:
+            _carregar_revogacoes()
+        except Exception as e:
+            # Keep serving the last known list; retry on the next interval
+            logger.warning("Could not refresh token revocations: %s", e)
+            _revogacoes['carregado_em'] = time.monotonic()
+    return _revogacoes
+
+
+def token_revogado(claims):
+    """Check the claims of a signed token against the revocation list."""
+    revogacoes = _obter_revogacoes()
+    if claims.get('jti') in revogacoes['jtis']:
+        return True
+    corte = revogacoes['utilizadores'].get((claims.get('tid'), claims.get('uid')))
+    return corte is not None and claims.get('iat', 0) <= corte[0]
+
+
+def _guardar_revogacao(chave, tenant_id, user_id, issued_before, expires_at):
+    try:
+        bd = obter_bd_diretorio()
+        bd.execute('DELETE FROM token_revocations WHERE revocation_key = ?', (chave,))
+        bd.execute('''
+            INSERT INTO token_revocations
+            (revocation_key, tenant_id, user_id, issued_before, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (chave, tenant_id, user_id, issued_before, expires_at))
+        bd.commit()
+    except Exception as e:
+        logger.warning("Could not record token revocation: %s", e)
+
+
+def revogar_token(claims):
+    """Revoke one signed token (logout) until it expires."""
+    with _revogacoes_lock:
+        _revogacoes['jtis'][claims['jti']] = claims['exp']
+    _guardar_revogacao(claims['jti'], claims['tid'], claims['uid'], None, claims['exp'])
+
+
+def revogar_tokens_utilizador(tenant_id, user_id):
+    """Revoke every signed token issued to a user so far."""
+    emitido_antes = int(time.time() * 1000)
+    # Tokens issued before now are all expired after one token lifetime
+    expira = int(time.time()) + Config.TOKEN_EXPIRATION_HOURS * 3600
+    with _revogacoes_lock:
+        _revogacoes['utilizadores'][(tenant_id, user_id)] = (emitido_antes, expira)
+    _guardar_revogacao(f'user:{tenant_id}:{user_id}', tenant_id, user_id,
+                       emitido_antes, expira)
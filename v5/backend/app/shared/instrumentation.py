@@ -0,0 +1,111 @@
+"""
+SmartLamppost v5.0 - Query Instrumentation
+Per-request database metrics: statement count, total DB time, slowest
+statements and repeated statements (N+1 patterns).
+
+Statements are recorded by DatabaseAdapter and the pooled SQLite
+connections into flask.g. After each request the totals are returned in a
+Server-Timing header and logged when they exceed the configured thresholds.
+"""
+
+import re
+import heapq
+import logging
+from collections import Counter
+from functools import lru_cache
+
+from flask import g, has_app_context, request
+
+logger = logging.getLogger(__name__)
+
+_RE_ESPACOS = re.compile(r'\s+')
+_RE_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_RE_LISTAS = re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)')
+
+
+@lru_cache(maxsize=4096)
+def normalizar_consulta(sql):
+    """Reduce a statement to its shape: literals and IN lists become '?'."""
+    sql = _RE_ESPACOS.sub(' ', sql).strip()
+    sql = _RE_LITERAIS.sub('?', sql)
+    return _RE_LISTAS.sub('(?)', sql)
+
+
+class MetricasPedido:
+    """Database metrics accumulated during one request."""
+
+    def __init__(self, max_lentas=5):
+        self.total = 0
+        self.duracao = 0.0
+        self.max_lentas = max_lentas
+        self._lentas = []  # min-heap of (duration, order, sql)
+        self.repeticoes = Counter()
+
+    def registar(self, sql, duracao):
+        """Record one executed statement."""
+        self.total += 1
+        self.duracao += duracao
+        self.repeticoes[sql] += 1
+        entrada = (duracao, self.total, sql)
+        if len(self._lentas) < self.max_lentas:
+            heapq.heappush(self._lentas, entrada)
+        elif duracao > self._lentas[0][0]:
+            heapq.heapreplace(self._lentas, entrada)
+
+    def mais_lentas(self):
+        """Return [(duration_ms, normalized sql)] slowest first."""
+        return [(round(d * 1000, 2), normalizar_consulta(sql))
+                for d, _, sql in sorted(self._lentas, reverse=True)]
+
+    def repetidas(self, limite):
+        """Return [(normalized sql, count)] of statement shapes run more than limite times."""
+        formas = Counter()
+        for sql, n in self.repeticoes.items():
+            formas[normalizar_consulta(sql)] += n
+        return [(sql, n) for sql, n in formas.most_common() if n > limite]
+
+
+def registar_consulta(sql, duracao):
+    """Record a statement in the current request's metrics (no-op outside a context)."""
+    if not has_app_context():
+        return
+    metricas = g.get('_metricas_bd')
+    if metricas is None:
+        metricas = g._metricas_bd = MetricasPedido()
+    metricas.registar(sql, duracao)
+
+
+def obter_metricas_pedido():
+    """Return the MetricasPedido of the current request, or None."""
+    return g.get('_metricas_bd') if has_app_context() else None
+
+
+def init_instrumentacao(app):
+    """Register the after_request hook that reports per-request DB metrics."""
+    if not app.config.get('QUERY_INSTRUMENTATION', True):
+        return
+
+    limite_ms = app.config.get('QUERY_LOG_MIN_MS', 500)
+    limite_total = app.config.get('QUERY_LOG_MIN_COUNT', 100)
+    limite_repeticoes = app.config.get('QUERY_REPEAT_THRESHOLD', 20)
+
+    @app.after_request
+    def reportar_metricas_bd(response):
+        metricas = obter_metricas_pedido()
+        if metricas is None:
+            return response
+
+        duracao_ms = metricas.duracao * 1000
+        response.headers.add(
+            'Server-Timing', f'db;dur={duracao_ms:.1f};desc="{metricas.total} queries"'
+        )
+
+        if duracao_ms >= limite_ms or metricas.total >= limite_total:
+            logger.warning("[DB] %s %s: %d queries in %.1f ms, slowest: %s",
+                           request.method, request.path, metricas.total, duracao_ms,
+                           metricas.mais_lentas())
+
+        for sql, n in metricas.repetidas(limite_repeticoes):
+            logger.warning("[DB] Possible N+1 on %s %s: statement ran %d times: %s",
+                           request.method, request.path, n, sql)
+        return response
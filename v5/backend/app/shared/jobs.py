@@ -0,0 +1,165 @@
+"""
+SmartLamppost v5.0 - Background Jobs
+Runs long tenant operations (e.g. bulk deletes of thousands of assets) off
+the request thread and tracks their progress in the tenant database.
+
+Job state lives in the tenant's background_jobs table rather than in
+memory, so the status endpoint answers from any worker while the job runs
+in the worker that accepted it.
+
+Jobs do not survive the process that runs them. A running row whose
+updated_at has not moved for JOB_STALE_MINUTES (a queued row, for
+JOB_QUEUED_STALE_MINUTES) is closed as failed when its status is read and by the scheduled purge, so it is never
+reported as running forever. Nothing is scanned at startup: a restarting
+worker cannot tell its own lost jobs from those of a worker still alive.
+"""
+
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g
+
+from .database import obter_bd
+
+logger = logging.getLogger(__name__)
+
+# Jobs running at the same time per worker process
+JOB_WORKERS = 2
+
+# Minutes a running job may go without touching updated_at before it is
+# taken as lost with its worker (running jobs touch it on every progress
+# report, so this only needs to exceed the gap between two reports)
+JOB_STALE_MINUTES = int(os.environ.get('JOB_STALE_MINUTES', '30'))
+
+# Same for a queued job, which touches nothing while it waits behind the
+# JOB_WORKERS jobs ahead of it, so the limit must outlast a long queue
+JOB_QUEUED_STALE_MINUTES = int(os.environ.get('JOB_QUEUED_STALE_MINUTES', '1440'))
+
+ERRO_TAREFA_INTERROMPIDA = 'Tarefa interrompida: o processo que a executava terminou'
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='slp-job')
+
+
+def _serializar_tarefa(row):
+    tarefa = dict(row)
+    tarefa['result'] = json.loads(tarefa['result']) if tarefa.get('result') else None
+    for campo in ('created_at', 'updated_at', 'finished_at'):
+        if tarefa.get(campo) is not None:
+            tarefa[campo] = str(tarefa[campo])
+    return tarefa
+
+
+def _parada(row, agora):
+    """Whether a queued/running job row has gone stale."""
+    atualizada = row['updated_at']
+    if not isinstance(atualizada, datetime):
+        atualizada = datetime.fromisoformat(str(atualizada))
+    minutos = JOB_QUEUED_STALE_MINUTES if row['status'] == 'queued' else JOB_STALE_MINUTES
+    return atualizada < agora - timedelta(minutes=minutos)
+
+
+def obter_tarefa(bd, job_id):
+    """Return a job as a dict, or None if it does not exist.
+
+    A stale queued/running job is closed as interrupted before it is returned.
+    """
+    row = bd.execute('SELECT * FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+    if row and row['status'] in ('queued', 'running') and _parada(row, datetime.now()):
+        marcar_tarefas_interrompidas(bd, job_id)
+        row = bd.execute('SELECT * FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+    return _serializar_tarefa(row) if row else None
+
+
+def atualizar_progresso(bd, job_id, processados, falhados=0):
+    """Record the progress of a running job and commit."""
+    bd.execute('''
+        UPDATE background_jobs SET processed = ?, failed = ?, updated_at = ?
+        WHERE id = ?
+    ''', (processados, falhados, datetime.now().isoformat(), job_id))
+    bd.commit()
+
+
+def _terminar(bd, job_id, estado, resultado=None, erro=None):
+    agora = datetime.now().isoformat()
+    bd.execute('''
+        UPDATE background_jobs SET status = ?, result = ?, error = ?, updated_at = ?, finished_at = ?
+        WHERE id = ?
+    ''', (estado, json.dumps(resultado, default=str) if resultado is not None else None,
+          erro, agora, agora, job_id))
+    bd.commit()
+
+
+def _executar(app, tenant_id, job_id, funcao, args):
+    with app.app_context():
+        g.tenant_id = tenant_id
+        bd = obter_bd(tenant_id)
+        cursor = bd.execute(
+            "UPDATE background_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (datetime.now().isoformat(), job_id)
+        )
+        bd.commit()
+        if not cursor.rowcount:
+            # Closed as interrupted while it waited for a free worker
+            logger.warning("[JOBS] %s is no longer queued in tenant %s, skipping", job_id, tenant_id)
+            return
+        try:
+            resultado = funcao(bd, job_id, *args)
+        except Exception as e:
+            logger.error("[JOBS] %s failed in tenant %s: %s", job_id, tenant_id, e)
+            bd.rollback()
+            _terminar(bd, job_id, 'failed', erro=str(e))
+            return
+        _terminar(bd, job_id, 'completed', resultado)
+        logger.info("[JOBS] %s completed in tenant %s", job_id, tenant_id)
+
+
+def submeter_tarefa(bd, tipo, total, funcao, *args, user_id=None):
+    """Queue a job and return its id.
+
+    Args:
+        bd: Database connection of the current tenant (the job row is committed)
+        tipo: Job type, e.g. 'bulk_delete_assets'
+        total: Number of items the job will process
+        funcao: Callable funcao(bd, job_id, *args) run in a worker thread with
+            its own app context and connection; its return value is stored as
+            the job result
+        user_id: User that requested the job
+    """
+    job_id = uuid.uuid4().hex
+    tenant_id = getattr(g, 'tenant_id', None)
+    agora = datetime.now().isoformat()
+    bd.execute('''
+        INSERT INTO background_jobs (id, job_type, status, total, processed, failed, created_by, created_at, updated_at)
+        VALUES (?, ?, 'queued', ?, 0, 0, ?, ?, ?)
+    ''', (job_id, tipo, total, user_id, agora, agora))
+    bd.commit()
+
+    _executor.submit(_executar, current_app._get_current_object(), tenant_id, job_id, funcao, args)
+    return job_id
+
+
+def marcar_tarefas_interrompidas(bd, job_id=None):
+    """Close the queued/running jobs left behind by a worker that exited, and commit.
+
+    Args:
+        bd: Tenant database connection
+        job_id: Only check this job (default: every job of the tenant)
+
+    Returns:
+        int: Jobs marked as failed
+    """
+    agora = datetime.now()
+    limite_execucao = agora - timedelta(minutes=JOB_STALE_MINUTES)
+    limite_fila = agora - timedelta(minutes=JOB_QUEUED_STALE_MINUTES)
+    filtro, params = ('AND id = ?', (job_id,)) if job_id else ('', ())
+    cursor = bd.execute(f'''
+        UPDATE background_jobs SET status = 'failed', error = ?, updated_at = ?, finished_at = ?
+        WHERE ((status = 'running' AND updated_at < ?) OR (status = 'queued' AND updated_at < ?)) {filtro}
+    ''', (ERRO_TAREFA_INTERROMPIDA, agora.isoformat(), agora.isoformat(),
+          limite_execucao.isoformat(), limite_fila.isoformat()) + params)
+    bd.commit()
+    return cursor.rowcount or 0
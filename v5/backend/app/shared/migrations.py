@@ -0,0 +1,306 @@
+"""
+SmartLamppost v5.0 - Schema Migrations
+Versioned schema upgrades for the tenant, catalog and directory databases.
+
+Every database records the versions applied to it in a schema_migrations
+table. A database without that record gets the baseline DDL (the
+CREATE IF NOT EXISTS initializers in database.py) and is stamped with the
+baseline version; after that only the numbered steps above its current
+version run. Schema changes ship as new steps in the lists below.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .search import criar_indice_pesquisa
+from .database import (
+    obter_bd, obter_bd_catalogo, obter_bd_diretorio, obter_lista_tenants,
+    inicializar_catalogo, inicializar_diretorio, aplicar_esquema_base_tenant,
+    extrair_valor, SCHEMA_VERSION
+)
+
+logger = logging.getLogger(__name__)
+
+
+# =========================================================================
+# MIGRATION STEPS
+# =========================================================================
+
+# Version reached by each baseline initializer
+VERSAO_BASE_TENANT = 6
+VERSAO_BASE_CATALOGO = 1
+VERSAO_BASE_DIRETORIO = 1
+
+
+def _v7_indices_consultas_criticas(bd):
+    """Indexes for the hot predicates listed in query_plans.CONSULTAS_CRITICAS.
+
+    sessions.token and user_permissions(user_id, section, field_name) are
+    already served by their UNIQUE constraints.
+    """
+    for nome, tabela, colunas in (
+        ('idx_asset_data_field_value', 'asset_data', 'field_name, field_value'),
+        ('idx_interventions_asset_created', 'interventions', 'asset_id, created_at'),
+        ('idx_interventions_status', 'interventions', 'status'),
+        ('idx_audit_log_created_at', 'audit_log', 'created_at'),
+        ('idx_status_change_log_asset_changed', 'status_change_log', 'asset_id, changed_at'),
+    ):
+        bd.execute(f'CREATE INDEX IF NOT EXISTS {nome} ON {tabela}({colunas})')
+
+
+def _v8_indices_paginacao(bd):
+    """(created_at, id) indexes behind the keyset-paginated listings."""
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_assets_created_id ON assets(created_at, id)')
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_interventions_created_id ON interventions(created_at, id)')
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_created_id ON audit_log(created_at, id)')
+    bd.execute('DROP INDEX IF EXISTS idx_audit_log_created_at')
+
+
+def _v9_indices_expiracao(bd):
+    """expires_at indexes used by the scheduled purge of expired rows."""
+    for tabela in ('sessions', 'two_factor_codes', 'password_reset_tokens'):
+        bd.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabela}_expires ON {tabela}(expires_at)')
+
+
+def _v10_indice_pesquisa(bd):
+    """Trigram search index over assets_flat (see shared.search)."""
+    criar_indice_pesquisa(bd)
+
+
+def _v11_tarefas_segundo_plano(bd):
+    """Progress of background jobs (see shared.jobs)."""
+    bd.execute('''
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            id TEXT PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER DEFAULT 0,
+            processed INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+
+def _v12_series_modulos(bd):
+    """asset_module_serials, until now created on first use by the module
+    serial routes; set-based deletes of assets need it to exist."""
+    bd.execute('''
+        CREATE TABLE IF NOT EXISTS asset_module_serials (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            asset_id INTEGER NOT NULL,
+            module_name TEXT NOT NULL,
+            module_description TEXT,
+            serial_number TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_by INTEGER,
+            FOREIGN KEY (asset_id) REFERENCES assets(id),
+            UNIQUE(asset_id, module_name)
+        )
+    ''')
+
+
+def _v13_registo_alteracoes(bd):
+    """asset_changes, the change log behind delta sync (see
+    asset_data.registar_alteracoes). Existing assets are logged once, using
+    their id as sequence, so a first sync from token 0 returns all of them."""
+    bd.execute('''
+        CREATE TABLE IF NOT EXISTS asset_changes (
+            asset_id INTEGER NOT NULL PRIMARY KEY,
+            serial_number TEXT,
+            change_seq INTEGER NOT NULL,
+            deleted INTEGER DEFAULT 0,
+            changed_at TIMESTAMP
+        )
+    ''')
+    bd.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_asset_changes_seq ON asset_changes(change_seq)')
+    bd.execute('''
+        INSERT OR IGNORE INTO asset_changes (asset_id, serial_number, change_seq, deleted, changed_at)
+        SELECT id, serial_number, id, 0, CURRENT_TIMESTAMP FROM assets
+    ''')
+    ultimo = extrair_valor(bd.execute('SELECT MAX(change_seq) FROM asset_changes').fetchone(), 0) or 0
+    bd.execute('''
+        INSERT INTO sequence_counters (counter_type, current_value)
+        VALUES ('asset_changes', ?)
+        ON CONFLICT (counter_type) DO UPDATE SET current_value = CASE
+            WHEN sequence_counters.current_value > excluded.current_value
+            THEN sequence_counters.current_value ELSE excluded.current_value END
+    ''', (ultimo,))
+
+
+def _diretorio_v2_revogacoes_tokens(bd):
+    """Revocation list of signed access tokens (see directory.token_revogado).
+
+    Rows with issued_before NULL revoke one token id; otherwise every token
+    of the user issued before that time (epoch ms). expires_at is epoch
+    seconds, after which the row no longer matters.
+    """
+    bd.execute('''
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            revocation_key TEXT PRIMARY KEY,
+            tenant_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            issued_before BIGINT,
+            expires_at BIGINT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_token_revocations_expires ON token_revocations(expires_at)')
+
+
+def _diretorio_v3_indice_expiracao(bd):
+    """expires_at index used by the scheduled purge of session_directory."""
+    bd.execute('CREATE INDEX IF NOT EXISTS idx_session_directory_expires ON session_directory(expires_at)')
+
+
+# (version, description, function(bd)) applied on top of the baseline, in
+# ascending version order. Steps must be safe to re-run (IF NOT EXISTS),
+# since two workers may race on the same database.
+MIGRACOES_TENANT = [
+    (7, 'Indexes for hot query paths', _v7_indices_consultas_criticas),
+    (8, 'Keyset pagination indexes', _v8_indices_paginacao),
+    (9, 'Expiry indexes for purging', _v9_indices_expiracao),
+    (10, 'Asset search index', _v10_indice_pesquisa),
+    (11, 'Background jobs', _v11_tarefas_segundo_plano),
+    (12, 'Asset module serials table', _v12_series_modulos),
+    (13, 'Asset change log for delta sync', _v13_registo_alteracoes),
+]
+MIGRACOES_CATALOGO = []
+MIGRACOES_DIRETORIO = [
+    (2, 'Signed token revocation list', _diretorio_v2_revogacoes_tokens),
+    (3, 'Session expiry index for purging', _diretorio_v3_indice_expiracao),
+]
+
+# Parallel workers for offline migration of every tenant
+MIGRACAO_WORKERS = 4
+
+
+# =========================================================================
+# VERSION BOOKKEEPING
+# =========================================================================
+
+def _versao_alvo(versao_base, passos):
+    """Return the version a database ends at after every step."""
+    return passos[-1][0] if passos else versao_base
+
+
+def obter_versao_esquema(bd):
+    """Return the highest version applied to a database (0 if never migrated)."""
+    try:
+        row = bd.execute('SELECT MAX(version) as version FROM schema_migrations').fetchone()
+    except Exception:
+        # No schema_migrations table yet (PostgreSQL needs the rollback)
+        bd.rollback()
+        return 0
+    return extrair_valor(row, 'version') or 0
+
+
+def _registar_versao(bd, versao, descricao):
+    """Record an applied version and commit."""
+    bd.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    bd.execute(
+        'INSERT OR IGNORE INTO schema_migrations (version, description) VALUES (?, ?)',
+        (versao, descricao)
+    )
+    bd.commit()
+
+
+def _migrar(nome, obter_ligacao, versao_base, aplicar_base, passos):
+    """Apply the pending baseline/steps of one database.
+
+    Returns:
+        tuple: (version before, version after)
+    """
+    bd = obter_ligacao()
+    versao_inicial = obter_versao_esquema(bd)
+    alvo = _versao_alvo(versao_base, passos)
+    if versao_inicial >= alvo:
+        return versao_inicial, versao_inicial
+
+    if versao_inicial < versao_base:
+        aplicar_base()
+        bd = obter_ligacao()
+        _registar_versao(bd, versao_base, 'Baseline schema')
+        logger.info("[MIGRATIONS] %s: baseline schema v%d applied", nome, versao_base)
+
+    for versao, descricao, passo in passos:
+        if versao <= max(versao_inicial, versao_base):
+            continue
+        passo(bd)
+        _registar_versao(bd, versao, descricao)
+        logger.info("[MIGRATIONS] %s: v%d %s", nome, versao, descricao)
+
+    return versao_inicial, alvo
+
+
+# =========================================================================
+# ENTRY POINTS
+# =========================================================================
+
+def migrar_tenant(tenant_id):
+    """Bring one tenant database up to SCHEMA_VERSION (needs an app context)."""
+    versoes = _migrar(
+        f'tenant {tenant_id}',
+        lambda: obter_bd(tenant_id),
+        VERSAO_BASE_TENANT,
+        lambda: aplicar_esquema_base_tenant(tenant_id),
+        MIGRACOES_TENANT
+    )
+    if versoes[1] != SCHEMA_VERSION:
+        logger.warning("[MIGRATIONS] tenant %s is at v%d, SCHEMA_VERSION is %d",
+                       tenant_id, versoes[1], SCHEMA_VERSION)
+    return versoes
+
+
+def migrar_catalogo():
+    """Bring the shared catalog database up to date (needs an app context)."""
+    return _migrar('catalog', obter_bd_catalogo, VERSAO_BASE_CATALOGO,
+                   inicializar_catalogo, MIGRACOES_CATALOGO)
+
+
+def migrar_diretorio():
+    """Bring the global directory database up to date (needs an app context)."""
+    return _migrar('directory', obter_bd_diretorio, VERSAO_BASE_DIRETORIO,
+                   inicializar_diretorio, MIGRACOES_DIRETORIO)
+
+
+def migrar_bases_partilhadas():
+    """Migrate the databases shared by all tenants (catalog and directory)."""
+    migrar_catalogo()
+    migrar_diretorio()
+
+
+def migrar_todos_tenants(app, tenants=None, workers=MIGRACAO_WORKERS):
+    """Migrate many tenants in parallel, each in its own app context.
+
+    Tenant databases are independent (one SQLite file or PostgreSQL schema
+    each), so they can be upgraded concurrently.
+
+    Returns:
+        dict: {tenant_id: (version before, version after)} or
+        {tenant_id: Exception} for tenants that failed
+    """
+    def migrar(tenant_id):
+        with app.app_context():
+            try:
+                return migrar_tenant(tenant_id)
+            except Exception as e:
+                logger.error("[MIGRATIONS] tenant %s failed: %s", tenant_id, e)
+                return e
+
+    tenant_ids = list(tenants or obter_lista_tenants())
+    if not tenant_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tenant_ids)))) as executor:
+        return dict(zip(tenant_ids, executor.map(migrar, tenant_ids)))
@@ -0,0 +1,147 @@
+"""
+SmartLamppost v5.0 - Keyset Pagination
+Opaque cursors for listings ordered newest first by (created_at, id).
+
+A cursor encodes the (created_at, id) of the last row of a page; the next
+page is a range read on the (created_at, id) index instead of an OFFSET
+that walks every skipped row. Totals are optional and cached briefly, so
+scrolling a large table does not re-count it on every page.
+
+Rows without a created_at never satisfy the (created_at, id) range, so
+they are paged as a second segment after every dated row, newest id
+first; a cursor whose created_at is null points into that segment.
+"""
+
+import json
+import base64
+import logging
+
+from flask import g
+
+from .cache import TTLCache
+from .database import extrair_valor
+
+logger = logging.getLogger(__name__)
+
+# (tenant, listing, count query, params) -> total
+_cache_totais = TTLCache(ttl_seconds=60, max_entries=5000)
+
+# ?total= values: exact count, recent count (default), or no count at all
+MODOS_TOTAL = ('exact', 'cached', 'none')
+
+
+def codificar_cursor(created_at, row_id):
+    """Encode the sort key of a row as an opaque URL-safe cursor."""
+    chave = json.dumps([str(created_at) if created_at is not None else None, row_id])
+    return base64.urlsafe_b64encode(chave.encode()).decode().rstrip('=')
+
+
+def descodificar_cursor(cursor):
+    """Decode a cursor into (created_at, id).
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        chave = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(chave)
+        return created_at, int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+
+
+def _no_segmento_nulo(after):
+    """Whether a cursor points past the last dated row."""
+    return bool(after) and descodificar_cursor(after)[0] is None
+
+
+def consulta_por_cursor(select_sql, where_sql, params, after, per_page,
+                        coluna_data='created_at', coluna_id='id', nulos=False):
+    """Build the query of one page after a cursor (see paginar_por_cursor).
+
+    Reads the dated rows, or with nulos (or a cursor into that segment)
+    the rows whose coluna_data is NULL.
+
+    Returns:
+        tuple: (sql, params)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    params = list(params)
+    created_at, row_id = descodificar_cursor(after) if after else (None, None)
+    if nulos or (after and created_at is None):
+        where_sql += f' AND {coluna_data} IS NULL'
+        if after and created_at is None:
+            where_sql += f' AND {coluna_id} < ?'
+            params.append(row_id)
+        ordem = f'{coluna_id} DESC'
+    else:
+        if after:
+            where_sql += f' AND ({coluna_data}, {coluna_id}) < (?, ?)'
+            params.extend([created_at, row_id])
+        else:
+            where_sql += f' AND {coluna_data} IS NOT NULL'
+        ordem = f'{coluna_data} DESC, {coluna_id} DESC'
+    return f'{select_sql} {where_sql} ORDER BY {ordem} LIMIT ?', params + [per_page + 1]
+
+
+def paginar_por_cursor(bd, select_sql, where_sql, params, after, per_page,
+                       coluna_data='created_at', coluna_id='id'):
+    """Fetch one page of rows after a cursor, newest first, undated rows last.
+
+    Args:
+        bd: Database connection
+        select_sql: 'SELECT ... FROM ... [JOIN ...]' part of the query
+        where_sql: 'WHERE ...' filter part (may be 'WHERE 1=1')
+        params: Parameters of where_sql
+        after: Cursor from the previous page, or '' for the first page
+        per_page: Page size
+        coluna_data, coluna_id: Qualified sort columns (e.g. 'a.created_at')
+
+    Returns:
+        tuple: (rows, next cursor or None)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    rows = bd.execute(*consulta_por_cursor(select_sql, where_sql, params, after, per_page,
+                                           coluna_data, coluna_id)).fetchall()
+    if len(rows) <= per_page and not _no_segmento_nulo(after):
+        # Dated rows ran out: fill the page from the undated ones
+        rows = list(rows) + bd.execute(*consulta_por_cursor(
+            select_sql, where_sql, params, None, per_page - len(rows),
+            coluna_data, coluna_id, nulos=True)).fetchall()
+    return dividir_pagina(rows, per_page)
+
+
+def dividir_pagina(rows, per_page):
+    """Split a LIMIT per_page + 1 result into (page rows, next cursor or None)."""
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    ultimo = rows[-1]
+    return rows, codificar_cursor(ultimo['created_at'], ultimo['id'])
+
+
+def obter_total(bd, listagem, count_sql, params, modo=None):
+    """Return the row count of a listing according to ?total=.
+
+    Args:
+        listagem: Name of the listing (part of the cache key)
+        modo: 'exact', 'cached' (default, reuses a count up to 60s old)
+            or 'none' (returns None)
+    """
+    modo = modo if modo in MODOS_TOTAL else 'cached'
+    if modo == 'none':
+        return None
+
+    chave = (getattr(g, 'tenant_id', None), listagem, count_sql, tuple(params))
+    if modo == 'cached':
+        total = _cache_totais.get(chave)
+        if total is not None:
+            return total
+
+    total = extrair_valor(bd.execute(count_sql, params).fetchone(), 0) or 0
+    _cache_totais.set(chave, total)
+    return total
@@ -4,17 +4,33 @@ RBAC (Role-Based Access Control) for multi-tenant authorization.
 """
 
 import json
+import time
+import secrets
 import logging
 from functools import wraps
 from datetime import datetime
 
-from flask import request, jsonify, g
+from flask import request, jsonify, g, current_app
 
-from .database import obter_bd, carregar_tenants, MASTER_TENANT_ID
+from .cache import TTLCache
+from .database import obter_bd, MASTER_TENANT_ID
 from .plans import TenantPlanService
+from .query_plans import registar_consulta_critica
+from .security import is_signed_token, generate_signed_token, verify_signed_token
+from .directory import (
+    resolver_sessao, invalidar_sessao, procurar_tenant_por_email,
+    token_revogado
+)
 
 logger = logging.getLogger(__name__)
 
+# (tenant_id, user_id) -> permission matrix (see _carregar_matriz). Writes in
+# this process invalidate explicitly; the TTL bounds staleness across workers.
+_cache_permissoes = TTLCache(ttl_seconds=60, max_entries=20000)
+
+# Action -> position in the section tuple of the matrix
+_ACOES = {'view': 0, 'create': 1, 'edit': 2, 'delete': 3}
+
 # Role hierarchy (higher number = more permissions)
 ROLE_HIERARCHY = {
     'guest': 0,
@@ -26,20 +42,80 @@ ROLE_HIERARCHY = {
 
 
 def identificar_tenant_por_email(email):
-    """Identify tenant by user email - searches all tenant databases."""
-    dados = carregar_tenants()
-    for tenant in dados.get('tenants', []):
-        try:
-            bd = obter_bd(tenant['id'])
-            user = bd.execute(
-                'SELECT id FROM users WHERE email = ? AND active = 1',
-                (email,)
-            ).fetchone()
-            if user:
-                return tenant['id']
-        except Exception:
-            continue
-    return None
+    """Identify tenant by user email through the global user directory."""
+    return procurar_tenant_por_email(email)
+
+
+_QUERY_SESSAO = '''
+    SELECT s.*, u.id as user_id, u.email, u.role, u.first_name,
+           u.last_name, u.two_factor_enabled, u.must_change_password
+    FROM sessions s
+    JOIN users u ON s.user_id = u.id
+    WHERE s.token = ? AND s.expires_at > ? AND u.active = 1
+'''
+registar_consulta_critica('session_by_token', _QUERY_SESSAO, ('token', '2000-01-01'))
+
+_QUERY_PERMISSOES = '''
+    SELECT section, field_name, can_view, can_create, can_edit, can_delete
+    FROM user_permissions
+    WHERE user_id = ?
+'''
+registar_consulta_critica('user_permissions', _QUERY_PERMISSOES, (1,))
+
+
+def _validar_sessao_tenant(tenant_id, token):
+    """Validate a token against a single tenant database."""
+    bd = obter_bd(tenant_id)
+    sessao = bd.execute(_QUERY_SESSAO, (token, datetime.now().isoformat())).fetchone()
+    return dict(sessao) if sessao else None
+
+
+def emitir_token_assinado(tenant_id, user_id, role, email, horas):
+    """Issue a signed access token that is verified without a session row.
+
+    Returns:
+        tuple: (token, expiry epoch seconds)
+    """
+    agora = time.time()
+    expira = int(agora + horas * 3600)
+    token = generate_signed_token({
+        'tid': tenant_id, 'uid': user_id, 'role': role, 'email': email,
+        'iat': int(agora * 1000), 'exp': expira, 'jti': secrets.token_urlsafe(12)
+    }, current_app.config['SECRET_KEY'])
+    return token, expira
+
+
+def _validar_token_assinado(token):
+    """Validate a signed token: signature, expiry and revocation list only."""
+    claims = verify_signed_token(token, current_app.config['SECRET_KEY'])
+    if not claims or token_revogado(claims):
+        return None, None
+    g.token_assinado = claims
+    return claims['tid'], {
+        'user_id': claims['uid'],
+        'email': claims.get('email'),
+        'role': claims.get('role'),
+        'expires_at': datetime.fromtimestamp(claims['exp']).isoformat()
+    }
+
+
+def _validar_token_sessao(token):
+    """Validate an opaque session token against its tenant's sessions table."""
+    # Resolve the owning tenant through the global directory
+    entrada = resolver_sessao(token)
+    if not entrada:
+        return None, None
+
+    try:
+        utilizador = _validar_sessao_tenant(entrada['tenant_id'], token)
+    except Exception as e:
+        logger.debug("Error checking tenant %s: %s", entrada['tenant_id'], str(e))
+        utilizador = None
+    if not utilizador:
+        # Session row is gone (logout/reset in another worker)
+        invalidar_sessao(token)
+        return None, None
+    return entrada['tenant_id'], utilizador
 
 
 def requer_autenticacao(f):
@@ -51,29 +127,11 @@ def requer_autenticacao(f):
         if not token:
             return jsonify({'error': 'Token de autenticação necessário'}), 401
 
-        # Search for valid session in all tenants
-        dados = carregar_tenants()
-        tenant_encontrado = None
-        utilizador = None
-
-        for tenant in dados.get('tenants', []):
-            try:
-                bd = obter_bd(tenant['id'])
-                sessao = bd.execute('''
-                    SELECT s.*, u.id as user_id, u.email, u.role, u.first_name,
-                           u.last_name, u.two_factor_enabled, u.must_change_password
-                    FROM sessions s
-                    JOIN users u ON s.user_id = u.id
-                    WHERE s.token = ? AND s.expires_at > ? AND u.active = 1
-                ''', (token, datetime.now().isoformat())).fetchone()
-
-                if sessao:
-                    tenant_encontrado = tenant['id']
-                    utilizador = dict(sessao)
-                    break
-            except Exception as e:
-                logger.debug("Error checking tenant %s: %s", tenant['id'], str(e))
-                continue
+        # Signed tokens carry tenant, user and role; no database access
+        if is_signed_token(token):
+            tenant_encontrado, utilizador = _validar_token_assinado(token)
+        else:
+            tenant_encontrado, utilizador = _validar_token_sessao(token)
 
         if not tenant_encontrado or not utilizador:
             return jsonify({'error': 'Sessão inválida ou expirada'}), 401
@@ -166,53 +224,86 @@ def requer_permissao(modulo, acao='view'):
     return decorator
 
 
-def verificar_permissao(user_id, section, action='view'):
-    """Check if a user has permission for an action on a section.
+# =========================================================================
+# PERMISSION MATRIX
+# =========================================================================
 
-    Args:
-        user_id: User ID
-        section: Section/module name
-        action: Action type ('view', 'create', 'edit', 'delete')
+def _carregar_matriz(bd, user_id):
+    """Load the role and every permission row of a user in two queries.
 
     Returns:
-        bool: True if user has permission
+        dict: {'role': str or None,
+               'sections': {section: (view, create, edit, delete)},
+               'fields': {(section, field_name): (view, edit)}}
     """
-    bd = obter_bd()
+    user = bd.execute('SELECT role FROM users WHERE id = ?', (user_id,)).fetchone()
+    matriz = {'role': user['role'] if user else None, 'sections': {}, 'fields': {}}
+    if not user or user['role'] in ['admin', 'superadmin']:
+        return matriz
 
-    # Get user role first
-    user = bd.execute(
-        'SELECT role FROM users WHERE id = ?',
-        (user_id,)
-    ).fetchone()
+    for perm in bd.execute(_QUERY_PERMISSOES, (user_id,)).fetchall():
+        if perm['field_name'] is None:
+            matriz['sections'][perm['section']] = (
+                bool(perm['can_view']), bool(perm['can_create']),
+                bool(perm['can_edit']), bool(perm['can_delete'])
+            )
+        else:
+            matriz['fields'][(perm['section'], perm['field_name'])] = (
+                bool(perm['can_view']), bool(perm['can_edit'])
+            )
+    return matriz
+
+
+def obter_matriz_permissoes(user_id, tenant_id=None):
+    """Return the cached permission matrix of a user in a tenant."""
+    tenant_id = tenant_id or getattr(g, 'tenant_id', MASTER_TENANT_ID)
+    chave = (tenant_id, user_id)
+    matriz = _cache_permissoes.get(chave)
+    if matriz is None:
+        matriz = _carregar_matriz(obter_bd(tenant_id), user_id)
+        _cache_permissoes.set(chave, matriz)
+    return matriz
+
+
+def invalidar_permissoes(tenant_id, user_id=None):
+    """Drop cached permission matrices (one user, or a whole tenant)."""
+    if user_id is not None:
+        _cache_permissoes.delete((tenant_id, user_id))
+    else:
+        _cache_permissoes.delete_where(lambda chave, _: chave[0] == tenant_id)
 
-    if not user:
-        return False
 
-    # Admin and superadmin have all permissions
-    if user['role'] in ['admin', 'superadmin']:
+def _permissao_seccao(matriz, section, action):
+    if matriz['role'] is None:
+        return False
+    if matriz['role'] in ['admin', 'superadmin']:
         return True
+    perms = matriz['sections'].get(section)
+    return bool(perms and perms[_ACOES.get(action, 0)])
 
-    # Map action to column name
-    action_column_map = {
-        'view': 'can_view',
-        'create': 'can_create',
-        'edit': 'can_edit',
-        'delete': 'can_delete'
-    }
 
-    column = action_column_map.get(action, 'can_view')
+def _permissao_campo(matriz, section, field_name, action):
+    if matriz['role'] in ['admin', 'superadmin']:
+        return True
+    perms = matriz['fields'].get((section, field_name))
+    if perms is not None:
+        return perms[0] if action == 'view' else perms[1]
+    # Fallback to section-level permission
+    return _permissao_seccao(matriz, section, action)
 
-    # Check user permissions table
-    perm = bd.execute(f'''
-        SELECT {column} FROM user_permissions
-        WHERE user_id = ? AND section = ? AND field_name IS NULL
-    ''', (user_id, section)).fetchone()
 
-    if perm:
-        return bool(perm[0])
+def verificar_permissao(user_id, section, action='view'):
+    """Check if a user has permission for an action on a section.
+
+    Args:
+        user_id: User ID
+        section: Section/module name
+        action: Action type ('view', 'create', 'edit', 'delete')
 
-    # Default: no permission
-    return False
+    Returns:
+        bool: True if user has permission
+    """
+    return _permissao_seccao(obter_matriz_permissoes(user_id), section, action)
 
 
 def verificar_permissao_campo(user_id, section, field_name, action='view'):
@@ -227,34 +318,37 @@ def verificar_permissao_campo(user_id, section, field_name, action='view'):
     Returns:
         bool: True if user has permission
     """
-    bd = obter_bd()
-
-    # Get user role
-    user = bd.execute(
-        'SELECT role FROM users WHERE id = ?',
-        (user_id,)
-    ).fetchone()
+    return _permissao_campo(obter_matriz_permissoes(user_id), section, field_name, action)
 
-    if not user:
-        return False
 
-    # Admin and superadmin have all permissions
-    if user['role'] in ['admin', 'superadmin']:
-        return True
+def filtrar_campos_permitidos(user_id, section, dados, action='view'):
+    """Return the entries of a field dict the user may view/edit.
 
-    column = 'can_view' if action == 'view' else 'can_edit'
+    One matrix lookup covers every field, however many the record has.
+    """
+    return filtrar_campos_registos(user_id, section, [dados], action)[0]
 
-    # Check field-specific permission
-    perm = bd.execute(f'''
-        SELECT {column} FROM user_permissions
-        WHERE user_id = ? AND section = ? AND field_name = ?
-    ''', (user_id, section, field_name)).fetchone()
 
-    if perm:
-        return bool(perm[0])
+def filtrar_campos_registos(user_id, section, registos, action='view', manter=()):
+    """Apply filtrar_campos_permitidos to a list of records with one lookup.
 
-    # Fallback to section-level permission
-    return verificar_permissao(user_id, section, action)
+    Fields named in manter (e.g. record keys) are always kept.
+    """
+    matriz = obter_matriz_permissoes(user_id)
+    if matriz['role'] in ['admin', 'superadmin']:
+        return [dict(dados) for dados in registos]
+    decisoes = {}
+    resultado = []
+    for dados in registos:
+        visiveis = {}
+        for campo, valor in dados.items():
+            if campo not in decisoes:
+                decisoes[campo] = (campo in manter
+                                   or _permissao_campo(matriz, section, campo, action))
+            if decisoes[campo]:
+                visiveis[campo] = valor
+        resultado.append(visiveis)
+    return resultado
 
 
 def obter_permissoes_utilizador(user_id):
@@ -265,11 +359,7 @@ def obter_permissoes_utilizador(user_id):
     """
     bd = obter_bd()
 
-    permissions = bd.execute('''
-        SELECT section, field_name, can_view, can_create, can_edit, can_delete
-        FROM user_permissions
-        WHERE user_id = ?
-    ''', (user_id,)).fetchall()
+    permissions = bd.execute(_QUERY_PERMISSOES, (user_id,)).fetchall()
 
     result = {}
     for perm in permissions:
@@ -345,6 +435,7 @@ def definir_permissoes_utilizador(user_id, permissions_dict):
             ))
 
     bd.commit()
+    invalidar_permissoes(getattr(g, 'tenant_id', MASTER_TENANT_ID), user_id)
     logger.info("Permissions updated for user %s", user_id)
 
 
@@ -0,0 +1,70 @@
+"""
+SmartLamppost v5.0 - Hot Query Plans
+Registry of the queries on hot request paths and a checker that asks the
+database for their plans, so a missing or unusable index is caught by the
+test suite instead of in production.
+"""
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# name -> (query or builder, sample parameters). The module that runs a hot
+# query registers it with registar_consulta_critica, passing the constant or
+# builder its route uses, so the check always sees the query in production.
+CONSULTAS_CRITICAS = {}
+
+# SQLite: "SCAN <table>" without an index (FTS5 lookups show as "VIRTUAL
+# TABLE INDEX"); PostgreSQL: sequential scan
+_RE_SCAN_SQLITE = re.compile(r'^SCAN (?!.*\b(?:USING|VIRTUAL TABLE INDEX)\b)')
+_RE_SCAN_POSTGRES = re.compile(r'\bSeq Scan on (\w+)')
+
+
+def registar_consulta_critica(nome, query, parametros=()):
+    """Add a query to the set checked by verificar_planos.
+
+    Args:
+        nome: Name reported by the check
+        query: SQL text, or a builder query(bd) -> (sql, params) for queries
+            assembled per request or per backend
+        parametros: Sample parameters of a SQL text query
+    """
+    CONSULTAS_CRITICAS[nome] = (query, tuple(parametros))
+
+
+def obter_plano(bd, query, parametros=()):
+    """Return the plan lines of a query (SQLite or PostgreSQL)."""
+    if getattr(bd, 'is_postgres', False):
+        # Small test tables always favour a seq scan; disable it so only
+        # queries with no usable index still show one.
+        bd.execute('SET LOCAL enable_seqscan = off')
+        rows = bd.execute('EXPLAIN ' + query, parametros).fetchall()
+        plano = [list(dict(r).values())[0] if isinstance(r, dict) else r[0] for r in rows]
+        bd.rollback()
+        return plano
+    rows = bd.execute('EXPLAIN QUERY PLAN ' + query, parametros).fetchall()
+    return [row['detail'] for row in rows]
+
+
+def verificar_planos(bd, consultas=None):
+    """Find registered hot queries that fall back to a full table scan.
+
+    Args:
+        bd: Tenant database connection
+        consultas: dict like CONSULTAS_CRITICAS (default: the registry)
+
+    Returns:
+        list of dicts {'query': name, 'plan': [...]} for each offender
+    """
+    regex = _RE_SCAN_POSTGRES if getattr(bd, 'is_postgres', False) else _RE_SCAN_SQLITE
+    problemas = []
+    for nome, (query, parametros) in (consultas or CONSULTAS_CRITICAS).items():
+        if callable(query):
+            query, parametros = query(bd)
+        plano = obter_plano(bd, query, parametros)
+        if any(regex.search(linha.strip()) for linha in plano):
+            logger.warning("Hot query %s does a full scan: %s", nome, plano)
+            problemas.append({'query': nome, 'plan': plano})
+    return problemas
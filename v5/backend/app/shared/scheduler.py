@@ -1,6 +1,7 @@
 """
 SmartLamppost v5.0 - Scheduled Tasks Service
-Handles automatic backups, maintenance alerts, and daily reports.
+Handles automatic backups, maintenance alerts, daily reports and the purge
+of expired authentication rows.
 """
 
 import os
@@ -12,7 +13,12 @@ from datetime import datetime, timedelta
 from typing import Optional
 
 from .config import Config
-from .database import obter_bd_para_tenant, obter_lista_tenants, extrair_valor
+from .asset_data import CONTADOR_ALTERACOES_PURGADAS
+from .jobs import marcar_tarefas_interrompidas
+from .database import (
+    obter_bd_para_tenant, bd_tarefa_tenant, bd_tarefa_diretorio, obter_lista_tenants,
+    extrair_valor, consolidar_wal
+)
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +34,7 @@ def verificar_alertas_manutencao(tenant_id: str):
     """
     from .email_service import enviar_alerta_manutencao
 
+    bd = None
     try:
         bd = obter_bd_para_tenant(tenant_id)
         if not bd:
@@ -53,12 +60,10 @@ def verificar_alertas_manutencao(tenant_id: str):
 
         # Check next_inspection_date
         ativos_inspecao = bd.execute('''
-            SELECT a.serial_number, ad_loc.field_value as localizacao, ad_insp.field_value as data_inspecao
-            FROM assets a
-            LEFT JOIN asset_data ad_loc ON a.id = ad_loc.asset_id AND ad_loc.field_name = 'installation_location'
-            LEFT JOIN asset_data ad_insp ON a.id = ad_insp.asset_id AND ad_insp.field_name = 'next_inspection_date'
-            WHERE ad_insp.field_value IS NOT NULL
-              AND DATE(ad_insp.field_value) BETWEEN ? AND ?
+            SELECT serial_number, installation_location as localizacao,
+                   CAST(next_inspection_date AS TEXT) as data_inspecao
+            FROM assets_flat
+            WHERE next_inspection_date BETWEEN ? AND ?
         ''', (hoje.isoformat(), limite.isoformat())).fetchall()
 
         for ativo in ativos_inspecao:
@@ -73,12 +78,10 @@ def verificar_alertas_manutencao(tenant_id: str):
 
         # Check next_maintenance_date
         ativos_manutencao = bd.execute('''
-            SELECT a.serial_number, ad_loc.field_value as localizacao, ad_maint.field_value as data_manutencao
-            FROM assets a
-            LEFT JOIN asset_data ad_loc ON a.id = ad_loc.asset_id AND ad_loc.field_name = 'installation_location'
-            LEFT JOIN asset_data ad_maint ON a.id = ad_maint.asset_id AND ad_maint.field_name = 'next_maintenance_date'
-            WHERE ad_maint.field_value IS NOT NULL
-              AND DATE(ad_maint.field_value) BETWEEN ? AND ?
+            SELECT serial_number, installation_location as localizacao,
+                   CAST(next_maintenance_date AS TEXT) as data_manutencao
+            FROM assets_flat
+            WHERE next_maintenance_date BETWEEN ? AND ?
         ''', (hoje.isoformat(), limite.isoformat())).fetchall()
 
         for ativo in ativos_manutencao:
@@ -96,10 +99,9 @@ def verificar_alertas_manutencao(tenant_id: str):
         ativos_garantia = bd.execute('''
             SELECT a.serial_number, ad_loc.field_value as localizacao, ad_war.field_value as data_garantia
             FROM assets a
+            JOIN asset_data ad_war ON a.id = ad_war.asset_id AND ad_war.field_name = 'warranty_end_date'
             LEFT JOIN asset_data ad_loc ON a.id = ad_loc.asset_id AND ad_loc.field_name = 'installation_location'
-            LEFT JOIN asset_data ad_war ON a.id = ad_war.asset_id AND ad_war.field_name = 'warranty_end_date'
-            WHERE ad_war.field_value IS NOT NULL
-              AND DATE(ad_war.field_value) BETWEEN ? AND ?
+            WHERE ad_war.value_date BETWEEN ? AND ?
         ''', (hoje.isoformat(), limite_garantia.isoformat())).fetchall()
 
         for ativo in ativos_garantia:
@@ -116,6 +118,9 @@ def verificar_alertas_manutencao(tenant_id: str):
 
     except Exception as e:
         logger.error("[SCHEDULER] Error checking alerts for tenant %s: %s", tenant_id, e)
+    finally:
+        if bd:
+            bd.close()
 
 
 def executar_backup_automatico(tenant_id: str):
@@ -144,6 +149,7 @@ def executar_backup_automatico(tenant_id: str):
             logger.warning("[BACKUP] No database found for tenant %s", tenant_id)
             return
 
+        consolidar_wal(db_path)
         with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # Add database
             zipf.write(db_path, 'database.db')
@@ -179,6 +185,7 @@ def enviar_relatorio_diario_tenant(tenant_id: str):
     """
     from .email_service import enviar_relatorio_diario
 
+    bd = None
     try:
         bd = obter_bd_para_tenant(tenant_id)
         if not bd:
@@ -217,8 +224,8 @@ def enviar_relatorio_diario_tenant(tenant_id: str):
         manut_proxima = extrair_valor(bd.execute('''
             SELECT COUNT(*) as cnt FROM asset_data
             WHERE field_name IN ('next_maintenance_date', 'next_inspection_date')
-              AND DATE(field_value) BETWEEN DATE('now') AND ?
-        ''', (limite,)).fetchone(), 0) or 0
+              AND value_date BETWEEN ? AND ?
+        ''', (hoje, limite)).fetchone(), 0) or 0
         stats['maintenance_due'] = manut_proxima
 
         # Get pending alerts
@@ -228,7 +235,7 @@ def enviar_relatorio_diario_tenant(tenant_id: str):
             FROM assets a
             JOIN asset_data ad ON a.id = ad.asset_id
             WHERE ad.field_name IN ('next_maintenance_date', 'next_inspection_date')
-              AND DATE(ad.field_value) <= ?
+              AND ad.value_date <= ?
         ''', (limite,)).fetchall()
 
         for al in ativos_alertas[:10]:
@@ -251,6 +258,9 @@ def enviar_relatorio_diario_tenant(tenant_id: str):
 
     except Exception as e:
         logger.error("[SCHEDULER] Error sending daily report for tenant %s: %s", tenant_id, e)
+    finally:
+        if bd:
+            bd.close()
 
 
 def executar_tarefas_diarias():
@@ -287,6 +297,152 @@ def executar_backup_semanal():
     executar_tarefas_diarias()
 
 
+# =========================================================================
+# EXPIRED ROW PURGE
+# =========================================================================
+
+# Rows deleted per statement/commit, so a large backlog never holds a long
+# write lock on a tenant database
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '5000'))
+
+# Tenant tables whose rows are dead once expires_at has passed
+_TABELAS_EXPIRAVEIS = ('sessions', 'two_factor_codes', 'password_reset_tokens')
+
+# Days a deleted asset stays in asset_changes for delta sync clients
+ASSET_CHANGES_RETENTION_DAYS = int(os.environ.get('ASSET_CHANGES_RETENTION_DAYS', '90'))
+
+# Days a finished background job stays readable through the status endpoint
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+
+
+def _apagar_em_lotes(bd, tabela, chave, condicao, params, lote):
+    """Delete the rows matching condicao in batches of lote, committing each one."""
+    total = 0
+    while True:
+        cursor = bd.execute(f'''
+            DELETE FROM {tabela} WHERE {chave} IN (
+                SELECT {chave} FROM {tabela} WHERE {condicao} LIMIT ?
+            )
+        ''', params + (lote,))
+        bd.commit()
+        apagadas = cursor.rowcount or 0
+        total += apagadas
+        if apagadas < lote:
+            return total
+
+
+def _atualizar_estatisticas(bd, tabelas):
+    """Refresh planner statistics after a purge."""
+    if hasattr(bd, 'is_postgres') and bd.is_postgres:
+        for tabela in tabelas:
+            bd.execute(f'ANALYZE {tabela}')
+    else:
+        bd.execute('PRAGMA optimize')
+    bd.commit()
+
+
+def _purgar_eliminacoes_antigas(bd, lote):
+    """Delete asset_changes deletion records older than the retention window.
+
+    The highest purged sequence is recorded first, so delta sync can tell a
+    client whose token predates it to start over.
+    """
+    limite = (datetime.now() - timedelta(days=ASSET_CHANGES_RETENTION_DAYS)).isoformat()
+    horizonte = extrair_valor(bd.execute(
+        'SELECT MAX(change_seq) FROM asset_changes WHERE deleted = 1 AND changed_at < ?', (limite,)
+    ).fetchone(), 0)
+    if not horizonte:
+        return 0
+    bd.execute('''
+        INSERT INTO sequence_counters (counter_type, current_value, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (counter_type) DO UPDATE SET
+            current_value = excluded.current_value, updated_at = excluded.updated_at
+    ''', (CONTADOR_ALTERACOES_PURGADAS, horizonte, datetime.now().isoformat()))
+    bd.commit()
+    return _apagar_em_lotes(bd, 'asset_changes', 'asset_id', 'deleted = 1 AND change_seq <= ?',
+                            (horizonte,), lote)
+
+
+def purgar_registos_expirados(tenant_id: str, lote: int = None):
+    """
+    Delete expired sessions, 2FA codes and password reset tokens of a tenant,
+    asset deletion records past ASSET_CHANGES_RETENTION_DAYS and background
+    jobs finished more than JOB_RETENTION_DAYS ago. Jobs left queued/running
+    by a worker that exited are closed first, so they age out the same way.
+
+    Returns:
+        dict: {table: rows deleted}
+    """
+    agora = datetime.now().isoformat()
+    lote = lote or PURGE_BATCH_SIZE
+    with bd_tarefa_tenant(tenant_id) as bd:
+        if not bd:
+            return {}
+        apagadas = {
+            tabela: _apagar_em_lotes(bd, tabela, 'id', 'expires_at < ?', (agora,), lote)
+            for tabela in _TABELAS_EXPIRAVEIS
+        }
+        apagadas['asset_changes'] = _purgar_eliminacoes_antigas(bd, lote)
+        marcar_tarefas_interrompidas(bd)
+        limite_tarefas = (datetime.now() - timedelta(days=JOB_RETENTION_DAYS)).isoformat()
+        apagadas['background_jobs'] = _apagar_em_lotes(bd, 'background_jobs', 'id', 'finished_at < ?',
+                                                       (limite_tarefas,), lote)
+        _atualizar_estatisticas(bd, list(apagadas))
+        return apagadas
+
+
+def purgar_diretorio_expirado(lote: int = None):
+    """
+    Delete expired session tokens and token revocations from the global directory.
+
+    Returns:
+        dict: {table: rows deleted}
+    """
+    lote = lote or PURGE_BATCH_SIZE
+    with bd_tarefa_diretorio() as bd:
+        apagadas = {
+            'session_directory': _apagar_em_lotes(
+                bd, 'session_directory', 'token', 'expires_at < ?',
+                (datetime.now().isoformat(),), lote),
+            'token_revocations': _apagar_em_lotes(
+                bd, 'token_revocations', 'revocation_key', 'expires_at < ?',
+                (int(time.time()),), lote),
+        }
+        _atualizar_estatisticas(bd, list(apagadas))
+        return apagadas
+
+
+def executar_limpeza_expirados():
+    """
+    Purge expired auth rows from every tenant and the directory.
+
+    Returns:
+        dict: {'tenants': {tenant_id: {table: rows}}, 'directory': {...}, 'total': rows}
+    """
+    logger.info("[SCHEDULER] Starting expired rows purge...")
+    relatorio = {'tenants': {}, 'directory': {}, 'total': 0}
+
+    for tenant_id in obter_lista_tenants():
+        try:
+            relatorio['tenants'][tenant_id] = purgar_registos_expirados(tenant_id)
+        except Exception as e:
+            logger.error("[SCHEDULER] Error purging tenant %s: %s", tenant_id, e)
+
+    try:
+        relatorio['directory'] = purgar_diretorio_expirado()
+    except Exception as e:
+        logger.error("[SCHEDULER] Error purging directory: %s", e)
+
+    relatorio['total'] = (
+        sum(sum(t.values()) for t in relatorio['tenants'].values())
+        + sum(relatorio['directory'].values())
+    )
+    logger.info("[SCHEDULER] Purged %d expired rows (%d tenants)",
+                relatorio['total'], len(relatorio['tenants']))
+    return relatorio
+
+
 def _run_scheduler():
     """Background thread that runs the scheduler."""
     global _scheduler_running
@@ -299,7 +455,8 @@ def _run_scheduler():
 def iniciar_scheduler(
     hora_diaria: str = "06:00",
     dia_semanal: str = "sunday",
-    hora_semanal: str = "02:00"
+    hora_semanal: str = "02:00",
+    hora_limpeza: str = "03:00"
 ):
     """
     Start the background scheduler.
@@ -308,6 +465,7 @@ def iniciar_scheduler(
         hora_diaria: Time for daily tasks (HH:MM)
         dia_semanal: Day for weekly backup (monday, tuesday, etc.)
         hora_semanal: Time for weekly backup (HH:MM)
+        hora_limpeza: Time for the daily purge of expired rows (HH:MM)
     """
     global _scheduler_thread, _scheduler_running
 
@@ -321,13 +479,16 @@ def iniciar_scheduler(
     # Schedule weekly backup
     getattr(schedule.every(), dia_semanal).at(hora_semanal).do(executar_backup_semanal)
 
+    # Schedule purge of expired sessions/codes/tokens
+    schedule.every().day.at(hora_limpeza).do(executar_limpeza_expirados)
+
     # Start background thread
     _scheduler_running = True
     _scheduler_thread = threading.Thread(target=_run_scheduler, daemon=True)
     _scheduler_thread.start()
 
-    logger.info("[SCHEDULER] Started - Daily at %s, Weekly on %s at %s",
-                hora_diaria, dia_semanal, hora_semanal)
+    logger.info("[SCHEDULER] Started - Daily at %s, Weekly on %s at %s, Purge at %s",
+                hora_diaria, dia_semanal, hora_semanal, hora_limpeza)
 
 
 def parar_scheduler():
@@ -0,0 +1,156 @@
+"""
+SmartLamppost v5.0 - Asset Search Index
+Substring search over the identifying fields of an asset (serial, RFID tag,
+product reference, street address, municipality).
+
+The index is built on top of the assets_flat projection, so every write
+path that keeps assets_flat current also keeps the index current:
+
+- SQLite: an FTS5 table with the trigram tokenizer, external content on
+  assets_flat and kept in sync by triggers.
+- PostgreSQL: pg_trgm GIN indexes on the assets_flat columns, used by ILIKE.
+
+Trigrams need at least three characters; shorter terms fall back to a
+plain LIKE over assets_flat.
+"""
+
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# assets_flat columns covered by the index
+COLUNAS_PESQUISA = ('serial_number', 'rfid_tag', 'product_reference', 'street_address', 'municipality')
+
+# Shortest term the trigram index can answer
+PESQUISA_MIN_CARACTERES = 3
+
+_LISTA_COLUNAS = ', '.join(COLUNAS_PESQUISA)
+
+
+def _is_postgres(bd):
+    return getattr(bd, 'is_postgres', False)
+
+
+# =========================================================================
+# INDEX MAINTENANCE
+# =========================================================================
+
+def _criar_indice_sqlite(bd):
+    novos = ', '.join(f'new.{c}' for c in COLUNAS_PESQUISA)
+    antigos = ', '.join(f'old.{c}' for c in COLUNAS_PESQUISA)
+    bd.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS assets_search USING fts5(
+            {_LISTA_COLUNAS},
+            content='assets_flat', content_rowid='asset_id', tokenize='trigram'
+        )
+    ''')
+    bd.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS assets_search_ai AFTER INSERT ON assets_flat BEGIN
+            INSERT INTO assets_search(rowid, {_LISTA_COLUNAS}) VALUES (new.asset_id, {novos});
+        END
+    ''')
+    bd.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS assets_search_ad AFTER DELETE ON assets_flat BEGIN
+            INSERT INTO assets_search(assets_search, rowid, {_LISTA_COLUNAS})
+            VALUES ('delete', old.asset_id, {antigos});
+        END
+    ''')
+    bd.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS assets_search_au AFTER UPDATE ON assets_flat BEGIN
+            INSERT INTO assets_search(assets_search, rowid, {_LISTA_COLUNAS})
+            VALUES ('delete', old.asset_id, {antigos});
+            INSERT INTO assets_search(rowid, {_LISTA_COLUNAS}) VALUES (new.asset_id, {novos});
+        END
+    ''')
+    bd.execute("INSERT INTO assets_search(assets_search) VALUES ('rebuild')")
+
+
+def _criar_indice_postgres(bd):
+    try:
+        # Installed once per database, in public so every tenant schema sees it
+        bd.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public')
+        bd.commit()
+    except Exception as e:
+        bd.rollback()
+        logger.warning("pg_trgm unavailable, asset search will not be indexed: %s", e)
+        return
+    for coluna in COLUNAS_PESQUISA:
+        bd.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_assets_flat_{coluna}_trgm
+            ON assets_flat USING gin ({coluna} public.gin_trgm_ops)
+        ''')
+
+
+def criar_indice_pesquisa(bd):
+    """Create the search index of a tenant and fill it from assets_flat (no commit)."""
+    if _is_postgres(bd):
+        _criar_indice_postgres(bd)
+    else:
+        try:
+            _criar_indice_sqlite(bd)
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5/trigram (< 3.34): search falls back to LIKE
+            logger.warning("FTS5 trigram unavailable, asset search will not be indexed: %s", e)
+
+
+def reconstruir_indice_pesquisa(bd):
+    """Rebuild the search index of a tenant from assets_flat and commit.
+
+    Returns:
+        int: Number of assets indexed
+    """
+    if _is_postgres(bd):
+        bd.execute('REINDEX TABLE assets_flat')
+    elif _tem_indice_sqlite(bd):
+        bd.execute("INSERT INTO assets_search(assets_search) VALUES ('rebuild')")
+    else:
+        criar_indice_pesquisa(bd)
+    bd.commit()
+    row = bd.execute('SELECT COUNT(*) as cnt FROM assets_flat').fetchone()
+    return row[0] if not isinstance(row, dict) else row['cnt']
+
+
+def _tem_indice_sqlite(bd):
+    return bd.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'assets_search'"
+    ).fetchone() is not None
+
+
+# =========================================================================
+# QUERIES
+# =========================================================================
+
+def _escapar_like(termo):
+    return termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def filtro_pesquisa(bd, termo, coluna_id='a.id'):
+    """Return a WHERE fragment restricting coluna_id to assets matching termo.
+
+    Args:
+        bd: Tenant database connection
+        termo: Search text (substring, case-insensitive)
+        coluna_id: Qualified assets.id column of the outer query
+
+    Returns:
+        tuple: (sql fragment, params)
+    """
+    termo = termo.strip()
+    if _is_postgres(bd):
+        # pg_trgm answers ILIKE '%term%' from the GIN indexes
+        condicao = ' OR '.join(f"{c} ILIKE ? ESCAPE '\\'" for c in COLUNAS_PESQUISA)
+        padrao = f'%{_escapar_like(termo)}%'
+        return (f'{coluna_id} IN (SELECT asset_id FROM assets_flat WHERE {condicao})',
+                [padrao] * len(COLUNAS_PESQUISA))
+
+    if len(termo) >= PESQUISA_MIN_CARACTERES and _tem_indice_sqlite(bd):
+        # Quoted FTS5 phrase: with the trigram tokenizer, a substring match
+        frase = '"' + termo.replace('"', '""') + '"'
+        return (f'{coluna_id} IN (SELECT rowid FROM assets_search WHERE assets_search MATCH ?)',
+                [frase])
+
+    condicao = ' OR '.join(f"{c} LIKE ? ESCAPE '\\'" for c in COLUNAS_PESQUISA)
+    padrao = f'%{_escapar_like(termo)}%'
+    return (f'{coluna_id} IN (SELECT asset_id FROM assets_flat WHERE {condicao})',
+            [padrao] * len(COLUNAS_PESQUISA))
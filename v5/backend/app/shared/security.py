@@ -4,6 +4,11 @@ Password hashing, token generation, and path validation.
 """
 
 import os
+import hmac
+import json
+import time
+import base64
+import hashlib
 import secrets
 import logging
 
@@ -14,6 +19,10 @@ logger = logging.getLogger(__name__)
 # Valid actions for permission checks (whitelist to prevent SQL injection)
 VALID_PERMISSION_ACTIONS = frozenset({'view', 'create', 'edit', 'delete'})
 
+# Signed tokens look like "st1.<payload>.<signature>"; opaque session
+# tokens from generate_token() never contain a dot.
+SIGNED_TOKEN_PREFIX = 'st1'
+
 
 def hash_password(password):
     """Generate a secure password hash using werkzeug (pbkdf2:sha256 with salt)."""
@@ -25,8 +34,6 @@ def verify_password(password, password_hash):
 
     Supports both new werkzeug hashes and legacy SHA-256 hashes for migration.
     """
-    import hashlib
-
     # Try werkzeug format first
     if password_hash.startswith('pbkdf2:') or password_hash.startswith('scrypt:'):
         return check_password_hash(password_hash, password)
@@ -45,6 +52,57 @@ def generate_token():
     return secrets.token_urlsafe(32)
 
 
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(message, secret):
+    return _b64encode(hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest())
+
+
+def is_signed_token(token):
+    """Tell signed tokens apart from opaque session tokens."""
+    return token.startswith(SIGNED_TOKEN_PREFIX + '.')
+
+
+def generate_signed_token(claims, secret):
+    """Generate an HMAC-SHA256 signed token carrying claims (a JSON-able dict).
+
+    claims should include 'exp' (epoch seconds); verify_signed_token
+    rejects the token after that.
+    """
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    mensagem = f'{SIGNED_TOKEN_PREFIX}.{payload}'
+    return f'{mensagem}.{_sign(mensagem, secret)}'
+
+
+def verify_signed_token(token, secret):
+    """Verify a signed token without any storage lookup.
+
+    Returns the claims dict, or None if the token is malformed, forged or
+    expired.
+    """
+    try:
+        prefixo, payload, assinatura = token.split('.')
+    except ValueError:
+        return None
+    if prefixo != SIGNED_TOKEN_PREFIX:
+        return None
+    if not hmac.compare_digest(assinatura, _sign(f'{prefixo}.{payload}', secret)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get('exp', 0) <= time.time():
+        return None
+    return claims
+
+
 def validate_safe_path(file_path, allowed_directory):
     """Validate that a file path is within an allowed directory.
 
@@ -0,0 +1,107 @@
+"""
+SmartLamppost v5.0 - Sequence Allocator
+Hands out serial numbers (assets, intervention codes) from the
+sequence_counters table.
+
+A block of numbers is reserved with a single upsert on the counter row.
+The upsert takes the write lock (SQLite) or the row lock (PostgreSQL), so
+concurrent creators queue on the counter and never see the same value; the
+lock is held until the caller commits, which keeps the counter and the
+rows created from it in one transaction.
+
+Serials written by imports are not taken from the counter and may land
+inside a reserved block. Those are found with IN queries over the block
+and skipped (a string range would miss them once the counter outgrows the
+zero padding, e.g. SLP9999 < SLP10000 is false).
+"""
+
+import logging
+from datetime import datetime
+
+from .database import obter_config
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the extra blocks reserved to step over imported serials
+MAX_TENTATIVAS_COLISAO = 1000
+
+# Serials per IN (...) collision probe
+COLISAO_CHUNK_SIZE = 500
+
+
+def formatar_numero(prefixo, valor, digitos):
+    """Return the serial for a counter value, e.g. SLP000000042."""
+    return f"{prefixo}{str(valor).zfill(digitos)}"
+
+
+def reservar_bloco(bd, tipo_contador, quantidade=1):
+    """Advance a counter by quantidade and return the first reserved value.
+
+    The reservation is part of the caller's transaction: it becomes
+    permanent on commit and is released by a rollback.
+
+    Returns:
+        int: First value of the block [first, first + quantidade - 1]
+    """
+    bd.execute('''
+        INSERT INTO sequence_counters (counter_type, current_value, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (counter_type) DO UPDATE SET
+            current_value = COALESCE(sequence_counters.current_value, 0) + excluded.current_value,
+            updated_at = excluded.updated_at
+    ''', (tipo_contador, quantidade, datetime.now().isoformat()))
+    row = bd.execute(
+        'SELECT current_value FROM sequence_counters WHERE counter_type = ?',
+        (tipo_contador,)
+    ).fetchone()
+    return row['current_value'] - quantidade + 1
+
+
+def reservar_numeros(bd, tipo_contador, prefixo, digitos, quantidade=1, tabela=None, coluna=None):
+    """Reserve quantidade formatted numbers from a counter.
+
+    Args:
+        bd: Tenant database connection (the caller commits)
+        tipo_contador: sequence_counters.counter_type
+        prefixo: Text before the number
+        digitos: Zero-padded width of the number
+        quantidade: How many numbers to reserve
+        tabela, coluna: Where numbers already in use live (e.g. assets,
+            serial_number); numbers found there are skipped
+
+    Returns:
+        list of str, in increasing order
+    """
+    numeros = []
+    em_falta = quantidade
+    for _ in range(MAX_TENTATIVAS_COLISAO):
+        primeiro = reservar_bloco(bd, tipo_contador, em_falta)
+        bloco = [formatar_numero(prefixo, v, digitos) for v in range(primeiro, primeiro + em_falta)]
+
+        if tabela:
+            ocupados = set()
+            for inicio in range(0, len(bloco), COLISAO_CHUNK_SIZE):
+                parte = bloco[inicio:inicio + COLISAO_CHUNK_SIZE]
+                ocupados.update(row[coluna] for row in bd.execute(
+                    f"SELECT {coluna} FROM {tabela} WHERE {coluna} IN ({', '.join('?' * len(parte))})",
+                    parte
+                ).fetchall())
+            bloco = [n for n in bloco if n not in ocupados]
+
+        numeros.extend(bloco)
+        em_falta = quantidade - len(numeros)
+        if not em_falta:
+            return numeros
+        logger.info("Counter %s: skipped %d numbers already in %s", tipo_contador, em_falta, tabela)
+
+    raise RuntimeError(f'Nao foi possivel reservar {quantidade} numeros do contador {tipo_contador}')
+
+
+def reservar_series_ativos(bd, quantidade=1):
+    """Reserve quantidade asset serial numbers, skipping ones already in use (no commit)."""
+    return reservar_numeros(
+        bd, 'assets',
+        obter_config('prefix_assets', 'SLP'),
+        int(obter_config('prefix_assets_digits', '9')),
+        quantidade, tabela='assets', coluna='serial_number'
+    )
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+SmartLamppost v5.0 - Database Maintenance Script
+Offline maintenance tasks run against every tenant (or selected ones).
+
+Usage:
+    python scripts/maintenance.py migrate [--tenant ID ...] [--workers N]
+    python scripts/maintenance.py rebuild-flat [--tenant ID ...]
+    python scripts/maintenance.py rebuild-values [--tenant ID ...]
+    python scripts/maintenance.py rebuild-search [--tenant ID ...]
+    python scripts/maintenance.py prune [--tenant ID ...]
+"""
+
+import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _tenants_alvo(tenants):
+    """Return the requested tenant ids, or every tenant."""
+    from app.shared.database import obter_lista_tenants
+    return tenants or obter_lista_tenants()
+
+
+def _executar_por_tenant(tenants, tarefa, descricao):
+    """Run tarefa(bd) on each tenant database and print its result."""
+    from app.shared.database import obter_bd_para_tenant
+
+    errors = 0
+    for tenant_id in _tenants_alvo(tenants):
+        bd = obter_bd_para_tenant(tenant_id)
+        if bd is None:
+            print(f"[{tenant_id}] database not found")
+            errors += 1
+            continue
+        try:
+            total = tarefa(bd)
+            print(f"[{tenant_id}] {descricao}: {total}")
+        except Exception as e:
+            print(f"[{tenant_id}] error: {e}")
+            errors += 1
+        finally:
+            bd.close()
+    return errors
+
+
+def migrate(tenants=None, workers=None):
+    """Apply pending schema migrations to the shared databases and tenants."""
+    from flask import current_app
+    from app.shared.migrations import (
+        migrar_bases_partilhadas, migrar_todos_tenants, MIGRACAO_WORKERS
+    )
+
+    migrar_bases_partilhadas()
+    resultados = migrar_todos_tenants(current_app._get_current_object(), tenants,
+                                      workers or MIGRACAO_WORKERS)
+    errors = 0
+    for tenant_id, resultado in sorted(resultados.items()):
+        if isinstance(resultado, Exception):
+            print(f"[{tenant_id}] error: {resultado}")
+            errors += 1
+        elif resultado[0] == resultado[1]:
+            print(f"[{tenant_id}] up to date (v{resultado[1]})")
+        else:
+            print(f"[{tenant_id}] migrated v{resultado[0]} -> v{resultado[1]}")
+    return errors
+
+
+def rebuild_flat(tenants=None):
+    """Rebuild the assets_flat projection of each tenant."""
+    from app.shared.asset_data import reconstruir_assets_flat
+    return _executar_por_tenant(tenants, reconstruir_assets_flat, 'assets_flat rebuilt, assets')
+
+
+def rebuild_values(tenants=None):
+    """Recompute the typed value_num/value_date columns of asset_data."""
+    from app.shared.asset_data import reconstruir_valores_tipados
+    return _executar_por_tenant(tenants, reconstruir_valores_tipados, 'typed values rebuilt, rows')
+
+
+def rebuild_search(tenants=None):
+    """Rebuild the asset search index of each tenant from assets_flat."""
+    from app.shared.search import reconstruir_indice_pesquisa
+    return _executar_por_tenant(tenants, reconstruir_indice_pesquisa, 'search index rebuilt, assets')
+
+
+def prune(tenants=None):
+    """Delete expired sessions, 2FA codes and reset tokens (and directory rows)."""
+    from app.shared.scheduler import purgar_registos_expirados, purgar_diretorio_expirado
+
+    errors = 0
+    for tenant_id in _tenants_alvo(tenants):
+        try:
+            print(f"[{tenant_id}] purged: {purgar_registos_expirados(tenant_id)}")
+        except Exception as e:
+            print(f"[{tenant_id}] error: {e}")
+            errors += 1
+    if not tenants:
+        print(f"[directory] purged: {purgar_diretorio_expirado()}")
+    return errors
+
+
+COMMANDS = {
+    'migrate': migrate,
+    'rebuild-flat': rebuild_flat,
+    'rebuild-values': rebuild_values,
+    'rebuild-search': rebuild_search,
+    'prune': prune,
+}
+
+
+def main():
+    """Main entry point for command line usage."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SmartLamppost database maintenance')
+    parser.add_argument('command', choices=sorted(COMMANDS), help='Task to run')
+    parser.add_argument('--tenant', action='append', default=[],
+                        help='Tenant id (repeatable, default: all tenants)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Tenants migrated in parallel (migrate only)')
+
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.shared.config import Config
+
+    class MaintenanceConfig(Config):
+        # Migrations run explicitly below, not as a side effect of startup
+        SCHEMA_AUTO_MIGRATE = False
+
+    app = create_app(MaintenanceConfig)
+
+    with app.app_context():
+        if args.command == 'migrate':
+            errors = migrate(args.tenant, args.workers)
+        else:
+            errors = COMMANDS[args.command](args.tenant)
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
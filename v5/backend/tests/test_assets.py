@@ -35,6 +35,55 @@ class TestAssetsList:
         response = client.get('/api/assets?search=test', headers=superadmin_headers)
         assert response.status_code == 200
 
+    def test_list_assets_with_cursor(self, client, superadmin_headers, sample_asset_data):
+        """Test keyset pagination visits every asset once, newest first."""
+        for i in range(3):
+            client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': f'CURSOR-{i}'},
+                        headers=superadmin_headers)
+        total = client.get('/api/assets?per_page=1', headers=superadmin_headers).get_json()['pagination']['total']
+
+        vistos = []
+        cursor = ''
+        while cursor is not None:
+            response = client.get(f'/api/assets?per_page=2&after={cursor}', headers=superadmin_headers)
+            assert response.status_code == 200
+            data = response.get_json()
+            vistos.extend(a['id'] for a in data['data'])
+            cursor = data['pagination']['next_cursor']
+
+        assert len(vistos) == len(set(vistos)) == total
+
+    def test_cursor_reaches_undated_assets(self, app, client, superadmin_headers, sample_asset_data):
+        """Test assets without a created_at are paged after the dated ones."""
+        from app.shared.database import obter_bd
+        client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'CURSOR-DATED'},
+                    headers=superadmin_headers)
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            sem_data = [bd.execute('INSERT INTO assets (serial_number, created_at) VALUES (?, NULL)',
+                                   (f'UNDATED-{i}',)).lastrowid for i in range(3)]
+            bd.commit()
+        try:
+            total = client.get('/api/assets?per_page=1', headers=superadmin_headers).get_json()['pagination']['total']
+            vistos = []
+            cursor = ''
+            while cursor is not None:
+                data = client.get(f'/api/assets?per_page=2&after={cursor}', headers=superadmin_headers).get_json()
+                vistos.extend(a['id'] for a in data['data'])
+                cursor = data['pagination']['next_cursor']
+            assert len(vistos) == len(set(vistos)) == total
+            assert vistos[-3:] == sorted(sem_data, reverse=True)
+        finally:
+            with app.app_context():
+                bd = obter_bd('smartlamppost')
+                bd.execute("DELETE FROM assets WHERE serial_number LIKE 'UNDATED-%'")
+                bd.commit()
+
+    def test_list_assets_invalid_cursor(self, client, superadmin_headers):
+        """Test a malformed cursor is rejected."""
+        response = client.get('/api/assets?after=not-a-cursor', headers=superadmin_headers)
+        assert response.status_code == 400
+
 
 class TestAssetsCreate:
     """Tests for POST /api/assets endpoint."""
@@ -108,6 +157,44 @@ class TestAssetsRead:
         response = client.get('/api/assets/TEST-001')
         assert response.status_code == 401
 
+    def test_denied_field_is_hidden(self, app, client, superadmin_headers, user_headers,
+                                    sample_asset_data):
+        """Test a field the user may not view is left out of every asset response."""
+        from flask import g
+        from app.shared.database import obter_bd
+        from app.shared.permissions import definir_permissoes_utilizador
+
+        serial = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'PERM-HIDE'},
+                             headers=superadmin_headers).get_json()['serial_number']
+        with app.test_request_context():
+            g.tenant_id = 'smartlamppost'
+            user_id = obter_bd().execute(
+                "SELECT id FROM users WHERE email = 'user@test.com'").fetchone()['id']
+            definir_permissoes_utilizador(user_id, {
+                'assets': {'access': True, 'actions': ['view'],
+                           'fields': {'gps_latitude': {'view': False}}}
+            })
+        try:
+            asset = client.get(f'/api/assets/{serial}', headers=user_headers).get_json()
+            assert asset['serial_number'] == serial and asset['rfid_tag'] == 'PERM-HIDE'
+            assert 'gps_latitude' not in asset
+
+            respostas = [
+                client.get('/api/assets?per_page=100', headers=user_headers).get_json()['data'],
+                client.get('/api/assets?after=', headers=user_headers).get_json()['data'],
+                client.get('/api/assets/search?q=PERM-HIDE', headers=user_headers).get_json()['assets'],
+                client.get('/api/assets/changes?limit=2000', headers=user_headers).get_json()['changes'],
+            ]
+            for ativos in respostas:
+                assert ativos and all('gps_latitude' not in a and 'serial_number' in a for a in ativos)
+
+            asset = client.get(f'/api/assets/{serial}', headers=superadmin_headers).get_json()
+            assert asset['gps_latitude'] is not None
+        finally:
+            with app.test_request_context():
+                g.tenant_id = 'smartlamppost'
+                definir_permissoes_utilizador(user_id, {})
+
 
 class TestAssetsUpdate:
     """Tests for PUT /api/assets/<serial_number> endpoint."""
@@ -197,3 +284,430 @@ class TestAssetsStatusChange:
                     json={'condition_status': 'Em Manutenção'},
                     headers=superadmin_headers)
                 assert response.status_code == 200
+
+
+class TestAssetsFlat:
+    """Tests for the assets_flat projection."""
+
+    def _flat_row(self, app, serial_number):
+        from app.shared.database import obter_bd
+        with app.app_context():
+            return obter_bd('smartlamppost').execute(
+                'SELECT * FROM assets_flat WHERE serial_number = ?', (serial_number,)
+            ).fetchone()
+
+    def test_projection_follows_writes(self, app, client, superadmin_headers, sample_asset_data):
+        """Test create, update and delete keep the flat row in sync."""
+        data = {**sample_asset_data, 'rfid_tag': 'FLAT-TEST-001', 'next_maintenance_date': '2030-05-01'}
+        response = client.post('/api/assets', json=data, headers=superadmin_headers)
+        serial_number = response.get_json()['serial_number']
+
+        row = self._flat_row(app, serial_number)
+        assert row['condition_status'] == 'Operacional'
+        assert row['gps_latitude'] == pytest.approx(38.7223)
+        assert row['next_maintenance_date'] == '2030-05-01'
+
+        client.put(f'/api/assets/{serial_number}',
+            json={'condition_status': 'Em Reparação'},
+            headers=superadmin_headers)
+        assert self._flat_row(app, serial_number)['condition_status'] == 'Em Reparação'
+
+        client.delete(f'/api/assets/{serial_number}', headers=superadmin_headers)
+        assert self._flat_row(app, serial_number) is None
+
+    def test_rebuild(self, app, client, superadmin_headers, sample_asset_data):
+        """Test the projection can be rebuilt from asset_data."""
+        from app.shared.database import obter_bd
+        from app.shared.asset_data import reconstruir_assets_flat
+        data = {**sample_asset_data, 'rfid_tag': 'FLAT-TEST-002'}
+        serial_number = client.post('/api/assets', json=data,
+                                    headers=superadmin_headers).get_json()['serial_number']
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.execute('DELETE FROM assets_flat')
+            bd.commit()
+            total = reconstruir_assets_flat(bd)
+            assert total == bd.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+        assert self._flat_row(app, serial_number)['rfid_tag'] == 'FLAT-TEST-002'
+
+
+class TestTypedValues:
+    """Tests for the value_num/value_date shadows of asset_data."""
+
+    def _typed(self, app, serial_number, field_name):
+        from app.shared.database import obter_bd
+        with app.app_context():
+            return obter_bd('smartlamppost').execute('''
+                SELECT ad.value_num, ad.value_date FROM asset_data ad
+                JOIN assets a ON a.id = ad.asset_id
+                WHERE a.serial_number = ? AND ad.field_name = ?
+            ''', (serial_number, field_name)).fetchone()
+
+    def test_typed_values_written(self, app, client, superadmin_headers, sample_asset_data):
+        """Test date and number fields get their typed shadow on write."""
+        data = {**sample_asset_data, 'rfid_tag': 'TYPED-TEST-001', 'warranty_end_date': '15/03/2031'}
+        serial_number = client.post('/api/assets', json=data,
+                                    headers=superadmin_headers).get_json()['serial_number']
+
+        assert self._typed(app, serial_number, 'warranty_end_date')['value_date'] == '2031-03-15'
+        assert self._typed(app, serial_number, 'gps_latitude')['value_num'] == pytest.approx(38.7223)
+        row = self._typed(app, serial_number, 'manufacturer')
+        assert row['value_num'] is None and row['value_date'] is None
+
+    def test_rebuild_typed_values(self, app, client, superadmin_headers, sample_asset_data):
+        """Test typed values can be recomputed from field_value."""
+        from app.shared.database import obter_bd
+        from app.shared.asset_data import reconstruir_valores_tipados
+        data = {**sample_asset_data, 'rfid_tag': 'TYPED-TEST-002', 'next_inspection_date': '2031-01-02'}
+        serial_number = client.post('/api/assets', json=data,
+                                    headers=superadmin_headers).get_json()['serial_number']
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.execute('UPDATE asset_data SET value_num = NULL, value_date = NULL')
+            bd.commit()
+            assert reconstruir_valores_tipados(bd) > 0
+        assert self._typed(app, serial_number, 'next_inspection_date')['value_date'] == '2031-01-02'
+
+
+class TestSearchIndex:
+    """Tests for the asset search index."""
+
+    def _search(self, client, headers, q):
+        response = client.get(f'/api/assets/search?q={q}', headers=headers)
+        assert response.status_code == 200
+        return {a['serial_number'] for a in response.get_json()['assets']}
+
+    def test_index_follows_writes(self, client, superadmin_headers, sample_asset_data):
+        """Test substring search on indexed fields after create, update and delete."""
+        data = {**sample_asset_data, 'rfid_tag': 'SEARCH-IDX-001',
+                'street_address': 'Rua das Amoreiras Pesquisáveis', 'municipality': 'Vilazinha'}
+        serial_number = client.post('/api/assets', json=data,
+                                    headers=superadmin_headers).get_json()['serial_number']
+
+        assert serial_number in self._search(client, superadmin_headers, 'amoreiras pesq')
+        assert serial_number in self._search(client, superadmin_headers, 'LAZIN')
+        assert serial_number in self._search(client, superadmin_headers, 'X-001')
+
+        client.put(f'/api/assets/{serial_number}', json={'municipality': 'Outravila'},
+                   headers=superadmin_headers)
+        assert serial_number not in self._search(client, superadmin_headers, 'lazin')
+        assert serial_number in self._search(client, superadmin_headers, 'travil')
+
+        listed = client.get('/api/assets?search=travil', headers=superadmin_headers).get_json()
+        assert serial_number in {a['serial_number'] for a in listed['data']}
+
+        client.delete(f'/api/assets/{serial_number}', headers=superadmin_headers)
+        assert serial_number not in self._search(client, superadmin_headers, 'travil')
+
+    def test_rebuild_index(self, app):
+        """Test the index can be rebuilt from assets_flat."""
+        from app.shared.database import obter_bd
+        from app.shared.search import reconstruir_indice_pesquisa
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            total = bd.execute('SELECT COUNT(*) FROM assets_flat').fetchone()[0]
+            assert reconstruir_indice_pesquisa(bd) == total
+
+
+class TestResolveRfid:
+    """Tests for the batch RFID resolve endpoint."""
+
+    def test_resolve_batch(self, client, superadmin_headers, sample_asset_data):
+        """Test known tags resolve to summaries and the rest are reported unknown."""
+        data = {**sample_asset_data, 'rfid_tag': 'SWEEP-RFID-001', 'municipality': 'Sweepville'}
+        serial_number = client.post('/api/assets', json=data,
+                                    headers=superadmin_headers).get_json()['serial_number']
+
+        response = client.post('/api/assets/resolve-rfid', headers=superadmin_headers, json={
+            'tags': ['SWEEP-RFID-001', 'SWEEP-UNKNOWN', 'SWEEP-RFID-001', '']
+        })
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['total'] == 2
+        assert data['unknown'] == ['SWEEP-UNKNOWN']
+        assert data['assets'][0]['serial_number'] == serial_number
+        assert data['assets'][0]['municipality'] == 'Sweepville'
+
+    def test_resolve_batch_limits(self, client, superadmin_headers):
+        """Test missing and oversized tag lists are rejected."""
+        from app.modules.assets.routes import RFID_BATCH_MAX
+        assert client.post('/api/assets/resolve-rfid', headers=superadmin_headers,
+                           json={}).status_code == 400
+        assert client.post('/api/assets/resolve-rfid', headers=superadmin_headers,
+                           json={'tags': ['x'] * (RFID_BATCH_MAX + 1)}).status_code == 400
+
+
+class TestBulkStatusChange:
+    """Tests for the set-based status change."""
+
+    def test_change_status_batch(self, app, client, superadmin_headers, sample_asset_data):
+        """Test statuses, log rows and unknown serials across chunks."""
+        from app.shared.database import obter_bd
+        from app.shared.asset_data import alterar_estado_ativos
+        serials = [
+            client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': f'STATUS-BULK-{i}'},
+                        headers=superadmin_headers).get_json()['serial_number']
+            for i in range(3)
+        ]
+
+        response = client.post('/api/assets/change-status', headers=superadmin_headers, json={
+            'serial_numbers': serials[:2] + ['NO-SUCH-SERIAL'],
+            'new_status': 'Em Reparação', 'description': 'Sweep'
+        })
+        assert response.status_code == 200
+        results = response.get_json()['results']
+        assert [r['serial_number'] for r in results['success']] == serials[:2]
+        assert results['success'][0]['previous_status'] == 'Operacional'
+        assert results['errors'] == [{'serial_number': 'NO-SUCH-SERIAL', 'error': 'Ativo não encontrado'}]
+
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            resultado = alterar_estado_ativos(bd, serials, 'Suspenso', 'Chunked', 1, tamanho_lote=2)
+            assert len(resultado['success']) == 3
+            estados = bd.execute(f'''
+                SELECT condition_status FROM assets_flat f JOIN assets a ON a.id = f.asset_id
+                WHERE a.serial_number IN ({', '.join('?' * len(serials))})
+            ''', serials).fetchall()
+            assert {e['condition_status'] for e in estados} == {'Suspenso'}
+            logs = bd.execute('''
+                SELECT COUNT(*) FROM status_change_log l JOIN assets a ON a.id = l.asset_id
+                WHERE a.serial_number = ?
+            ''', (serials[0],)).fetchone()[0]
+            assert logs == 2
+
+
+class TestBulkDelete:
+    """Tests for synchronous and job-based bulk deletes."""
+
+    def _criar(self, client, headers, sample_asset_data, n, prefixo):
+        return [
+            client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': f'{prefixo}-{i}'},
+                        headers=headers).get_json()['serial_number']
+            for i in range(n)
+        ]
+
+    def test_sync_bulk_delete(self, client, superadmin_headers, sample_asset_data):
+        """Test small lists are deleted in the request."""
+        serials = self._criar(client, superadmin_headers, sample_asset_data, 2, 'BULK-DEL-SYNC')
+        response = client.delete('/api/assets/bulk', headers=superadmin_headers,
+                                 json={'serial_numbers': serials + ['NO-SUCH-SERIAL']})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['deleted'] == 2 and data['deleted_serials'] == serials
+        assert data['failed_details'] == [{'serial_number': 'NO-SUCH-SERIAL', 'error': 'Ativo não encontrado'}]
+        assert client.get(f'/api/assets/{serials[0]}', headers=superadmin_headers).status_code == 404
+
+    def test_async_bulk_delete_job(self, app, client, superadmin_headers, sample_asset_data):
+        """Test a queued delete job reports progress and its result."""
+        import time
+        serials = self._criar(client, superadmin_headers, sample_asset_data, 3, 'BULK-DEL-JOB')
+        response = client.delete('/api/assets/bulk?async=1', headers=superadmin_headers,
+                                 json={'serial_numbers': serials})
+        assert response.status_code == 202
+        status_url = response.get_json()['status_url']
+
+        for _ in range(100):
+            job = client.get(status_url, headers=superadmin_headers).get_json()
+            if job['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+        assert job['status'] == 'completed'
+        assert job['total'] == 3 and job['processed'] == 3
+        assert job['result']['deleted'] == 3
+
+        from app.shared.database import obter_bd
+        with app.app_context():
+            audit = obter_bd('smartlamppost').execute(
+                "SELECT COUNT(*) FROM audit_log WHERE action = 'BULK_DELETE' AND old_values LIKE '%BULK-DEL-JOB%'"
+            ).fetchone()[0]
+            assert audit == 3
+
+        assert client.get('/api/assets/jobs/missing', headers=superadmin_headers).status_code == 404
+
+
+class TestSerialAllocator:
+    """Tests for block reservation of serial numbers."""
+
+    def test_skips_imported_serials(self, client, superadmin_headers, sample_asset_data):
+        """Test that generated serials step over ones created by hand or import."""
+        proximo = client.get('/api/assets/next-number', headers=superadmin_headers).get_json()['number']
+        client.post('/api/assets', json={**sample_asset_data, 'serial_number': proximo,
+                                         'rfid_tag': 'ALLOC-IMPORTED'}, headers=superadmin_headers)
+
+        response = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'ALLOC-NEW'},
+                               headers=superadmin_headers)
+        assert response.status_code == 201
+        assert response.get_json()['serial_number'] > proximo
+
+        response = client.post('/api/assets/duplicate', headers=superadmin_headers,
+                               json={'serial_number': proximo, 'quantity': 3})
+        assert response.status_code == 201
+        serials = response.get_json()['created_serials']
+        assert len(set(serials)) == 3 and serials == sorted(serials)
+
+    def test_skips_serials_past_the_padding(self, app):
+        """Test collisions are found when the counter outgrows the zero padding."""
+        from app.shared.database import obter_bd
+        from app.shared.sequences import reservar_numeros
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.execute("INSERT INTO sequence_counters (counter_type, current_value) VALUES ('pad_test', 97)")
+            bd.execute("INSERT INTO assets (serial_number) VALUES ('PAD100')")
+            try:
+                assert reservar_numeros(bd, 'pad_test', 'PAD', 2, 3,
+                                        tabela='assets', coluna='serial_number') == ['PAD98', 'PAD99', 'PAD101']
+            finally:
+                bd.rollback()
+
+    def test_concurrent_reservations(self, app):
+        """Test that concurrent reservations never hand out the same number."""
+        from concurrent.futures import ThreadPoolExecutor
+        from app.shared.database import obter_bd
+        from app.shared.sequences import reservar_numeros
+
+        def reservar(_):
+            with app.app_context():
+                bd = obter_bd('smartlamppost')
+                numeros = []
+                for _ in range(10):
+                    numeros += reservar_numeros(bd, 'alloc_test', 'T', 6, 5)
+                    bd.commit()
+                return numeros
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            numeros = [n for lote in executor.map(reservar, range(4)) for n in lote]
+        assert len(numeros) == len(set(numeros)) == 200
+
+
+class TestListFilters:
+    """Tests for ?filter= and ?sort= on the asset listing."""
+
+    def _listar(self, client, headers, query):
+        response = client.get(f'/api/assets?per_page=100&{query}', headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+
+    def test_filter_and_sort(self, client, superadmin_headers, sample_asset_data):
+        """Test typed filters, the status shortcut and sorting on flat fields."""
+        for i, (municipio, latitude) in enumerate([('FiltroA', 38.1), ('FiltroA', 38.3), ('FiltroB', 38.2)]):
+            client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': f'FILTER-{i}',
+                                             'municipality': municipio, 'gps_latitude': latitude},
+                        headers=superadmin_headers)
+
+        data = self._listar(client, superadmin_headers, 'filter=municipality:eq:FiltroA&sort=-gps_latitude')
+        assert data['pagination']['total'] == 2
+        assert [a['rfid_tag'] for a in data['data']] == ['FILTER-1', 'FILTER-0']
+
+        data = self._listar(client, superadmin_headers,
+                            'filter=municipality:in:FiltroA|FiltroB&filter=gps_latitude:gte:38,2')
+        assert {a['rfid_tag'] for a in data['data']} == {'FILTER-1', 'FILTER-2'}
+
+        data = self._listar(client, superadmin_headers, 'filter=rfid_tag:contains:FILTER-&status=Operacional')
+        assert data['pagination']['total'] == 3
+
+    def test_missing_field_in_ne_and_sort(self, client, superadmin_headers, sample_asset_data):
+        """Test ne keeps assets without the field and sorting puts them last."""
+        for i, municipio in enumerate(['NullA', 'NullB', None]):
+            dados = {**sample_asset_data, 'rfid_tag': f'NULLSORT-{i}'}
+            if municipio:
+                dados['municipality'] = municipio
+            client.post('/api/assets', json=dados, headers=superadmin_headers)
+
+        data = self._listar(client, superadmin_headers,
+                            'filter=rfid_tag:contains:NULLSORT-&filter=municipality:ne:NullA')
+        assert {a['rfid_tag'] for a in data['data']} == {'NULLSORT-1', 'NULLSORT-2'}
+
+        for sort, esperado in (('municipality', [0, 1, 2]), ('-municipality', [1, 0, 2])):
+            data = self._listar(client, superadmin_headers, f'filter=rfid_tag:contains:NULLSORT-&sort={sort}')
+            assert [a['rfid_tag'] for a in data['data']] == [f'NULLSORT-{i}' for i in esperado], sort
+
+    def test_filter_timestamp_by_day(self, client, superadmin_headers, sample_asset_data):
+        """Test that a day on created_at matches the whole day, not only midnight."""
+        serial = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'FILTER-DAY'},
+                             headers=superadmin_headers).get_json()['serial_number']
+        dia = client.get(f'/api/assets/{serial}', headers=superadmin_headers).get_json()['created_at'][:10]
+
+        for op, encontrado in (('eq', True), ('lte', True), ('gte', True), ('in', True),
+                               ('lt', False), ('gt', False), ('ne', False)):
+            data = self._listar(client, superadmin_headers,
+                                f'filter=created_at:{op}:{dia}&filter=rfid_tag:eq:FILTER-DAY')
+            assert (data['pagination']['total'] == 1) is encontrado, op
+
+    def test_invalid_filters(self, client, superadmin_headers):
+        """Test that malformed filters are rejected."""
+        for query in ('filter=municipality', 'filter=municipality:like:x',
+                      'filter=gps_latitude:lt:abc', 'filter=Bad Field:eq:1', 'sort=x&after='):
+            response = client.get(f'/api/assets?{query}', headers=superadmin_headers)
+            assert response.status_code == 400, query
+
+
+class TestAssetChanges:
+    """Tests for delta sync through /api/assets/changes."""
+
+    def _token_atual(self, client, headers):
+        token, has_more = '0', True
+        while has_more:
+            data = client.get(f'/api/assets/changes?since={token}&limit=2000', headers=headers).get_json()
+            token, has_more = data['next_token'], data['has_more']
+        return token
+
+    def test_changes_since_token(self, client, superadmin_headers, sample_asset_data):
+        """Test that creates, updates and deletes after a token are returned once."""
+        manter = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'SYNC-KEEP'},
+                             headers=superadmin_headers).get_json()['serial_number']
+        apagar = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'SYNC-DROP'},
+                             headers=superadmin_headers).get_json()['serial_number']
+        token = self._token_atual(client, superadmin_headers)
+
+        vazio = client.get(f'/api/assets/changes?since={token}', headers=superadmin_headers).get_json()
+        assert vazio == {'changes': [], 'deleted': [], 'deleted_ids': [], 'next_token': token,
+                         'has_more': False}
+
+        client.put(f'/api/assets/{manter}', json={'municipality': 'SyncTown'}, headers=superadmin_headers)
+        client.delete(f'/api/assets/{apagar}', headers=superadmin_headers)
+        nova = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'SYNC-NEW'},
+                           headers=superadmin_headers).get_json()['serial_number']
+
+        data = client.get(f'/api/assets/changes?since={token}&limit=1', headers=superadmin_headers).get_json()
+        assert data['has_more'] and len(data['changes']) + len(data['deleted_ids']) == 1
+        data = client.get(f'/api/assets/changes?since={token}', headers=superadmin_headers).get_json()
+        assert {a['serial_number'] for a in data['changes']} == {manter, nova}
+        assert [a['municipality'] for a in data['changes'] if a['serial_number'] == manter] == ['SyncTown']
+        assert data['deleted'] == [apagar]
+        assert int(data['next_token']) > int(token) and not data['has_more']
+
+    def test_delete_then_recreate_serial(self, client, superadmin_headers, sample_asset_data):
+        """Test a serial deleted and created again is told apart by asset id."""
+        criado = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'SYNC-AGAIN'},
+                             headers=superadmin_headers).get_json()
+        serial = criado['serial_number']
+        antigo = client.get(f'/api/assets/{serial}', headers=superadmin_headers).get_json()['id']
+        token = self._token_atual(client, superadmin_headers)
+
+        client.delete(f'/api/assets/{serial}', headers=superadmin_headers)
+        response = client.post('/api/assets', json={**sample_asset_data, 'rfid_tag': 'SYNC-AGAIN',
+                                                    'serial_number': serial},
+                               headers=superadmin_headers)
+        assert response.status_code in [200, 201]
+
+        data = client.get(f'/api/assets/changes?since={token}', headers=superadmin_headers).get_json()
+        assert data['deleted'] == [serial] and data['deleted_ids'] == [antigo]
+        assert [(a['serial_number'], a['id'] != antigo) for a in data['changes']] == [(serial, True)]
+
+    def test_purged_token_needs_reset(self, app, client, superadmin_headers):
+        """Test that a token older than purged deletions gets a 410."""
+        from app.shared.database import obter_bd
+        assert client.get('/api/assets/changes?since=abc', headers=superadmin_headers).status_code == 400
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.execute("INSERT INTO sequence_counters (counter_type, current_value) VALUES ('asset_changes_purged', 5)")
+            bd.commit()
+        try:
+            response = client.get('/api/assets/changes?since=2', headers=superadmin_headers)
+            assert response.status_code == 410 and response.get_json()['reset'] is True
+            assert client.get('/api/assets/changes?since=0', headers=superadmin_headers).status_code == 200
+        finally:
+            with app.app_context():
+                bd = obter_bd('smartlamppost')
+                bd.execute("DELETE FROM sequence_counters WHERE counter_type = 'asset_changes_purged'")
+                bd.commit()
@@ -4,6 +4,8 @@ SmartLamppost v5.0 - Backup API Tests
 Note: Backup endpoints use /api/backup/create, /api/backup/list, etc.
 """
 
+import os
+
 import pytest
 
 
@@ -94,6 +96,40 @@ class TestBackupRestore:
         response = client.post('/api/backup/restore/nonexistent.zip', headers=superadmin_headers)
         assert response.status_code in [400, 404]
 
+    def test_restore_migrates_old_backup(self, app, client, superadmin_headers):
+        """Test a backup taken before the versioned migrations is brought up to date."""
+        import shutil
+        import sqlite3
+        from app.shared.database import (
+            obter_bd, obter_caminho_bd_tenant, consolidar_wal, table_exists, SCHEMA_VERSION
+        )
+        from app.shared.migrations import obter_versao_esquema
+        from app.modules.backup.routes import get_backup_dir
+
+        caminho_bd = obter_caminho_bd_tenant('smartlamppost')
+        antigo = os.path.join(get_backup_dir(app.config['BASE_PATH']), 'pre_series_test.db')
+        consolidar_wal(caminho_bd)
+        shutil.copy2(caminho_bd, antigo)
+        conn = sqlite3.connect(antigo)
+        for tabela in ('schema_migrations', 'background_jobs', 'asset_changes'):
+            conn.execute(f'DROP TABLE IF EXISTS {tabela}')
+        conn.commit()
+        conn.close()
+
+        try:
+            response = client.post('/api/backup/restore/pre_series_test.db',
+                                   json={'confirm': True}, headers=superadmin_headers)
+            assert response.status_code == 200
+        finally:
+            os.remove(antigo)
+
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            assert obter_versao_esquema(bd) == SCHEMA_VERSION
+            assert table_exists(bd, 'background_jobs') and table_exists(bd, 'asset_changes')
+        response = client.get('/api/assets/changes', headers=superadmin_headers)
+        assert response.status_code == 200
+
     def test_restore_unauthenticated(self, client):
         """Test restore without authentication."""
         response = client.post('/api/backup/restore/test.zip')
@@ -49,6 +49,29 @@ class TestDataImport:
         # 405 if method not implemented
         assert response.status_code in [401, 404, 405]
 
+    def test_blank_serials_need_opt_in(self, client, superadmin_headers):
+        """Test rows without a serial are reported unless generate_serials is set."""
+        import io
+        import openpyxl
+
+        def enviar(**opcoes):
+            wb = openpyxl.Workbook()
+            wb.active.append(['Serial Number', 'Status'])
+            wb.active.append([None, 'ativo'])
+            ficheiro = io.BytesIO()
+            wb.save(ficheiro)
+            ficheiro.seek(0)
+            return client.post('/api/data/import/excel', headers=superadmin_headers,
+                               data={'file': (ficheiro, 'blank.xlsx'), 'mode': 'create_only', **opcoes},
+                               content_type='multipart/form-data').get_json()
+
+        dados = enviar()
+        assert dados['imported'] == 0
+        assert any('Número de série vazio' in e for e in dados['errors'])
+
+        dados = enviar(generate_serials='true')
+        assert dados['imported'] == 1 and not dados['errors']
+
 
 class TestDataPreview:
     """Tests for POST /api/data/import/preview endpoint."""
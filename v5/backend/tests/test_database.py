@@ -0,0 +1,645 @@
+"""
+SmartLamppost v5.0 - Database Layer Tests
+"""
+
+import os
+
+import pytest
+
+
+class TestSqlTranslation:
+    """Tests for the SQLite -> PostgreSQL dialect translation."""
+
+    def test_placeholders_and_upsert(self):
+        """Test placeholder conversion and known INSERT OR REPLACE targets."""
+        from app.shared.database import traduzir_sql_postgres
+        query = traduzir_sql_postgres(
+            'INSERT OR REPLACE INTO asset_data (asset_id, field_name, field_value) VALUES (?, ?, ?)')
+        assert '%s, %s, %s' in query
+        assert query.startswith('INSERT INTO asset_data')
+        assert 'ON CONFLICT (asset_id, field_name) DO UPDATE SET field_value = EXCLUDED.field_value' in query
+        assert query.endswith('value_date = EXCLUDED.value_date')
+
+    def test_insert_or_ignore(self):
+        """Test INSERT OR IGNORE becomes ON CONFLICT DO NOTHING."""
+        from app.shared.database import traduzir_sql_postgres
+        query = traduzir_sql_postgres('INSERT OR IGNORE INTO t (a) VALUES (?);')
+        assert query == 'INSERT INTO t (a) VALUES (%s) ON CONFLICT DO NOTHING'
+
+    def test_date_functions(self):
+        """Test strftime, DATE('now') and julianday rewrites."""
+        from app.shared.database import traduzir_sql_postgres
+        query = traduzir_sql_postgres(
+            "SELECT strftime('%Y-%m', i.created_at), julianday('now') - julianday(i.created_at) "
+            "FROM interventions i WHERE i.created_at >= DATE('now', '-30 days') AND d <= DATE('now')")
+        assert "TO_CHAR(i.created_at::timestamp, 'YYYY-MM')" in query
+        assert 'EXTRACT(EPOCH FROM NOW() - i.created_at::timestamp) / 86400' in query
+        assert "CURRENT_DATE + INTERVAL '-30 days'" in query
+        assert query.endswith('d <= CURRENT_DATE')
+
+    def test_translation_is_cached(self):
+        """Test repeated queries are served from the translation cache."""
+        from app.shared.database import traduzir_sql_postgres, obter_estatisticas_traducao
+        query = 'SELECT id FROM assets WHERE serial_number = ? AND 1 = 1'
+        traduzir_sql_postgres(query)
+        antes = obter_estatisticas_traducao()
+        traduzir_sql_postgres(query)
+        depois = obter_estatisticas_traducao()
+        assert depois['hits'] == antes['hits'] + 1
+        assert depois['misses'] == antes['misses']
+
+
+class TestSQLitePool:
+    """Tests for the pooled SQLite connections."""
+
+    def test_connections_are_tuned(self, app):
+        """Test pooled connections use WAL and a busy timeout."""
+        from app.shared.database import obter_bd
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            assert bd.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert bd.execute('PRAGMA busy_timeout').fetchone()[0] > 0
+            assert bd.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+
+    def test_connection_reused_across_requests(self, app):
+        """Test a connection returned at teardown is handed out again."""
+        from app.shared.database import obter_bd
+        with app.app_context():
+            primeira = obter_bd('smartlamppost')
+        with app.app_context():
+            segunda = obter_bd('smartlamppost')
+        assert primeira is segunda
+
+    def test_uncommitted_work_is_rolled_back(self, app):
+        """Test returning a connection discards an open transaction."""
+        from app.shared.database import obter_bd
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.execute("INSERT INTO system_config (config_key, config_value) VALUES ('pool_test', '1')")
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            row = bd.execute("SELECT 1 FROM system_config WHERE config_key = 'pool_test'").fetchone()
+            assert row is None
+
+    @staticmethod
+    def _criar_bd(caminho, valor):
+        import sqlite3
+        conn = sqlite3.connect(caminho)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('CREATE TABLE t (v TEXT)')
+        conn.execute('INSERT INTO t (v) VALUES (?)', (valor,))
+        conn.commit()
+        conn.close()
+
+    def test_replaced_file_is_reopened(self, tmp_path):
+        """Test an idle connection to a file replaced on disk is not handed out."""
+        from app.shared.database import SQLiteConnectionPool
+        caminho, novo = str(tmp_path / 'a.db'), str(tmp_path / 'b.db')
+        self._criar_bd(caminho, 'antigo')
+        self._criar_bd(novo, 'novo')
+        pool = SQLiteConnectionPool()
+        conn = pool.adquirir(caminho)
+        assert conn.execute('SELECT v FROM t').fetchone()[0] == 'antigo'
+        pool.devolver(conn)
+
+        os.replace(novo, caminho)
+        outra = pool.adquirir(caminho)
+        assert outra is not conn and conn.fechada
+        assert outra.execute('SELECT v FROM t').fetchone()[0] == 'novo'
+        assert pool.estatisticas()['replaced_files'] == 1
+        pool.devolver(outra)
+        pool.descartar()
+
+    def test_restore_reaches_other_connections(self, tmp_path):
+        """Test a restore is seen by connections another worker keeps open."""
+        from app.shared.database import SQLiteConnectionPool, restaurar_bd_sqlite
+        caminho, backup = str(tmp_path / 'a.db'), str(tmp_path / 'backup.db')
+        self._criar_bd(caminho, 'antigo')
+        self._criar_bd(backup, 'restaurado')
+        outro_worker = SQLiteConnectionPool()
+        conn = outro_worker.adquirir(caminho)
+        # Left in the other worker's -wal, not checkpointed into the file
+        conn.execute("UPDATE t SET v = 'alterado'")
+        conn.commit()
+        outro_worker.devolver(conn)
+
+        restaurar_bd_sqlite(backup, caminho)
+        reutilizada = outro_worker.adquirir(caminho)
+        assert reutilizada is conn
+        assert reutilizada.execute('SELECT v FROM t').fetchone()[0] == 'restaurado'
+        outro_worker.devolver(reutilizada)
+        outro_worker.descartar()
+
+
+class _CursorPgFalso:
+    """psycopg2-like cursor over the SQLite file the fake connection points at."""
+
+    def __init__(self, ligacao):
+        self._ligacao = ligacao
+        self._cursor = None
+
+    def execute(self, query, params=None):
+        if query.startswith('CREATE SCHEMA'):
+            return
+        if query.startswith('SET search_path TO'):
+            self._ligacao.abrir(query.split()[3].rstrip(','))
+            return
+        self._cursor = self._ligacao.sqlite.execute(query.replace('%s', '?'), params or ())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        pass
+
+
+class _LigacaoPgFalsa:
+    """Stand-in for a pooled psycopg2 connection, one SQLite file per schema."""
+
+    closed = 0
+    search_path = None
+
+    def __init__(self, caminhos):
+        import sqlite3
+        from types import SimpleNamespace
+        self._sqlite3 = sqlite3
+        self._caminhos = caminhos
+        self.sqlite = None
+        self.info = SimpleNamespace(transaction_status=0)
+
+    def abrir(self, schema):
+        self.sqlite = self._sqlite3.connect(self._caminhos[schema])
+        self.sqlite.row_factory = self._sqlite3.Row
+
+    def cursor(self, cursor_factory=None):
+        return _CursorPgFalso(self)
+
+    def commit(self):
+        if self.sqlite:
+            self.sqlite.commit()
+
+    def rollback(self):
+        if self.sqlite:
+            self.sqlite.rollback()
+
+
+class TestStandalonePgConnections:
+    """Tests for scheduler connections checked out of the PostgreSQL manager."""
+
+    def _gestor(self, monkeypatch):
+        """Switch the database layer to a PostgreSQL manager over fake connections."""
+        from types import SimpleNamespace
+        from app.shared import database
+
+        caminhos = {'directory': database.DIRETORIO_PARTILHADO, 'catalog': database.CATALOGO_PARTILHADO}
+        for tenant_id in database.obter_lista_tenants():
+            caminhos[f"tenant_{tenant_id.replace('-', '_')}"] = database.obter_caminho_bd_tenant(tenant_id)
+
+        class _PoolFalso:
+            def __init__(self, **kwargs):
+                pass
+
+            def getconn(self):
+                return _LigacaoPgFalsa(caminhos)
+
+            def putconn(self, conn):
+                if conn.sqlite:
+                    conn.sqlite.close()
+
+        monkeypatch.setattr(database, 'pool', SimpleNamespace(ThreadedConnectionPool=_PoolFalso,
+                                                               PoolError=RuntimeError), raising=False)
+        monkeypatch.setattr(database, '_PgConnection', object, raising=False)
+        monkeypatch.setattr(database, 'TRANSACTION_STATUS_IDLE', 0, raising=False)
+        # Two slots and no wait: a single leaked checkout starves the next tenant
+        gestor = database.PostgresConnectionManager('postgresql://u:p@localhost/slp', maxconn=2, timeout=0.1)
+        monkeypatch.setattr(database, '_pg_manager', gestor)
+        monkeypatch.setattr(database, 'USE_POSTGRES', True)
+        return gestor
+
+    def test_scheduler_returns_connections(self, app, monkeypatch):
+        """Test a purge run leaves no PostgreSQL connection checked out."""
+        from app.shared.scheduler import executar_limpeza_expirados
+        gestor = self._gestor(monkeypatch)
+
+        for _ in range(3):
+            relatorio = executar_limpeza_expirados()
+            assert 'smartlamppost' in relatorio['tenants']
+            assert set(relatorio['directory']) == {'session_directory', 'token_revocations'}
+
+        stats = gestor.estatisticas()
+        assert stats['checkouts'] >= 6
+        assert stats['in_use'] == 0
+
+
+    def test_failed_schema_setup_returns_connections(self, app, monkeypatch):
+        """Test DDL errors during schema setup don't leak PostgreSQL checkouts."""
+        from app.shared import database
+        gestor = self._gestor(monkeypatch)
+
+        def falhar(*args, **kwargs):
+            raise RuntimeError('DDL failed')
+
+        monkeypatch.setattr(database, '_criar_tabelas_postgres', falhar)
+        monkeypatch.setattr(database, '_criar_tabelas_catalogo_postgres', falhar)
+        monkeypatch.setattr(_LigacaoPgFalsa, 'commit', falhar)
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                database.aplicar_esquema_base_tenant('smartlamppost')
+            with pytest.raises(RuntimeError):
+                database.inicializar_catalogo()
+            with pytest.raises(RuntimeError):
+                database.inicializar_diretorio()
+
+        stats = gestor.estatisticas()
+        assert stats['checkouts'] == 9
+        assert stats['in_use'] == 0
+
+
+class TestAssetDataHydration:
+    """Tests for batched asset_data loading."""
+
+    def test_loads_fields_in_chunks(self, app):
+        """Test fields of many assets are returned per asset, across chunks."""
+        from app.shared.database import obter_bd, carregar_dados_ativos
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            ids = []
+            for i in range(5):
+                cursor = bd.execute('INSERT INTO assets (serial_number) VALUES (?)', (f'HYD{i:03d}',))
+                ids.append(cursor.lastrowid)
+                bd.execute('INSERT INTO asset_data (asset_id, field_name, field_value) VALUES (?, ?, ?)',
+                           (cursor.lastrowid, 'municipality', f'M{i}'))
+                bd.execute('INSERT INTO asset_data (asset_id, field_name, field_value) VALUES (?, ?, ?)',
+                           (cursor.lastrowid, 'model', 'X'))
+            bd.commit()
+
+            dados = carregar_dados_ativos(bd, ids + [999999], chunk_size=2)
+            assert dados[ids[3]] == {'municipality': 'M3', 'model': 'X'}
+            assert dados[999999] == {}
+
+            dados = carregar_dados_ativos(bd, ids, campos=['municipality'])
+            assert dados[ids[0]] == {'municipality': 'M0'}
+
+
+class TestMigrations:
+    """Tests for the versioned schema migration runner."""
+
+    def test_tenant_at_schema_version(self, app):
+        """Test the tenant database records the current schema version."""
+        from app.shared.database import obter_bd, SCHEMA_VERSION
+        from app.shared.migrations import obter_versao_esquema
+        with app.app_context():
+            assert obter_versao_esquema(obter_bd('smartlamppost')) == SCHEMA_VERSION
+
+    def test_pending_step_runs_once(self, app, monkeypatch):
+        """Test only steps above the recorded version are applied."""
+        from app.shared.database import obter_bd
+        from app.shared import migrations
+
+        aplicados = []
+        versao = migrations.SCHEMA_VERSION + 1
+        monkeypatch.setattr(migrations, 'MIGRACOES_TENANT', migrations.MIGRACOES_TENANT +
+                            [(versao, 'Test step', lambda bd: aplicados.append(bd))])
+        try:
+            with app.app_context():
+                assert migrations.migrar_tenant('smartlamppost') == (versao - 1, versao)
+            with app.app_context():
+                assert migrations.migrar_tenant('smartlamppost') == (versao, versao)
+            assert len(aplicados) == 1
+        finally:
+            with app.app_context():
+                bd = obter_bd('smartlamppost')
+                bd.execute('DELETE FROM schema_migrations WHERE version = ?', (versao,))
+                bd.commit()
+
+    def test_migrate_all_tenants(self, app):
+        """Test the parallel runner reports every tenant."""
+        from app.shared.database import SCHEMA_VERSION
+        from app.shared.migrations import migrar_todos_tenants
+        resultados = migrar_todos_tenants(app, ['smartlamppost'], workers=2)
+        assert resultados == {'smartlamppost': (SCHEMA_VERSION, SCHEMA_VERSION)}
+
+    def test_startup_migrates_shared_databases_only(self, app, monkeypatch):
+        """Test worker startup leaves tenant databases to the migrate command."""
+        import app as pacote
+        from app.shared.config import Config
+        monkeypatch.delenv('SCHEMA_AUTO_MIGRATE', raising=False)
+        chamadas = []
+        monkeypatch.setattr(pacote, 'migrar_bases_partilhadas', lambda: chamadas.append('shared'))
+        monkeypatch.setattr(pacote, 'migrar_todos_tenants', lambda *a, **k: chamadas.append('tenants'))
+
+        class ConfigArranque(Config):
+            BASE_PATH = app.config['BASE_PATH']
+            SECRET_KEY = app.config['SECRET_KEY']
+            TESTING = True
+
+        pacote.create_app(ConfigArranque)
+        assert chamadas == ['shared']
+        ConfigArranque.SCHEMA_AUTO_MIGRATE = True
+        pacote.create_app(ConfigArranque)
+        assert chamadas == ['shared', 'shared', 'tenants']
+
+    def test_migrate_pre_series_tenant_with_assets(self, app):
+        """Test a tenant from before versioned migrations, holding assets, upgrades."""
+        import shutil
+        from app.shared.database import obter_bd, obter_caminho_bd_tenant, SCHEMA_VERSION
+        from app.shared.migrations import migrar_tenant, obter_versao_esquema
+        tenant_id = 'legacy-migration'
+        with app.app_context():
+            migrar_tenant(tenant_id)
+            bd = obter_bd(tenant_id)
+            bd.execute("INSERT INTO assets (serial_number, created_at) VALUES ('LEGACY-1', CURRENT_TIMESTAMP)")
+            bd.execute("INSERT INTO asset_data (asset_id, field_name, field_value) VALUES (1, 'municipality', 'Old')")
+            # Back to the layout the baseline commit shipped
+            for tabela in ('schema_migrations', 'asset_changes', 'assets_flat', 'assets_search', 'background_jobs'):
+                bd.execute(f'DROP TABLE IF EXISTS {tabela}')
+            bd.commit()
+        try:
+            with app.app_context():
+                assert migrar_tenant(tenant_id)[1] == SCHEMA_VERSION
+                bd = obter_bd(tenant_id)
+                assert obter_versao_esquema(bd) == SCHEMA_VERSION
+                assert bd.execute('SELECT municipality FROM assets_flat').fetchone()[0] == 'Old'
+                assert [tuple(r) for r in bd.execute(
+                    'SELECT serial_number, change_seq FROM asset_changes').fetchall()] == [('LEGACY-1', 1)]
+
+                # Rebuilding the projection is not an asset change
+                from app.shared.asset_data import reconstruir_assets_flat
+                reconstruir_assets_flat(bd)
+                assert bd.execute('SELECT change_seq FROM asset_changes').fetchone()[0] == 1
+        finally:
+            shutil.rmtree(os.path.dirname(obter_caminho_bd_tenant(tenant_id)), ignore_errors=True)
+
+
+class TestQueryPlans:
+    """Tests for the hot query plan regression check."""
+
+    def test_hot_queries_use_indexes(self, app):
+        """Test no registered hot query falls back to a full table scan."""
+        from app.shared.database import obter_bd
+        from app.shared.query_plans import verificar_planos
+        with app.app_context():
+            assert verificar_planos(obter_bd('smartlamppost')) == []
+
+    def test_registry_uses_route_queries(self, app):
+        """Test the checked queries are the ones the routes run, per backend."""
+        from app.shared import permissions
+        from app.shared.database import obter_bd
+        from app.shared.query_plans import CONSULTAS_CRITICAS
+        assert CONSULTAS_CRITICAS['session_by_token'][0] is permissions._QUERY_SESSAO
+        with app.app_context():
+            sql, _ = CONSULTAS_CRITICAS['asset_search'][0](obter_bd('smartlamppost'))
+        assert 'assets_search MATCH' in sql
+
+    def test_detects_full_scan(self, app):
+        """Test the checker flags an unindexed predicate."""
+        from app.shared.database import obter_bd
+        from app.shared.query_plans import verificar_planos
+        consultas = {'unindexed': ('SELECT * FROM interventions WHERE notes = ?', ('x',))}
+        with app.app_context():
+            problemas = verificar_planos(obter_bd('smartlamppost'), consultas)
+        assert [p['query'] for p in problemas] == ['unindexed']
+
+
+class TestInsertReturningId:
+    """Tests for insert_returning_id."""
+
+    def test_returns_new_id(self, app):
+        """Test the id of the inserted row is returned without a re-select."""
+        from app.shared.database import obter_bd, insert_returning_id
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            novo_id = insert_returning_id(bd,
+                'INSERT INTO assets (serial_number, created_at) VALUES (?, CURRENT_TIMESTAMP)',
+                ('RETURNING-ID-001',))
+            row = bd.execute('SELECT serial_number FROM assets WHERE id = ?', (novo_id,)).fetchone()
+            assert row['serial_number'] == 'RETURNING-ID-001'
+            bd.rollback()
+
+    def test_ignored_insert_returns_none(self, app):
+        """Test a conflicting INSERT OR IGNORE reports no new row."""
+        from app.shared.database import obter_bd, insert_returning_id
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            query = 'INSERT OR IGNORE INTO assets (serial_number) VALUES (?)'
+            assert insert_returning_id(bd, query, ('RETURNING-ID-002',)) is not None
+            assert insert_returning_id(bd, query, ('RETURNING-ID-002',)) is None
+            bd.rollback()
+
+    def test_adapter_ignored_insert_returns_none(self):
+        """Test the adapter agrees with the module helper on an ignored insert."""
+        import sqlite3
+        from app.shared.database import DatabaseAdapter, insert_returning_id
+        bd = DatabaseAdapter(sqlite3.connect(':memory:'))
+        bd.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, k TEXT UNIQUE)')
+        query = 'INSERT OR IGNORE INTO t (k) VALUES (?)'
+        assert insert_returning_id(bd, query, ('a',)) == 1
+        assert insert_returning_id(bd, query, ('a',)) is None
+        assert insert_returning_id(bd, query, ('b',)) == 2
+        bd.close()
+
+
+class TestBulkWrites:
+    """Tests for inserir_em_massa."""
+
+    def _valores(self, bd):
+        rows = bd.execute(
+            "SELECT config_key, config_value FROM system_config WHERE config_key LIKE 'bulk_test_%'"
+        ).fetchall()
+        return {r['config_key']: r['config_value'] for r in rows}
+
+    def test_insert_and_upsert(self, app):
+        """Test plain insert, upsert and do-nothing conflict handling."""
+        from app.shared.database import obter_bd, inserir_em_massa
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            colunas = ('config_key', 'config_value')
+            inserir_em_massa(bd, 'system_config', colunas, [('bulk_test_a', '1'), ('bulk_test_b', '1')])
+            inserir_em_massa(bd, 'system_config', colunas,
+                             [('bulk_test_a', '2'), ('bulk_test_c', '2'), ('bulk_test_c', '3')],
+                             chave_conflito=('config_key',), atualizar=('config_value',))
+            inserir_em_massa(bd, 'system_config', colunas, [('bulk_test_b', '9')],
+                             chave_conflito=('config_key',))
+            assert self._valores(bd) == {'bulk_test_a': '2', 'bulk_test_b': '1', 'bulk_test_c': '3'}
+            bd.rollback()
+
+
+class TestInstrumentation:
+    """Tests for per-request query metrics."""
+
+    def test_server_timing_header(self, client, admin_headers):
+        """Test API responses report DB time and statement count."""
+        response = client.get('/api/assets', headers=admin_headers)
+        assert response.status_code == 200
+        assert response.headers.get('Server-Timing', '').startswith('db;dur=')
+
+    def test_detects_repeated_statements(self, app):
+        """Test a statement shape run in a loop is reported as N+1."""
+        from app.shared.database import obter_bd
+        from app.shared.instrumentation import obter_metricas_pedido
+        with app.test_request_context():
+            bd = obter_bd('smartlamppost')
+            for i in range(25):
+                bd.execute(f'SELECT id FROM assets WHERE id = {i}').fetchall()
+            metricas = obter_metricas_pedido()
+            assert metricas.total >= 25
+            assert metricas.repetidas(20) == [('SELECT id FROM assets WHERE id = ?', 25)]
+
+    def test_normalizes_literals_and_lists(self):
+        """Test literals and IN lists collapse to one shape."""
+        from app.shared.instrumentation import normalizar_consulta
+        assert normalizar_consulta("SELECT * FROM t WHERE a = 'x'  AND b IN (?, ?, ?)") == \
+            'SELECT * FROM t WHERE a = ? AND b IN (?)'
+
+
+class TestTenantRegistry:
+    """Tests for the cached tenants.json registry."""
+
+    def test_reads_are_cached(self, app):
+        """Test repeated lookups do not re-read the file."""
+        from app.shared import database
+        registo = database._registo_tenants
+        assert database.obter_tenant('smartlamppost') is not None
+        leituras = registo.leituras
+        for _ in range(10):
+            database.obter_tenant('smartlamppost')
+            database.carregar_tenants()
+        assert registo.leituras == leituras
+
+    def test_copy_is_private(self, app):
+        """Test carregar_tenants returns data callers can modify freely."""
+        from app.shared.database import carregar_tenants, obter_tenant
+        dados = carregar_tenants()
+        dados['tenants'][0]['plan'] = 'changed-without-saving'
+        assert carregar_tenants()['tenants'][0].get('plan') != 'changed-without-saving'
+        assert obter_tenant(dados['tenants'][0]['id']).get('plan') != 'changed-without-saving'
+
+    def test_save_and_external_change(self, app, monkeypatch):
+        """Test saves are visible at once and external edits after revalidation."""
+        import json
+        from app.shared import database
+        original = database.carregar_tenants()
+        try:
+            dados = database.carregar_tenants()
+            dados['tenants'].append({'id': 'registry-test', 'name': 'Registry'})
+            database.guardar_tenants(dados)
+            assert database.obter_tenant('registry-test')['name'] == 'Registry'
+
+            monkeypatch.setattr(database._registo_tenants, 'intervalo', 0)
+            dados['tenants'][-1]['name'] = 'Edited on disk'
+            with open(database.FICHEIRO_TENANTS, 'w', encoding='utf-8') as f:
+                json.dump(dados, f, indent=4)
+            assert database.obter_tenant('registry-test')['name'] == 'Edited on disk'
+        finally:
+            database.guardar_tenants(original)
+        assert database.obter_tenant('registry-test') is None
+
+
+class TestExpiredRowPurge:
+    """Tests for the scheduled purge of expired auth rows."""
+
+    def test_purges_expired_rows_in_batches(self, app):
+        """Test expired rows go, live ones stay, across several batches."""
+        from datetime import datetime, timedelta
+        from app.shared.database import obter_bd
+        from app.shared.scheduler import purgar_registos_expirados, executar_limpeza_expirados
+        passado = (datetime.now() - timedelta(days=1)).isoformat()
+        futuro = (datetime.now() + timedelta(days=1)).isoformat()
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.executemany(
+                'INSERT INTO sessions (user_id, token, expires_at) VALUES (1, ?, ?)',
+                [(f'purge-old-{i}', passado) for i in range(7)] + [('purge-live', futuro)]
+            )
+            bd.execute("INSERT INTO two_factor_codes (user_id, code, expires_at) VALUES (1, '1', ?)", (passado,))
+            bd.execute("INSERT INTO password_reset_tokens (user_id, token, expires_at) VALUES (1, 'purge-reset', ?)",
+                       (passado,))
+            bd.commit()
+
+        apagadas = purgar_registos_expirados('smartlamppost', lote=3)
+        assert apagadas['sessions'] >= 7
+        assert apagadas['two_factor_codes'] >= 1 and apagadas['password_reset_tokens'] >= 1
+
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            tokens = {r['token'] for r in bd.execute("SELECT token FROM sessions WHERE token LIKE 'purge-%'")}
+            assert tokens == {'purge-live'}
+            bd.execute("DELETE FROM sessions WHERE token = 'purge-live'")
+            bd.commit()
+
+        relatorio = executar_limpeza_expirados()
+        assert 'smartlamppost' in relatorio['tenants']
+        assert set(relatorio['directory']) == {'session_directory', 'token_revocations'}
+
+    def test_interrupted_and_old_jobs(self, app):
+        """Test that jobs lost with their worker are failed and old finished jobs purged."""
+        from datetime import datetime, timedelta
+        from app.shared.database import obter_bd
+        from app.shared.jobs import obter_tarefa, ERRO_TAREFA_INTERROMPIDA
+        from app.shared.scheduler import purgar_registos_expirados
+        agora = datetime.now()
+        antigo = (agora - timedelta(days=30)).isoformat()
+        parado = (agora - timedelta(hours=2)).isoformat()
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.executemany('''
+                INSERT INTO background_jobs (id, job_type, status, created_at, updated_at, finished_at)
+                VALUES (?, 'test', ?, ?, ?, ?)
+            ''', [('job-lost', 'running', parado, parado, None),
+                  ('job-polled', 'running', parado, parado, None),
+                  ('job-live', 'running', agora.isoformat(), agora.isoformat(), None),
+                  ('job-old', 'completed', antigo, antigo, antigo)])
+            bd.commit()
+
+            # Polling a lost job closes it, and only it
+            assert obter_tarefa(bd, 'job-live')['status'] == 'running'
+            tarefa = obter_tarefa(bd, 'job-polled')
+            assert (tarefa['status'], tarefa['error']) == ('failed', ERRO_TAREFA_INTERROMPIDA)
+            assert bd.execute("SELECT status FROM background_jobs WHERE id = 'job-lost'").fetchone()[0] == 'running'
+
+        assert purgar_registos_expirados('smartlamppost')['background_jobs'] >= 1
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            estados = {r['id']: (r['status'], r['error']) for r in bd.execute(
+                "SELECT id, status, error FROM background_jobs WHERE job_type = 'test'")}
+            assert estados == {'job-lost': ('failed', ERRO_TAREFA_INTERROMPIDA),
+                               'job-polled': ('failed', ERRO_TAREFA_INTERROMPIDA),
+                               'job-live': ('running', None)}
+            bd.execute("DELETE FROM background_jobs WHERE job_type = 'test'")
+            bd.commit()
+
+    def test_long_queued_job_still_runs(self, app):
+        """Test a job queued behind long jobs is not taken as lost and still runs."""
+        from datetime import datetime, timedelta
+        from app.shared.database import obter_bd
+        from app.shared.jobs import (
+            _executar, obter_tarefa, marcar_tarefas_interrompidas, JOB_QUEUED_STALE_MINUTES
+        )
+        agora = datetime.now()
+        em_fila = (agora - timedelta(hours=2)).isoformat()
+        abandonada = (agora - timedelta(minutes=JOB_QUEUED_STALE_MINUTES + 1)).isoformat()
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            bd.executemany('''
+                INSERT INTO background_jobs (id, job_type, status, created_at, updated_at)
+                VALUES (?, 'test', 'queued', ?, ?)
+            ''', [('job-waiting', em_fila, em_fila), ('job-abandoned', abandonada, abandonada)])
+            bd.commit()
+            assert marcar_tarefas_interrompidas(bd) == 1
+            assert obter_tarefa(bd, 'job-waiting')['status'] == 'queued'
+            assert obter_tarefa(bd, 'job-abandoned')['status'] == 'failed'
+
+        _executar(app, 'smartlamppost', 'job-waiting', lambda bd, job_id: {'ok': True}, ())
+        with app.app_context():
+            bd = obter_bd('smartlamppost')
+            tarefa = obter_tarefa(bd, 'job-waiting')
+            assert (tarefa['status'], tarefa['result']) == ('completed', {'ok': True})
+            bd.execute("DELETE FROM background_jobs WHERE job_type = 'test'")
+            bd.commit()
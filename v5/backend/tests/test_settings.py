@@ -53,6 +53,18 @@ class TestAuditLog:
         response = client.get('/api/settings/audit-log?action=create&limit=10', headers=superadmin_headers)
         assert response.status_code == 200
 
+    def test_get_audit_log_with_cursor(self, client, superadmin_headers):
+        """Test keyset pagination of the audit log."""
+        response = client.get('/api/settings/audit-log?after=&per_page=1&total=exact',
+                              headers=superadmin_headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data['entries']) <= 1
+        if data['total'] > 1:
+            following = client.get(f"/api/settings/audit-log?after={data['next_cursor']}&per_page=1",
+                                   headers=superadmin_headers).get_json()
+            assert following['entries'][0]['id'] != data['entries'][0]['id']
+
     def test_get_audit_log_unauthenticated(self, client):
         """Test getting audit log without authentication."""
         response = client.get('/api/settings/audit-log')
@@ -181,3 +193,21 @@ class TestConfigLists:
         """Test getting a specific configurable list."""
         response = client.get('/api/settings/lists/materials', headers=superadmin_headers)
         assert response.status_code in [200, 404]
+
+
+class TestDatabaseStats:
+    """Tests for database diagnostics."""
+
+    def test_get_database_stats(self, client, superadmin_headers):
+        """Test superadmin can read pool and translation statistics."""
+        response = client.get('/api/settings/database/stats', headers=superadmin_headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['mode'] == 'sqlite'
+        assert 'created' in data['sqlite_pool']
+        assert 'hits' in data['sql_translation']
+
+    def test_database_stats_forbidden_for_admin(self, client, admin_headers):
+        """Test admin cannot read database statistics."""
+        response = client.get('/api/settings/database/stats', headers=admin_headers)
+        assert response.status_code == 403